@@ -0,0 +1,43 @@
+import argparse
+import asyncio
+
+import config
+from services.archive_service import archive_old_conversations
+from utils.logger import logger
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Roll up old conversations into summary documents and move raw messages to the archive."
+    )
+    parser.add_argument(
+        "--older-than-days", type=int, default=config.ARCHIVE_AFTER_DAYS, help="Archive messages older than this"
+    )
+    parser.add_argument(
+        "--max-conversations", type=int, default=config.ARCHIVE_BATCH_SIZE, help="Conversations per pass"
+    )
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=0,
+        help=f"Keep running, one pass every N seconds (e.g. {config.ARCHIVE_INTERVAL_SECONDS}); 0 runs until caught up",
+    )
+    return parser.parse_args()
+
+
+async def run(args):
+    while True:
+        # Drain the backlog in passes of --max-conversations. A pass that archived fewer (the rest failed
+        # or nothing was left) ends it, so conversations that keep failing are retried on the next run only
+        while True:
+            result = await archive_old_conversations(args.older_than_days, args.max_conversations)
+            if result["conversations"] < args.max_conversations:
+                break
+        if not args.interval:
+            return
+        logger.info("Next archiving pass in %s seconds", args.interval)
+        await asyncio.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,73 @@
+import argparse
+import json
+
+import config
+from database.mongodb import VECTOR_SEARCH_INDEXES
+from services.recall_benchmark_service import DEFAULT_MULTIPLIERS, recommend, run_benchmark, save_report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Measure the recall and latency of a vector search index against exact brute-force search, for "
+            "a range of numCandidates, grouped by how many documents users have."
+        )
+    )
+    parser.add_argument("--collection", choices=sorted(VECTOR_SEARCH_INDEXES), default=config.MEMORY_NODES_COLLECTION)
+    parser.add_argument("--users", type=int, default=20, help="Random users to sample")
+    parser.add_argument("--user-id", action="append", dest="user_ids", help="Benchmark this user instead of sampling (repeatable)")
+    parser.add_argument("--min-documents", type=int, default=0, help="Only sample users with at least this many documents")
+    parser.add_argument("--queries", type=int, default=10, help="Stored vectors per user used as queries")
+    parser.add_argument("--limit", type=int, default=10, help="Results per search (k of recall@k)")
+    parser.add_argument(
+        "--multipliers", default=",".join(map(str, DEFAULT_MULTIPLIERS)),
+        help="numCandidates to try, as comma-separated multiples of --limit",
+    )
+    parser.add_argument("--target-recall", type=float, default=config.VECTOR_SEARCH_TARGET_RECALL)
+    parser.add_argument("--save", action="store_true", help="Record the results for VECTOR_SEARCH_CANDIDATES=auto")
+    parser.add_argument("--json", action="store_true", help="Print the full report as JSON")
+    return parser.parse_args()
+
+
+def print_report(report, target_recall):
+    recommendations = recommend(report, target_recall)
+    print(f"{report['collection']} in {report['space']['field']} ({report['space']['model_id']}), recall@{report['limit']}")
+    for bucket in report["buckets"]:
+        bound = bucket["max_documents"]
+        size = f"<= {bound}" if bound is not None else f"> {max(b['max_documents'] or 0 for b in report['buckets'])}"
+        print(f"\nUsers with {size} documents: {bucket['users']} users, {bucket['queries']} queries")
+        print(f"  {'setting':>8} {'numCandidates':>13} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8}")
+        for setting in bucket["settings"]:
+            print(
+                f"  {setting['setting']:>8} {setting['num_candidates'] or '-':>13} {setting['recall']:>7.3f} "
+                f"{setting['latency_p50_ms']:>8.1f} {setting['latency_p95_ms']:>8.1f}"
+            )
+        multiplier = recommendations[bound]
+        if multiplier is None:
+            print(f"  No multiplier reaches recall {target_recall}; try larger ones or exact search")
+        else:
+            print(f"  Smallest multiplier reaching recall {target_recall}: {multiplier}")
+
+
+def main():
+    args = parse_args()
+    report = run_benchmark(
+        args.collection,
+        users=args.users,
+        queries=args.queries,
+        limit=args.limit,
+        multipliers=[int(value) for value in args.multipliers.split(",")],
+        user_ids=args.user_ids,
+        min_documents=args.min_documents,
+    )
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report, args.target_recall)
+    if args.save:
+        save_report(report)
+        print(f"\nSaved as the calibration of {args.collection}")
+
+
+if __name__ == "__main__":
+    main()
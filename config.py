@@ -5,10 +5,29 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Constants
-MAX_DEPTH = 5
+MAX_DEPTH = 5  # Maximum number of cluster levels above the leaf memories in a user's memory tree
 SIMILARITY_THRESHOLD = 0.7
 DECAY_FACTOR = 0.99
 REINFORCEMENT_FACTOR = 1.1
+# "time": importance decays lazily with elapsed time since last reinforcement, computed at read time
+# "eager": every new memory multiplies the importance of all other memories by DECAY_FACTOR
+DECAY_MODEL = os.getenv("DECAY_MODEL", "time").lower()
+DECAY_HALF_LIFE_DAYS = float(os.getenv("DECAY_HALF_LIFE_DAYS", "30"))
+# Ranking of similar memories: vector search over-fetches top_n * MEMORY_RANK_CANDIDATE_MULTIPLIER leaves, which
+# are re-ranked inside the aggregation by a weighted sum of similarity, effective importance and recency
+MEMORY_RANK_CANDIDATE_MULTIPLIER = int(os.getenv("MEMORY_RANK_CANDIDATE_MULTIPLIER", "5"))
+MEMORY_RANK_SIMILARITY_WEIGHT = float(os.getenv("MEMORY_RANK_SIMILARITY_WEIGHT", "0.7"))
+MEMORY_RANK_IMPORTANCE_WEIGHT = float(os.getenv("MEMORY_RANK_IMPORTANCE_WEIGHT", "0.2"))
+MEMORY_RANK_RECENCY_WEIGHT = float(os.getenv("MEMORY_RANK_RECENCY_WEIGHT", "0.1"))
+MEMORY_RANK_RECENCY_HALF_LIFE_DAYS = float(os.getenv("MEMORY_RANK_RECENCY_HALF_LIFE_DAYS", "7"))
+SIMILAR_MEMORIES_TOP_N = int(os.getenv("SIMILAR_MEMORIES_TOP_N", "3"))  # Default `top_n` of /retrieve_memory/
+SIMILAR_MEMORIES_MAX_TOP_N = 50
+
+# Memory tree: leaf memories are grouped under cluster nodes holding centroid embeddings and summaries
+MAX_MEMORIES_PER_USER = int(os.getenv("MAX_MEMORIES_PER_USER", "10000"))
+MEMORY_TREE_BRANCHING = int(os.getenv("MEMORY_TREE_BRANCHING", "32"))  # Children per node before it splits
+MEMORY_TREE_BEAM_WIDTH = int(os.getenv("MEMORY_TREE_BEAM_WIDTH", "3"))  # Clusters descended into per level
+MEMORY_TREE_SUMMARY_REFRESH = int(os.getenv("MEMORY_TREE_SUMMARY_REFRESH", "8"))  # Inserts before a cluster summary is regenerated
 
 # Application settings
 APP_NAME = "AI-Memory-Service"
@@ -20,10 +39,70 @@ DEBUG = os.getenv("DEBUG", "False").lower() == "true"
 SERVICE_HOST = os.getenv("SERVICE_HOST", "0.0.0.0")
 SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8182"))
 
+# Logging: records are handed to a background thread through a bounded queue and formatted there
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # "text" or "json"
+LOG_ASYNC = os.getenv("LOG_ASYNC", "True").lower() == "true"  # False writes from the calling thread
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # Records beyond this are dropped and counted
+LOG_MAX_MESSAGE_LENGTH = int(os.getenv("LOG_MAX_MESSAGE_LENGTH", "2000"))  # Longer messages and tracebacks are truncated
+# Per-logger "name=value" lists, e.g. "services.retrieval_service=0.1,*=1". Names are relative to the app
+# logger (or absolute, e.g. uvicorn.access when started through main.py); the longest matching name applies and "*" matches any logger
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")  # Fraction of records below WARNING kept
+LOG_RATE_LIMITS = os.getenv("LOG_RATE_LIMITS", "")  # Records per second, all levels
+
 # AWS Configuration
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 EMBEDDING_MODEL_ID = os.getenv("EMBEDDING_MODEL_ID", "amazon.titan-embed-text-v1")
+# Output size of the embedding model: 1536 for Titan v1, 256, 512 or 1024 for Titan v2. Both only apply to
+# a new deployment; afterwards the active embedding space is changed with migrate_embeddings.py
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))
 LLM_MODEL_ID = os.getenv("LLM_MODEL_ID", "us.anthropic.claude-3-7-sonnet-20250219-v1:0")
+# Hedging of the query embedding of retrievals: if it is still running after the given latency percentile of
+# recent calls, a second identical request is sent and whichever finishes first is used. Writes, summaries and
+# archiving are never hedged
+BEDROCK_HEDGE_ENABLED = os.getenv("BEDROCK_HEDGE_ENABLED", "False").lower() == "true"
+BEDROCK_HEDGE_PERCENTILE = float(os.getenv("BEDROCK_HEDGE_PERCENTILE", "95"))
+BEDROCK_HEDGE_MIN_SAMPLES = int(os.getenv("BEDROCK_HEDGE_MIN_SAMPLES", "20"))
+# Prompt caching: the shared system prompt and the static instructions of LLM prompts end with Converse cache
+# points, so Bedrock reuses their processed prefix (only prefixes of 1024+ tokens are cached). Disable for models
+# without prompt caching support
+BEDROCK_PROMPT_CACHING_ENABLED = os.getenv("BEDROCK_PROMPT_CACHING_ENABLED", "True").lower() == "true"
+
+# Latency budget for /retrieve_memory/; callers may pass a smaller or larger `timeout`
+RETRIEVE_MEMORY_TIMEOUT_SECONDS = float(os.getenv("RETRIEVE_MEMORY_TIMEOUT_SECONDS", "10"))
+RETRIEVE_BATCH_MAX_QUERIES = int(os.getenv("RETRIEVE_BATCH_MAX_QUERIES", "32"))  # Queries per POST /retrieve_memory/batch
+
+# Per-user semantic cache of /retrieve_memory/ results (per process, invalidated across processes through
+# USER_VERSIONS_COLLECTION)
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "True").lower() == "true"
+SEMANTIC_CACHE_MAX_DISTANCE = float(os.getenv("SEMANTIC_CACHE_MAX_DISTANCE", "0.05"))  # Cosine distance
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "60"))
+SEMANTIC_CACHE_MAX_ENTRIES_PER_USER = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES_PER_USER", "32"))
+SEMANTIC_CACHE_MAX_USERS = int(os.getenv("SEMANTIC_CACHE_MAX_USERS", "10000"))
+
+# Admission control (per process): requests beyond the concurrency limits wait in a bounded queue for up to
+# ADMISSION_MAX_WAIT_SECONDS, anything more is rejected with 429 and Retry-After. Ingestion (POST /conversation/)
+# and retrieval (/retrieve_memory/) have separate limits, so heavy ingestion cannot starve reads
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "True").lower() == "true"
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "2"))
+INGEST_MAX_CONCURRENT = int(os.getenv("INGEST_MAX_CONCURRENT", "32"))
+INGEST_MAX_PER_USER = int(os.getenv("INGEST_MAX_PER_USER", "4"))  # Running or waiting requests per user
+INGEST_MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", "64"))
+RETRIEVE_MAX_CONCURRENT = int(os.getenv("RETRIEVE_MAX_CONCURRENT", "64"))
+RETRIEVE_MAX_PER_USER = int(os.getenv("RETRIEVE_MAX_PER_USER", "8"))
+RETRIEVE_MAX_QUEUE = int(os.getenv("RETRIEVE_MAX_QUEUE", "128"))
+
+# Token required by /admin endpoints (X-Admin-Token header); admin endpoints are disabled when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Sampling request profiler: a fraction of requests (plus requests sent with an `X-Profile: <ADMIN_TOKEN>`
+# header) record a statistical profile, served from /admin/profiles and optionally written to files
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))  # 0 disables sampling
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+PROFILING_MAX_CONCURRENT = int(os.getenv("PROFILING_MAX_CONCURRENT", "2"))  # Requests profiled at once
+PROFILING_MAX_SECONDS = float(os.getenv("PROFILING_MAX_SECONDS", "30"))  # Sampling stops after this per request
+PROFILING_MAX_PROFILES = int(os.getenv("PROFILING_MAX_PROFILES", "100"))  # Profiles kept in memory and on disk
+PROFILING_OUTPUT_DIR = os.getenv("PROFILING_OUTPUT_DIR", "")  # Also write .collapsed files here when set
 
 # MongoDB Configuration
 MONGODB_URI = os.getenv("MONGODB_URI")
@@ -32,4 +111,77 @@ CONVERSATIONS_COLLECTION = "conversations"
 MEMORY_NODES_COLLECTION = "memory_nodes"
 CONVERSATIONS_VECTOR_SEARCH_INDEX_NAME = "conversations_vector_search_index"
 CONVERSATIONS_FULLTEXT_SEARCH_INDEX_NAME = "conversations_fulltext_search_index"
-MEMORY_NODES_VECTOR_SEARCH_INDEX_NAME = "memory_nodes_vector_search_index"
\ No newline at end of file
+MEMORY_NODES_VECTOR_SEARCH_INDEX_NAME = "memory_nodes_vector_search_index"
+REEMBED_CHECKPOINTS_COLLECTION = "reembed_checkpoints"
+CONVERSATION_ROLLUPS_COLLECTION = "conversation_rollups"
+CONVERSATION_ARCHIVE_COLLECTION = "conversation_archive"
+CONVERSATION_SUMMARIES_COLLECTION = "conversation_summaries"
+INGEST_REQUESTS_COLLECTION = "ingest_requests"
+INGEST_CHECKPOINTS_COLLECTION = "ingest_checkpoints"
+CONVERSATION_ROLLUPS_VECTOR_SEARCH_INDEX_NAME = "conversation_rollups_vector_search_index"
+EMBEDDING_SETTINGS_COLLECTION = "embedding_settings"
+EMBEDDING_SETTINGS_REFRESH_SECONDS = float(os.getenv("EMBEDDING_SETTINGS_REFRESH_SECONDS", "30"))  # Delay before processes see a cutover
+SEARCH_TUNING_COLLECTION = "search_tuning"
+# Per-user write counters; part of the semantic cache key, so a write in any process retires cached results
+USER_VERSIONS_COLLECTION = "user_versions"
+
+# Vector search candidates: "fixed" keeps the numCandidates of each search; "auto" searches users with few
+# documents exactly and gives the others as many candidates as their size needs to reach the target recall,
+# according to the calibration recorded by benchmark_recall.py --save
+VECTOR_SEARCH_CANDIDATES = os.getenv("VECTOR_SEARCH_CANDIDATES", "fixed").lower()
+VECTOR_SEARCH_TARGET_RECALL = float(os.getenv("VECTOR_SEARCH_TARGET_RECALL", "0.95"))
+VECTOR_SEARCH_EXACT_MAX_DOCUMENTS = int(os.getenv("VECTOR_SEARCH_EXACT_MAX_DOCUMENTS", "2000"))  # Users searched exactly
+VECTOR_SEARCH_CANDIDATE_MULTIPLIER = int(os.getenv("VECTOR_SEARCH_CANDIDATE_MULTIPLIER", "20"))  # Candidates per result until calibrated
+VECTOR_SEARCH_TUNING_REFRESH_SECONDS = float(os.getenv("VECTOR_SEARCH_TUNING_REFRESH_SECONDS", "300"))  # Document counts are reused this long
+VECTOR_SEARCH_TUNING_MAX_USERS = int(os.getenv("VECTOR_SEARCH_TUNING_MAX_USERS", "10000"))  # Users whose document counts are kept
+
+# Read routing: "operation=mode" list of read preferences, e.g. "search=secondaryPreferred,memory=nearest".
+# Operations: search (hybrid search), memory (similar memories), context (conversation context), summary
+# (rolling summaries); unlisted operations and all writes go to the primary
+READ_PREFERENCES = os.getenv("READ_PREFERENCES", "")
+READ_MAX_STALENESS_SECONDS = int(os.getenv("READ_MAX_STALENESS_SECONDS", "-1"))  # -1 for no limit, otherwise at least 90
+# Per-user causally consistent sessions give read-your-writes on secondaries (per process)
+CAUSAL_CONSISTENCY_ENABLED = os.getenv("CAUSAL_CONSISTENCY_ENABLED", "True").lower() == "true"
+CAUSAL_SESSION_MAX_USERS = int(os.getenv("CAUSAL_SESSION_MAX_USERS", "10000"))  # Users whose latest write time is kept
+
+# Conversation tiering: hot messages older than ARCHIVE_AFTER_DAYS are rolled up and archived
+CONVERSATION_TTL_DAYS = int(os.getenv("CONVERSATION_TTL_DAYS", "30"))
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "7"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "50"))  # Conversations per archiving pass
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+# Layout of the archive, applied when it is created: "standard", or "timeseries" for a MongoDB time-series
+# collection (timeField `timestamp`, metaField `conversation` holding the user and conversation ids)
+CONVERSATION_ARCHIVE_LAYOUT = os.getenv("CONVERSATION_ARCHIVE_LAYOUT", "standard").lower()
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "0"))  # Archived messages expire after this; 0 keeps them
+# Per-user snapshots (snapshot.py, /admin/snapshot): vectors are stored as "float16" or "int8" (one float32
+# scale per vector), documents in zlib-compressed frames of SNAPSHOT_BATCH_SIZE, restored with unordered inserts
+SNAPSHOT_VECTOR_ENCODING = os.getenv("SNAPSHOT_VECTOR_ENCODING", "float16").lower()
+SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", "1000"))
+SNAPSHOT_COMPRESSION_LEVEL = int(os.getenv("SNAPSHOT_COMPRESSION_LEVEL", "6"))
+# Idempotent ingestion: retried POST /conversation/ requests return the original result
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 60 * 60)))
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "120"))  # Unrenewed for this long, an unfinished request may be taken over
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))  # How long a duplicate waits for the original
+
+# Ingestion: "inline" embeds each message and consolidates memories inside POST /conversation/; "worker" only
+# stores the raw message and leaves that to worker.py processes tailing the conversations change stream
+INGEST_MODE = os.getenv("INGEST_MODE", "inline").lower()
+INGEST_WORKER_CONCURRENCY = int(os.getenv("INGEST_WORKER_CONCURRENCY", "8"))  # Messages enriched at once per worker, one at a time per user
+INGEST_WORKER_MAX_RETRIES = int(os.getenv("INGEST_WORKER_MAX_RETRIES", "3"))
+INGEST_CHECKPOINT_INTERVAL_SECONDS = float(os.getenv("INGEST_CHECKPOINT_INTERVAL_SECONDS", "5"))  # Resume token persistence
+INGEST_RESCAN_INTERVAL_SECONDS = float(os.getenv("INGEST_RESCAN_INTERVAL_SECONDS", "300"))  # Retry messages left unenriched
+
+# Rolling conversation summaries, maintained off the ingest path
+ROLLING_SUMMARY_MAX_MESSAGES = int(os.getenv("ROLLING_SUMMARY_MAX_MESSAGES", "50"))  # New messages folded in per LLM call
+# Messages up to this much older than the newest one summarized are read again, so one committed late (or
+# with a slightly earlier timestamp) is still folded in; ids of those already folded in are skipped
+ROLLING_SUMMARY_LOOKBACK_SECONDS = float(os.getenv("ROLLING_SUMMARY_LOOKBACK_SECONDS", "300"))
+
+HYBRID_SEARCH_INCLUDE_ROLLUPS = os.getenv("HYBRID_SEARCH_INCLUDE_ROLLUPS", "False").lower() == "true"
+
+# Re-embedding / backfill settings
+REEMBED_BATCH_SIZE = int(os.getenv("REEMBED_BATCH_SIZE", "100"))
+REEMBED_CONCURRENCY = int(os.getenv("REEMBED_CONCURRENCY", "8"))
+REEMBED_RATE_LIMIT = float(os.getenv("REEMBED_RATE_LIMIT", "20"))  # Embedding requests per second, 0 disables
+REEMBED_MAX_RETRIES = int(os.getenv("REEMBED_MAX_RETRIES", "5"))
+EMBEDDING_INDEX_READY_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_INDEX_READY_TIMEOUT_SECONDS", "3600"))  # Cutover waits this long for new indexes
\ No newline at end of file
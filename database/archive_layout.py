@@ -0,0 +1,42 @@
+from config import CONVERSATION_ARCHIVE_COLLECTION
+from database.mongodb import ARCHIVE_META_FIELD, db
+
+# Layout of the existing archive collection, read once it exists
+_timeseries = None
+
+
+def archive_is_timeseries():
+    """
+    Whether the archive is a time-series collection. Taken from the collection itself rather than from
+    CONVERSATION_ARCHIVE_LAYOUT, which only applies when the archive is created
+    """
+    global _timeseries
+    if _timeseries is None:
+        if CONVERSATION_ARCHIVE_COLLECTION not in db.list_collection_names():
+            return False
+        _timeseries = "timeseries" in db[CONVERSATION_ARCHIVE_COLLECTION].options()
+    return _timeseries
+
+
+def to_archive_document(message):
+    """Archive form of a message: in the time-series layout its user and conversation ids move to the metaField"""
+    if not archive_is_timeseries():
+        return message
+    doc = dict(message)
+    doc[ARCHIVE_META_FIELD] = {"user_id": doc.pop("user_id"), "conversation_id": doc.pop("conversation_id")}
+    return doc
+
+
+def from_archive_document(doc):
+    """Archived message in the shape of a `conversations` document"""
+    meta = doc.pop(ARCHIVE_META_FIELD, None)
+    if meta is not None:
+        doc.update(meta)
+    return doc
+
+
+def archive_filter(user_id, conversation_id):
+    """Query for the archived messages of a conversation, in either layout"""
+    if archive_is_timeseries():
+        return {f"{ARCHIVE_META_FIELD}.user_id": user_id, f"{ARCHIVE_META_FIELD}.conversation_id": conversation_id}
+    return {"user_id": user_id, "conversation_id": conversation_id}
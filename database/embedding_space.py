@@ -0,0 +1,157 @@
+import time
+import datetime
+import threading
+from config import (
+    EMBEDDING_MODEL_ID, EMBEDDING_DIMENSIONS, EMBEDDING_SETTINGS_REFRESH_SECONDS
+)
+from database.mongodb import embedding_settings
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+SETTINGS_ID = "embeddings"
+# Output sizes of models whose dimensions are configurable; other models have a single fixed size
+CONFIGURABLE_DIMENSIONS = {
+    "amazon.titan-embed-text-v2": (256, 512, 1024),
+}
+FIXED_DIMENSIONS = {
+    "amazon.titan-embed-text-v1": 1536,
+}
+
+
+def model_family(model_id):
+    """Model id without its version suffix, e.g. amazon.titan-embed-text-v2 for amazon.titan-embed-text-v2:0"""
+    return model_id.split(":")[0]
+
+
+def supported_dimensions(model_id):
+    """Output sizes a model can be asked for, None when the request cannot choose one"""
+    return CONFIGURABLE_DIMENSIONS.get(model_family(model_id))
+
+
+class EmbeddingSpace:
+    """Where stored vectors live (document field) and how they are produced (model and dimensions)"""
+
+    def __init__(self, field, model_id, dimensions):
+        choices = supported_dimensions(model_id)
+        fixed = FIXED_DIMENSIONS.get(model_family(model_id))
+        if choices is not None and dimensions not in choices:
+            raise ValueError(f"{model_id} supports {choices} dimensions, not {dimensions}")
+        if fixed is not None and dimensions != fixed:
+            raise ValueError(f"{model_id} always produces {fixed} dimensions, not {dimensions}")
+        self.field = field
+        self.model_id = model_id
+        self.dimensions = dimensions
+
+    @property
+    def sum_field(self):
+        """Field holding the leaf vector sums of memory tree clusters"""
+        return "embedding_sum" if self.field == "embeddings" else f"{self.field}_sum"
+
+    def index_name(self, base_name):
+        """Vector search index over this space's field; the original field keeps the original names"""
+        return base_name if self.field == "embeddings" else f"{base_name}_{self.field}"
+
+    def to_dict(self):
+        return {"field": self.field, "model_id": self.model_id, "dimensions": self.dimensions}
+
+    @classmethod
+    def from_dict(cls, doc):
+        return cls(doc["field"], doc["model_id"], doc["dimensions"])
+
+    def __eq__(self, other):
+        return isinstance(other, EmbeddingSpace) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"EmbeddingSpace({self.field!r}, {self.model_id!r}, {self.dimensions})"
+
+
+def configured_space():
+    """Space described by EMBEDDING_MODEL_ID and EMBEDDING_DIMENSIONS, stored in `embeddings`"""
+    return EmbeddingSpace("embeddings", EMBEDDING_MODEL_ID, EMBEDDING_DIMENSIONS)
+
+
+class EmbeddingSettings:
+    """
+    Process-wide view of the `embedding_settings` document: the active space reads and writes use, the
+    space a migration is backfilling (written alongside the active one) and the retired spaces whose
+    vectors are still stored.
+    Re-read every EMBEDDING_SETTINGS_REFRESH_SECONDS, so a cutover reaches every process within that time.
+    """
+
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self._doc = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _current(self):
+        now = time.monotonic()
+        if self._doc is None or now - self._loaded_at >= self.refresh_seconds:
+            with self._lock:
+                if self._doc is None or now - self._loaded_at >= self.refresh_seconds:
+                    self._doc = embedding_settings.find_one({"_id": SETTINGS_ID}) or {
+                        "active": configured_space().to_dict()
+                    }
+                    self._loaded_at = now
+        return self._doc
+
+    def invalidate(self):
+        self._doc = None
+
+    def active(self):
+        return EmbeddingSpace.from_dict(self._current()["active"])
+
+    def retired(self):
+        return [EmbeddingSpace.from_dict(doc) for doc in self._current().get("retired", [])]
+
+    def migration(self):
+        doc = self._current().get("migration")
+        return EmbeddingSpace.from_dict(doc) if doc else None
+
+    def vector_fields(self):
+        """Every field that may hold vectors, for projections that leave them out"""
+        doc = self._current()
+        fields = [doc["active"]["field"]] + [space["field"] for space in doc.get("retired", [])]
+        if doc.get("migration"):
+            fields.append(doc["migration"]["field"])
+        return fields
+
+    def initialize(self):
+        """Record the configured space as the active one on first start, and warn when they diverge later"""
+        embedding_settings.update_one(
+            {"_id": SETTINGS_ID},
+            {
+                "$setOnInsert": {
+                    "active": configured_space().to_dict(),
+                    "migration": None,
+                    "retired": [],
+                    "updated_at": datetime.datetime.now(datetime.timezone.utc),
+                }
+            },
+            upsert=True,
+        )
+        self.invalidate()
+        active = self.active()
+        configured = configured_space()
+        if (active.model_id, active.dimensions) != (configured.model_id, configured.dimensions):
+            logger.warning(
+                "EMBEDDING_MODEL_ID/EMBEDDING_DIMENSIONS (%s, %s) differ from the active embedding space %s; "
+                "stored vectors only change through migrate_embeddings.py",
+                configured.model_id, configured.dimensions, active,
+            )
+        return active
+
+
+settings = EmbeddingSettings(EMBEDDING_SETTINGS_REFRESH_SECONDS)
+
+
+def active_space():
+    """Embedding space searches query and new documents are written in"""
+    return settings.active()
+
+
+def vector_projection():
+    """Projection excluding every stored vector field"""
+    return {field: 0 for field in settings.vector_fields()}
+
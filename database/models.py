@@ -1,15 +1,24 @@
 import datetime
+import hashlib
 from fastapi import HTTPException
-from services.bedrock_service import generate_embedding
+from database.embedding_space import active_space
+from services.bedrock_service import generate_embedding, migration_embeddings
+
+def user_hash(user_id):
+    """Stable non-negative 32-bit hash of a user id, used to partition users between ingestion workers"""
+    return int.from_bytes(hashlib.sha256(user_id.encode("utf-8")).digest()[:4], "big")
 
 class Message:
-    def __init__(self, message_data):
+    def __init__(self, message_data, embed=True):
         self.user_id = message_data.user_id.strip()
         self.conversation_id = message_data.conversation_id.strip()
         self.type = message_data.type
         self.text = message_data.text.strip()
         self.timestamp = self.parse_timestamp(message_data.timestamp)
-        self.embeddings = generate_embedding(self.text)
+        # Vectors by field: the active embedding space's, plus a migration target's while one runs
+        self.vectors = (
+            {active_space().field: generate_embedding(self.text), **migration_embeddings(self.text)} if embed else None
+        )
         
     def parse_timestamp(self, timestamp):
         if timestamp:
@@ -20,11 +29,17 @@ class Message:
         return datetime.datetime.now(datetime.timezone.utc)
         
     def to_dict(self):
-        return {
+        doc = {
             "user_id": self.user_id,
+            "user_hash": user_hash(self.user_id),
             "conversation_id": self.conversation_id,
             "type": self.type,
             "text": self.text,
             "timestamp": self.timestamp,
-            "embeddings": self.embeddings,
-        }
\ No newline at end of file
+        }
+        if self.vectors is not None:
+            doc.update(self.vectors)
+        else:
+            # Picked up by the ingestion workers
+            doc["enrichment"] = "pending"
+        return doc
\ No newline at end of file
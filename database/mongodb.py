@@ -3,62 +3,203 @@ import pymongo.errors
 from config import (
     MONGODB_URI, MONGODB_DB_NAME, CONVERSATIONS_COLLECTION, MEMORY_NODES_COLLECTION,
     CONVERSATIONS_VECTOR_SEARCH_INDEX_NAME, CONVERSATIONS_FULLTEXT_SEARCH_INDEX_NAME,
-    MEMORY_NODES_VECTOR_SEARCH_INDEX_NAME
+    MEMORY_NODES_VECTOR_SEARCH_INDEX_NAME, REEMBED_CHECKPOINTS_COLLECTION,
+    CONVERSATION_ROLLUPS_COLLECTION, CONVERSATION_ARCHIVE_COLLECTION, CONVERSATION_ARCHIVE_LAYOUT, ARCHIVE_RETENTION_DAYS,
+    CONVERSATION_ROLLUPS_VECTOR_SEARCH_INDEX_NAME, CONVERSATION_TTL_DAYS,
+    CONVERSATION_SUMMARIES_COLLECTION, INGEST_REQUESTS_COLLECTION, IDEMPOTENCY_TTL_SECONDS,
+    INGEST_CHECKPOINTS_COLLECTION, EMBEDDING_SETTINGS_COLLECTION, EMBEDDING_DIMENSIONS, SEARCH_TUNING_COLLECTION,
+    USER_VERSIONS_COLLECTION
 )
-from utils.logger import logger
+from database.read_routing import SessionCollection, causal_session, current_session, for_reads, read_metrics
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
 # Create a MongoDB client
-client = pymongo.MongoClient(MONGODB_URI)
+client = pymongo.MongoClient(MONGODB_URI, event_listeners=[read_metrics])
+read_metrics.client = client
 
-# Access the specified database and collections
+# Access the specified database and collections; operations on them join the caller's user session, if any
 db = client[MONGODB_DB_NAME]
-conversations = db[CONVERSATIONS_COLLECTION]
-memory_nodes = db[MEMORY_NODES_COLLECTION]
+conversations = SessionCollection(db[CONVERSATIONS_COLLECTION])
+memory_nodes = SessionCollection(db[MEMORY_NODES_COLLECTION])
+reembed_checkpoints = db[REEMBED_CHECKPOINTS_COLLECTION]
+conversation_rollups = SessionCollection(db[CONVERSATION_ROLLUPS_COLLECTION])
+conversation_archive = SessionCollection(db[CONVERSATION_ARCHIVE_COLLECTION])
+conversation_summaries = SessionCollection(db[CONVERSATION_SUMMARIES_COLLECTION])
+ingest_requests = db[INGEST_REQUESTS_COLLECTION]
+ingest_checkpoints = db[INGEST_CHECKPOINTS_COLLECTION]
+embedding_settings = db[EMBEDDING_SETTINGS_COLLECTION]
+search_tuning = db[SEARCH_TUNING_COLLECTION]
+user_versions = SessionCollection(db[USER_VERSIONS_COLLECTION])
+
+# metaField of a time-series archive, holding the user and conversation ids of each message
+ARCHIVE_META_FIELD = "conversation"
+
+def user_session(user_id):
+    """Causally consistent session of a user for the enclosed MongoDB operations, see `causal_session`"""
+    return causal_session(client, user_id)
+
+def union_aggregate(collection_name, pipelines, operation=None):
+    """
+    Run several pipelines over a collection in one aggregation round trip. Each pipeline runs in its own
+    $unionWith branch, so each may start with $search or $vectorSearch.
+
+    Returns:
+        One list of result documents per pipeline, in order
+    """
+    results = [[] for _ in pipelines]
+    if not pipelines:
+        return results
+    pipeline = [{"$documents": []}] + [
+        {
+            "$unionWith": {
+                "coll": collection_name,
+                "pipeline": branch + [{"$addFields": {"_branch": index}}],
+            }
+        }
+        for index, branch in enumerate(pipelines)
+    ]
+    database = for_reads(db, operation) if operation else db
+    for doc in database.aggregate(pipeline, session=current_session()):
+        results[doc.pop("_branch")].append(doc)
+    return results
+
+# Fields memory node vector searches pre-filter on: the user, the tree position of a node, and the
+# source conversation and creation time of a memory (see SearchScope)
+MEMORY_NODES_FILTER_FIELDS = ("user_id", "level", "parent_id", "conversation_id", "timestamp")
+# Fields message and rollup searches pre-filter on: the user, and the scope of a retrieval
+CONVERSATIONS_FILTER_FIELDS = ("user_id", "conversation_id", "type", "timestamp")
+CONVERSATION_ROLLUPS_FILTER_FIELDS = ("user_id", "conversation_id", "first_timestamp", "last_timestamp")
+
+# Vector search indexes per collection: base index name and pre-filter fields. Each embedding space gets
+# its own index per collection, see EmbeddingSpace.index_name
+VECTOR_SEARCH_INDEXES = {
+    CONVERSATIONS_COLLECTION: (CONVERSATIONS_VECTOR_SEARCH_INDEX_NAME, CONVERSATIONS_FILTER_FIELDS),
+    MEMORY_NODES_COLLECTION: (MEMORY_NODES_VECTOR_SEARCH_INDEX_NAME, MEMORY_NODES_FILTER_FIELDS),
+    CONVERSATION_ROLLUPS_COLLECTION: (CONVERSATION_ROLLUPS_VECTOR_SEARCH_INDEX_NAME, CONVERSATION_ROLLUPS_FILTER_FIELDS),
+}
+
+def vector_search_index_definition(path="embeddings", num_dimensions=EMBEDDING_DIMENSIONS, filter_fields=("user_id",)):
+    """Build an Atlas vector search index definition over `path` with the given pre-filter fields"""
+    return {
+        "fields": [
+            {
+                "type": "vector",
+                "path": path,
+                "numDimensions": num_dimensions,
+                "similarity": "cosine",
+            },
+        ]
+        + [{"type": "filter", "path": field} for field in filter_fields]
+    }
+
+# Full-text index over message text; the other fields serve as $search compound filters
+FULLTEXT_SEARCH_INDEX_DEFINITION = {
+    "mappings": {
+        "dynamic": False,
+        "fields": {
+            "text": {"type": "string"},
+            "user_id": {"type": "token"},
+            "conversation_id": {"type": "token"},
+            "type": {"type": "token"},
+            "timestamp": {"type": "date"},
+        },
+    }
+}
+
+def sync_search_index(collection, name, definition, index_type="vectorSearch"):
+    """Create a search index, or update it in place if its definition has changed"""
+    existing = list(collection.list_search_indexes(name))
+    if not existing:
+        collection.create_search_index({"name": name, "type": index_type, "definition": definition})
+        return
+    # Atlas may add defaults to stored definitions, so only compare the keys we set
+    if index_type == "vectorSearch":
+        current = existing[0].get("latestDefinition", {}).get("fields", [])
+        up_to_date = len(current) == len(definition["fields"]) and all(
+            any(all(field.get(key) == value for key, value in wanted.items()) for field in current)
+            for wanted in definition["fields"]
+        )
+    else:
+        current = existing[0].get("latestDefinition", {}).get("mappings", {}).get("fields", {})
+        up_to_date = all(
+            all(current.get(path, {}).get(key) == value for key, value in wanted.items())
+            for path, wanted in definition["mappings"]["fields"].items()
+        )
+    if not up_to_date:
+        collection.update_search_index(name, definition)
+
+def sync_vector_indexes(space):
+    """
+    Create or update the vector search indexes of an embedding space on every collection
+
+    Returns:
+        {collection name: index name}
+    """
+    names = {}
+    for collection_name, (base_name, filter_fields) in VECTOR_SEARCH_INDEXES.items():
+        names[collection_name] = space.index_name(base_name)
+        sync_search_index(
+            db[collection_name],
+            names[collection_name],
+            vector_search_index_definition(space.field, space.dimensions, filter_fields),
+        )
+    return names
+
+def create_archive_collection():
+    """
+    Create the conversation archive in the layout set by CONVERSATION_ARCHIVE_LAYOUT. As a time-series
+    collection, messages are bucketed per conversation and compressed on disk, and retention is handled
+    by dropping whole buckets; reads by user and conversation use the metaField.
+    """
+    retention = {"expireAfterSeconds": ARCHIVE_RETENTION_DAYS * 24 * 60 * 60} if ARCHIVE_RETENTION_DAYS > 0 else {}
+    if CONVERSATION_ARCHIVE_LAYOUT == "timeseries":
+        db.create_collection(
+            CONVERSATION_ARCHIVE_COLLECTION,
+            timeseries={"timeField": "timestamp", "metaField": ARCHIVE_META_FIELD, "granularity": "hours"},
+            **retention,
+        )
+        keys = [
+            (f"{ARCHIVE_META_FIELD}.user_id", pymongo.ASCENDING),
+            (f"{ARCHIVE_META_FIELD}.conversation_id", pymongo.ASCENDING),
+            ("timestamp", pymongo.ASCENDING),
+        ]
+    else:
+        db.create_collection(CONVERSATION_ARCHIVE_COLLECTION)
+        keys = [
+            ("user_id", pymongo.ASCENDING),
+            ("conversation_id", pymongo.ASCENDING),
+            ("timestamp", pymongo.ASCENDING),
+        ]
+    try:
+        conversation_archive.create_index(keys, name="user_conversation_timestamp_index")
+        if retention and CONVERSATION_ARCHIVE_LAYOUT != "timeseries":
+            conversation_archive.create_index("timestamp", name="timestamp_ttl_idx", **retention)
+    except pymongo.errors.PyMongoError as e:
+        logger.error("Error creating conversation_archive indexes: %s", e)
 
 def initialize_mongodb():
     """Initialize MongoDB collections and create necessary indexes"""
     # Ensure conversations collection exists
     if CONVERSATIONS_COLLECTION not in db.list_collection_names():
         db.create_collection(CONVERSATIONS_COLLECTION)
-        # Create vector search index for conversations
         try:
-            conversations.create_search_index(
-                {
-                    "name": CONVERSATIONS_VECTOR_SEARCH_INDEX_NAME,
-                    "type": "vectorSearch",
-                    "definition": {
-                        "fields": [
-                            {
-                                "type": "vector",
-                                "path": "embeddings",
-                                "numDimensions": 1536,
-                                "similarity": "cosine",
-                            },
-                            {"type": "filter", "path": "user_id"},
-                        ]
-                    },
-                }
-            )
-            conversations.create_search_index(
-                {
-                    "name": CONVERSATIONS_FULLTEXT_SEARCH_INDEX_NAME,
-                    "type": "search",
-                    "definition": {
-                        "mappings": {
-                            "dynamic": False,
-                            "fields": {"text": {"type": "string"}},
-                        }
-                    },
-                }
-            )
             # Create TTL index on timestamp field
             conversations.create_index(
                 [("timestamp", 1)],
-                expireAfterSeconds=30 * 24 * 60 * 60,  # 30 days
+                expireAfterSeconds=CONVERSATION_TTL_DAYS * 24 * 60 * 60,  # Backstop behind archiving
                 name="timestamp_ttl_idx",
             )
         except pymongo.errors.PyMongoError as e:
-            logger.error(f"Error creating indexes: {e}")
+            logger.error("Error creating indexes: %s", e)
     
+    # Messages awaiting the ingestion workers; sparse, so it only holds those
+    try:
+        conversations.create_index([("enrichment", pymongo.ASCENDING)], sparse=True, name="enrichment_index")
+    except pymongo.errors.PyMongoError as e:
+        logger.error("Error creating enrichment index: %s", e)
+
     # Ensure memory_nodes collection exists
     if MEMORY_NODES_COLLECTION not in db.list_collection_names():
         db.create_collection(MEMORY_NODES_COLLECTION)
@@ -69,25 +210,81 @@ def initialize_mongodb():
             memory_nodes.create_index(
                 [("user_id", pymongo.ASCENDING)], name="user_id_index"
             )
-            memory_nodes.create_search_index(
-                {
-                    "name": MEMORY_NODES_VECTOR_SEARCH_INDEX_NAME,
-                    "type": "vectorSearch",
-                    "definition": {
-                        "fields": [
-                            {
-                                "type": "vector",
-                                "path": "embeddings",
-                                "numDimensions": 1536,
-                                "similarity": "cosine",
-                            },
-                            {"type": "filter", "path": "user_id"},
-                        ]
-                    },
-                }
+        except pymongo.errors.PyMongoError as e:
+            logger.error("Error creating memory_nodes indexes: %s", e)
+
+    # Memory tree indexes; also applied to existing deployments created before the tree existed
+    try:
+        memory_nodes.create_index(
+            [("user_id", pymongo.ASCENDING), ("level", pymongo.DESCENDING)], name="user_id_level_index"
+        )
+        memory_nodes.create_index([("parent_id", pymongo.ASCENDING)], name="parent_id_index")
+    except pymongo.errors.PyMongoError as e:
+        logger.error("Error creating memory tree indexes: %s", e)
+    # Memories stored before the tree existed have no `level`; mark them as leaves once, so leaf searches
+    # can pre-filter on level 0 inside $vectorSearch
+    legacy = memory_nodes.update_many({"level": None}, {"$set": {"level": 0}})
+    if legacy.modified_count:
+        logger.info("Marked %d memories stored before the memory tree as leaves", legacy.modified_count)
+
+    # Ensure conversation rollups collection exists
+    if CONVERSATION_ROLLUPS_COLLECTION not in db.list_collection_names():
+        db.create_collection(CONVERSATION_ROLLUPS_COLLECTION)
+        try:
+            conversation_rollups.create_index(
+                [("user_id", pymongo.ASCENDING), ("conversation_id", pymongo.ASCENDING)],
+                unique=True,
+                name="user_conversation_index",
+            )
+        except pymongo.errors.PyMongoError as e:
+            logger.error("Error creating conversation_rollups indexes: %s", e)
+
+    # Search indexes: those of the active embedding space, sized from its dimensions, and the full-text index
+    try:
+        # Imported here: the settings module reads the collections defined above
+        from database.embedding_space import settings
+        sync_vector_indexes(settings.initialize())
+        sync_search_index(
+            conversations, CONVERSATIONS_FULLTEXT_SEARCH_INDEX_NAME, FULLTEXT_SEARCH_INDEX_DEFINITION, "search"
+        )
+    except pymongo.errors.PyMongoError as e:
+        logger.error("Error creating search indexes: %s", e)
+
+    # Ensure conversation archive collection exists
+    if CONVERSATION_ARCHIVE_COLLECTION not in db.list_collection_names():
+        create_archive_collection()
+    else:
+        timeseries = "timeseries" in db[CONVERSATION_ARCHIVE_COLLECTION].options()
+        if timeseries != (CONVERSATION_ARCHIVE_LAYOUT == "timeseries"):
+            # The layout of a collection cannot be changed in place
+            logger.warning(
+                "conversation_archive is a %s collection but CONVERSATION_ARCHIVE_LAYOUT is %s; keeping the existing layout",
+                "time-series" if timeseries else "standard", CONVERSATION_ARCHIVE_LAYOUT,
+            )
+
+    # Ensure conversation summaries collection exists
+    if CONVERSATION_SUMMARIES_COLLECTION not in db.list_collection_names():
+        db.create_collection(CONVERSATION_SUMMARIES_COLLECTION)
+        try:
+            conversation_summaries.create_index(
+                [("user_id", pymongo.ASCENDING), ("conversation_id", pymongo.ASCENDING)],
+                unique=True,
+                name="user_conversation_index",
+            )
+        except pymongo.errors.PyMongoError as e:
+            logger.error("Error creating conversation_summaries indexes: %s", e)
+
+    # Ensure ingest requests collection exists; its _id is the idempotency key
+    if INGEST_REQUESTS_COLLECTION not in db.list_collection_names():
+        db.create_collection(INGEST_REQUESTS_COLLECTION)
+        try:
+            ingest_requests.create_index(
+                [("created_at", pymongo.ASCENDING)],
+                expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS,
+                name="created_at_ttl_idx",
             )
         except pymongo.errors.PyMongoError as e:
-            logger.error(f"Error creating memory_nodes indexes: {e}")
+            logger.error("Error creating ingest_requests indexes: %s", e)
 
 def serialize_document(doc):
     """Helper function to serialize MongoDB documents."""
@@ -0,0 +1,218 @@
+import asyncio
+import threading
+import contextlib
+import contextvars
+from collections import OrderedDict
+from pymongo import monitoring, read_preferences
+from config import READ_PREFERENCES, READ_MAX_STALENESS_SECONDS, CAUSAL_CONSISTENCY_ENABLED, CAUSAL_SESSION_MAX_USERS
+
+# Operation types whose reads may be routed away from the primary
+READ_OPERATIONS = ("search", "memory", "context", "summary")
+_MODES = {
+    "primary": read_preferences.Primary,
+    "primarypreferred": read_preferences.PrimaryPreferred,
+    "secondary": read_preferences.Secondary,
+    "secondarypreferred": read_preferences.SecondaryPreferred,
+    "nearest": read_preferences.Nearest,
+}
+_READ_COMMANDS = {"find", "aggregate", "getMore", "count", "distinct", "listIndexes", "listSearchIndexes"}
+
+# (session, user_id, owner) of the causally consistent session opened by the current task or thread
+_current_session = contextvars.ContextVar("mongo_session", default=None)
+
+
+def _parse_read_preferences(spec):
+    preferences = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        operation, _, mode = item.partition("=")
+        operation, mode = operation.strip(), mode.strip().lower()
+        if operation not in READ_OPERATIONS or mode not in _MODES:
+            raise ValueError(f"Invalid READ_PREFERENCES entry: {item}")
+        if mode == "primary":
+            preferences[operation] = read_preferences.Primary()
+        else:
+            preferences[operation] = _MODES[mode](max_staleness=READ_MAX_STALENESS_SECONDS)
+    return preferences
+
+
+_read_preferences = _parse_read_preferences(READ_PREFERENCES)
+_routed = {}
+
+
+def read_preference(operation):
+    """Configured read preference of an operation type, primary when none is configured"""
+    return _read_preferences.get(operation, read_preferences.Primary())
+
+
+def for_reads(collection, operation):
+    """`collection` with the read preference configured for `operation` applied"""
+    preference = _read_preferences.get(operation)
+    if preference is None:
+        return collection
+    key = (collection, operation)
+    if key not in _routed:
+        _routed[key] = collection.with_options(read_preference=preference)
+    return _routed[key]
+
+
+def _owner():
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        return threading.get_ident()
+
+
+def current_session():
+    """Session opened by the calling task or thread with `causal_session`, if any"""
+    state = _current_session.get()
+    if state is None or state[2] != _owner():
+        # Sessions are not safe for concurrent use, so tasks and threads inheriting one do not use it
+        return None
+    session = state[0]
+    return None if session.has_ended else session
+
+
+class CausalTokens:
+    """
+    Latest cluster and operation time observed per user, least recently used users evicted first.
+    Starting a session from these makes its reads wait for the user's earlier writes, on any member.
+    """
+
+    def __init__(self, max_users):
+        self.max_users = max_users
+        self._tokens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def apply(self, user_id, session):
+        with self._lock:
+            tokens = self._tokens.get(user_id)
+            if tokens:
+                self._tokens.move_to_end(user_id)
+        if tokens:
+            cluster_time, operation_time = tokens
+            session.advance_cluster_time(cluster_time)
+            session.advance_operation_time(operation_time)
+
+    def record(self, user_id, session):
+        cluster_time, operation_time = session.cluster_time, session.operation_time
+        if cluster_time is None or operation_time is None:
+            return
+        with self._lock:
+            previous = self._tokens.get(user_id)
+            if previous:
+                if previous[0]["clusterTime"] > cluster_time["clusterTime"]:
+                    cluster_time = previous[0]
+                operation_time = max(previous[1], operation_time)
+            self._tokens[user_id] = (cluster_time, operation_time)
+            self._tokens.move_to_end(user_id)
+            while len(self._tokens) > self.max_users:
+                self._tokens.popitem(last=False)
+
+
+causal_tokens = CausalTokens(CAUSAL_SESSION_MAX_USERS)
+
+
+@contextlib.contextmanager
+def causal_session(client, user_id):
+    """
+    Run the MongoDB operations of the enclosed block in a causally consistent session of `user_id`, so
+    reads routed to secondaries see the user's earlier writes (read-your-writes). A block nested in
+    another block of the same user and task reuses its session. Without a `user_id` no session is started.
+    """
+    state = _current_session.get()
+    if not CAUSAL_CONSISTENCY_ENABLED or user_id is None or (
+        state and state[1] == user_id and current_session() is not None
+    ):
+        yield current_session()
+        return
+    session = client.start_session(causal_consistency=True)
+    causal_tokens.apply(user_id, session)
+    token = _current_session.set((session, user_id, _owner()))
+    try:
+        yield session
+    finally:
+        _current_session.reset(token)
+        causal_tokens.record(user_id, session)
+        session.end_session()
+
+
+class SessionCollection:
+    """Collection wrapper passing the caller's causally consistent session, if any, to every operation"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            if "session" not in kwargs:
+                session = current_session()
+                if session is not None:
+                    kwargs["session"] = session
+            return attribute(*args, **kwargs)
+
+        return call
+
+    def with_options(self, **options):
+        return SessionCollection(self._collection.with_options(**options))
+
+    def __eq__(self, other):
+        return isinstance(other, SessionCollection) and self._collection == other._collection
+
+    def __hash__(self):
+        return hash(self._collection)
+
+
+class ReadMetrics(monitoring.CommandListener):
+    """Counts commands per kind (read/write/other) and type of the server that ran them"""
+
+    def __init__(self):
+        self.client = None
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def _server_type(self, address):
+        if self.client is None:
+            return "unknown"
+        description = self.client.topology_description.server_descriptions().get(address)
+        return {
+            "RSPrimary": "primary",
+            "RSSecondary": "secondary",
+            "Standalone": "standalone",
+            "Mongos": "mongos",
+        }.get(description.server_type_name if description else None, "other")
+
+    def started(self, event):
+        kind = "read" if event.command_name in _READ_COMMANDS else (
+            "write" if event.command_name in ("insert", "update", "delete", "findAndModify") else "other"
+        )
+        key = (kind, self._server_type(event.connection_id), event.command_name)
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def snapshot(self):
+        """Reads and writes per server type, and per command"""
+        with self._lock:
+            counts = dict(self._counts)
+        report = {"reads": {}, "writes": {}, "commands": {}}
+        for (kind, server_type, command), count in counts.items():
+            if kind in ("read", "write"):
+                totals = report[f"{kind}s"]
+                totals[server_type] = totals.get(server_type, 0) + count
+            report["commands"].setdefault(command, {})[server_type] = count
+        reads = sum(report["reads"].values())
+        report["secondary_read_ratio"] = round(report["reads"].get("secondary", 0) / reads, 4) if reads else 0.0
+        report["read_preferences"] = {operation: read_preference(operation).mode_name for operation in READ_OPERATIONS}
+        return report
+
+
+read_metrics = ReadMetrics()
@@ -0,0 +1,95 @@
+import datetime
+
+
+def _utc(value):
+    """Naive datetimes are taken to be UTC, like the stored timestamps"""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+class SearchScope:
+    """
+    Optional restrictions of a retrieval beyond the user: one conversation, one message type ("human" or
+    "ai") and a time window (`start` and `end` inclusive). They are applied as search pre-filters, so a
+    narrow scope also narrows the candidate sets of the vector and full-text searches.
+    """
+
+    def __init__(self, conversation_id=None, message_type=None, start=None, end=None):
+        if start is not None and end is not None and _utc(start) > _utc(end):
+            raise ValueError("The start of the time window is after its end")
+        self.conversation_id = conversation_id
+        self.message_type = message_type
+        self.start = _utc(start)
+        self.end = _utc(end)
+
+    @property
+    def empty(self):
+        return self.key() == (None, None, None, None)
+
+    @property
+    def restricts_memories(self):
+        """Memories have a conversation and a creation time, but no message type"""
+        return self.conversation_id is not None or self.start is not None or self.end is not None
+
+    @property
+    def includes_rollups(self):
+        """Rollups summarize both message types, so a type restriction leaves them out"""
+        return self.message_type is None
+
+    def key(self):
+        """Hashable identity of the scope, for caches"""
+        return (self.conversation_id, self.message_type, self.start, self.end)
+
+    def _range(self):
+        bounds = {}
+        if self.start is not None:
+            bounds["$gte"] = self.start
+        if self.end is not None:
+            bounds["$lte"] = self.end
+        return bounds
+
+    def message_filter(self):
+        """Filter over conversation messages, usable as a $vectorSearch pre-filter"""
+        query = {}
+        if self.conversation_id is not None:
+            query["conversation_id"] = self.conversation_id
+        if self.message_type is not None:
+            query["type"] = self.message_type
+        if self._range():
+            query["timestamp"] = self._range()
+        return query
+
+    def search_clauses(self):
+        """The same restrictions as $search compound `filter` clauses"""
+        clauses = []
+        if self.conversation_id is not None:
+            clauses.append({"equals": {"path": "conversation_id", "value": self.conversation_id}})
+        if self.message_type is not None:
+            clauses.append({"equals": {"path": "type", "value": self.message_type}})
+        if self._range():
+            clauses.append({"range": {"path": "timestamp", **{key[1:]: value for key, value in self._range().items()}}})
+        return clauses
+
+    def rollup_filter(self):
+        """Filter over conversation rollups: the conversation, and rollups overlapping the time window"""
+        query = {}
+        if self.conversation_id is not None:
+            query["conversation_id"] = self.conversation_id
+        if self.start is not None:
+            query["last_timestamp"] = {"$gte": self.start}
+        if self.end is not None:
+            query["first_timestamp"] = {"$lte": self.end}
+        return query
+
+    def memory_filter(self):
+        """Filter over memory nodes: the conversation a memory came from, and its creation time"""
+        query = {}
+        if self.conversation_id is not None:
+            query["conversation_id"] = self.conversation_id
+        if self._range():
+            query["timestamp"] = self._range()
+        return query
+
+
+UNSCOPED = SearchScope()
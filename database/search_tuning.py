@@ -0,0 +1,160 @@
+import time
+import datetime
+import threading
+from collections import OrderedDict
+from config import (
+    VECTOR_SEARCH_CANDIDATES, VECTOR_SEARCH_TARGET_RECALL, VECTOR_SEARCH_EXACT_MAX_DOCUMENTS,
+    VECTOR_SEARCH_CANDIDATE_MULTIPLIER, VECTOR_SEARCH_TUNING_REFRESH_SECONDS, VECTOR_SEARCH_TUNING_MAX_USERS
+)
+from database.mongodb import db, search_tuning
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Atlas rejects larger numCandidates
+MAX_NUM_CANDIDATES = 10000
+# Upper bounds of the per-user document counts calibrations are recorded for; larger users share a last,
+# open-ended bucket
+CARDINALITY_BUCKETS = (1_000, 10_000, 100_000, 1_000_000)
+
+
+def cardinality_bucket(count):
+    """Upper bound of the calibration bucket of a user with `count` documents, None for the open last bucket"""
+    return next((bound for bound in CARDINALITY_BUCKETS if count <= bound), None)
+
+
+def num_candidates(limit, multiplier):
+    """numCandidates for `limit` results, within the bounds Atlas accepts"""
+    return min(max(limit * multiplier, limit), MAX_NUM_CANDIDATES)
+
+
+class SearchTuning:
+    """
+    Per-process view of what `auto` candidate tuning needs: the number of documents each user has per
+    collection (least recently used users evicted first) and the recall calibrations recorded by
+    benchmark_recall.py, both reused for `refresh_seconds`.
+    """
+
+    def __init__(self, refresh_seconds, max_users):
+        self.refresh_seconds = refresh_seconds
+        self.max_users = max_users
+        self._counts = OrderedDict()
+        self._calibrations = {}
+        self._lock = threading.Lock()
+
+    def _cached_count(self, key, now):
+        with self._lock:
+            entry = self._counts.get(key)
+            if entry is None or now - entry[1] >= self.refresh_seconds:
+                return None
+            self._counts.move_to_end(key)
+            return entry[0]
+
+    def _remember_count(self, key, count, now):
+        with self._lock:
+            self._counts[key] = (count, now)
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.max_users:
+                self._counts.popitem(last=False)
+
+    def cardinality(self, collection_name, user_id):
+        """Number of documents of `user_id` in a collection, counted at most once per refresh interval"""
+        now = time.monotonic()
+        count = self._cached_count((collection_name, user_id), now)
+        if count is None:
+            count = db[collection_name].count_documents({"user_id": user_id})
+            self._remember_count((collection_name, user_id), count, now)
+        return count
+
+    def prefetch(self, collection_name, user_ids):
+        """Count the documents of several users in one round trip, for searches about to run for all of them"""
+        now = time.monotonic()
+        missing = [user_id for user_id in set(user_ids) if self._cached_count((collection_name, user_id), now) is None]
+        if not missing:
+            return
+        counts = dict.fromkeys(missing, 0)
+        response = db[collection_name].aggregate(
+            [
+                {"$match": {"user_id": {"$in": missing}}},
+                {"$group": {"_id": "$user_id", "count": {"$sum": 1}}},
+            ]
+        )
+        counts.update((doc["_id"], doc["count"]) for doc in response)
+        for user_id, count in counts.items():
+            self._remember_count((collection_name, user_id), count, now)
+
+    def calibration(self, collection_name):
+        """Recall calibration of a collection's vector index, None until benchmark_recall.py --save recorded one"""
+        now = time.monotonic()
+        entry = self._calibrations.get(collection_name)
+        if entry is None or now - entry[1] >= self.refresh_seconds:
+            entry = (search_tuning.find_one({"_id": collection_name}), now)
+            self._calibrations[collection_name] = entry
+        return entry[0]
+
+    def invalidate(self):
+        with self._lock:
+            self._counts.clear()
+        self._calibrations.clear()
+
+    def multiplier(self, collection_name, count, target_recall=VECTOR_SEARCH_TARGET_RECALL):
+        """
+        Smallest calibrated numCandidates-to-limit ratio reaching `target_recall` for users with `count`
+        documents. Without a calibration of their size, the nearest larger calibrated size is used (recall
+        only drops as users grow), then the largest; without any calibration VECTOR_SEARCH_CANDIDATE_MULTIPLIER.
+        """
+        calibration = self.calibration(collection_name)
+        if not calibration or not calibration.get("buckets"):
+            return VECTOR_SEARCH_CANDIDATE_MULTIPLIER
+        buckets = sorted(calibration["buckets"], key=lambda bucket: bucket["max_documents"] or float("inf"))
+        bucket = next(
+            (bucket for bucket in buckets if bucket["max_documents"] is None or count <= bucket["max_documents"]),
+            buckets[-1],
+        )
+        recalls = sorted((int(multiplier), recall) for multiplier, recall in bucket["recall"].items())
+        return next((multiplier for multiplier, recall in recalls if recall >= target_recall), recalls[-1][0])
+
+    def options(self, collection_name, user_id, limit, default_candidates):
+        """
+        $vectorSearch options choosing between approximate and exact search for `limit` results of a user.
+        In `fixed` mode these are `default_candidates` candidates. In `auto` mode users with at most
+        VECTOR_SEARCH_EXACT_MAX_DOCUMENTS documents are searched exactly, which is as fast as the index at
+        that size and always finds the true nearest neighbours; for larger users the number of candidates
+        follows their size and VECTOR_SEARCH_TARGET_RECALL.
+        """
+        if VECTOR_SEARCH_CANDIDATES != "auto":
+            return {"numCandidates": default_candidates}
+        count = self.cardinality(collection_name, user_id)
+        if count <= VECTOR_SEARCH_EXACT_MAX_DOCUMENTS:
+            return {"exact": True}
+        return {"numCandidates": num_candidates(limit, self.multiplier(collection_name, count))}
+
+
+tuning = SearchTuning(VECTOR_SEARCH_TUNING_REFRESH_SECONDS, VECTOR_SEARCH_TUNING_MAX_USERS)
+
+
+def candidate_options(collection_name, user_id, limit, default_candidates):
+    """numCandidates or exact search for a user's $vectorSearch, see `SearchTuning.options`"""
+    return tuning.options(collection_name, user_id, limit, default_candidates)
+
+
+def prefetch_cardinalities(collection_name, user_ids):
+    """Count the documents of the users of a batch of searches at once; a no-op in `fixed` mode"""
+    if VECTOR_SEARCH_CANDIDATES == "auto":
+        tuning.prefetch(collection_name, user_ids)
+
+
+def save_calibration(collection_name, limit, buckets):
+    """Record measured recall per numCandidates-to-limit ratio and user size bucket, replacing the previous one"""
+    search_tuning.replace_one(
+        {"_id": collection_name},
+        {
+            "_id": collection_name,
+            "limit": limit,
+            "buckets": buckets,
+            "measured_at": datetime.datetime.now(datetime.timezone.utc),
+        },
+        upsert=True,
+    )
+    tuning.invalidate()
+    logger.info("Saved the vector search recall calibration of %s (%d size buckets)", collection_name, len(buckets))
@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+
+import httpx
+
+from loadtest.runner import Workload, run_load, seed, summarize
+from loadtest.stubs import Latency, StubBedrockClient, StubMongoClient
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Load test POST /conversation/ and GET /retrieve_memory/. By default the app runs in-process "
+            "against stub MongoDB and Bedrock backends with injected latency; --url targets a running server."
+        )
+    )
+    parser.add_argument("--url", help="Base URL of a running server; omit to test the app in-process with stubs")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of measured load")
+    parser.add_argument("--max-requests", type=int, help="Stop after this many measured requests")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent closed-loop clients")
+    parser.add_argument("--users", type=int, default=20, help="Distinct users")
+    parser.add_argument("--conversations-per-user", type=int, default=3, help="Conversations per user")
+    parser.add_argument("--read-ratio", type=float, default=0.8, help="Fraction of requests that are retrievals")
+    parser.add_argument("--seed-messages", type=int, default=5, help="Messages written per user before measuring")
+    parser.add_argument("--retrieve-timeout", type=float, help="Latency budget passed to /retrieve_memory/")
+    parser.add_argument("--request-timeout", type=float, default=60, help="Client-side timeout per request")
+    parser.add_argument("--mongo-latency-ms", type=float, default=2, help="Stub latency per MongoDB operation")
+    parser.add_argument("--embedding-latency-ms", type=float, default=40, help="Stub latency per embedding")
+    parser.add_argument("--llm-latency-ms", type=float, default=400, help="Stub latency per LLM call")
+    parser.add_argument(
+        "--latency-jitter", type=float, default=0.25, help="Stub latencies vary by +/- this fraction of the mean"
+    )
+    parser.add_argument(
+        "--ingest-workers",
+        type=int,
+        default=0,
+        help="Run the in-process app with INGEST_MODE=worker and this many ingestion workers (partitions)",
+    )
+    parser.add_argument("--random-seed", type=int, help="Seed for the workload and latency jitter")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--log-level", default="WARNING", help="Log level of the in-process app")
+    return parser.parse_args()
+
+
+def install_stubs(args, rng):
+    """Make pymongo and boto3 hand out the stub backends; must run before the app is imported"""
+    import boto3
+    import pymongo
+
+    mongo = StubMongoClient(Latency(args.mongo_latency_ms, args.latency_jitter, rng))
+    bedrock = StubBedrockClient(
+        Latency(args.embedding_latency_ms, args.latency_jitter, rng),
+        Latency(args.llm_latency_ms, args.latency_jitter, rng),
+    )
+    pymongo.MongoClient = lambda *_args, **_kwargs: mongo
+    boto3.client = lambda *_args, **_kwargs: bedrock
+
+
+def in_process_client(args):
+    import main
+    from utils.logger import output_handler
+
+    # Keep stdout for the report
+    logging.getLogger().setLevel(args.log_level)
+    output_handler.setStream(sys.stderr)
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=main.app), base_url="http://loadtest", timeout=args.request_timeout
+    )
+
+
+async def start_ingest_workers(count):
+    from services.ingest_worker_service import IngestWorker
+
+    workers = [IngestWorker(partition, count) for partition in range(count)]
+    return workers, [asyncio.create_task(worker.run()) for worker in workers]
+
+
+async def drain_ingest_workers(workers, tasks, timeout=120):
+    """Wait for the workers to enrich every stored message, then stop them"""
+    from database.mongodb import conversations
+
+    loop = asyncio.get_running_loop()
+    backlog = conversations.count_documents({"enrichment": {"$exists": True}})
+    started = loop.time()
+    while conversations.count_documents({"enrichment": {"$exists": True}}) and loop.time() - started < timeout:
+        await asyncio.sleep(0.1)
+    drain_seconds = loop.time() - started
+    for worker in workers:
+        worker.stop()
+    await asyncio.gather(*tasks)
+    return {
+        "workers": len(workers),
+        "enriched": sum(worker.processed for worker in workers),
+        "failed": sum(worker.failed for worker in workers),
+        "backlog_at_end_of_load": backlog,
+        "drain_seconds": round(drain_seconds, 2),
+    }
+
+
+async def run(args):
+    rng = random.Random(args.random_seed)
+    if args.ingest_workers and args.url:
+        raise SystemExit("--ingest-workers requires the in-process app")
+    if args.ingest_workers:
+        # Must be set before the app (and config) is imported
+        os.environ["INGEST_MODE"] = "worker"
+    if args.url:
+        client = httpx.AsyncClient(
+            base_url=args.url,
+            timeout=args.request_timeout,
+            limits=httpx.Limits(max_connections=args.concurrency),
+        )
+    else:
+        install_stubs(args, rng)
+        client = in_process_client(args)
+    workload = Workload(args.users, args.conversations_per_user, args.read_ratio, rng)
+    workers, worker_tasks = await start_ingest_workers(args.ingest_workers) if args.ingest_workers else ([], [])
+    async with client:
+        print(f"Seeding {args.users} users with {args.seed_messages} messages each", file=sys.stderr)
+        await seed(client, workload, args.seed_messages, args.concurrency)
+        print(f"Running for {args.duration}s with {args.concurrency} concurrent clients", file=sys.stderr)
+        samples, elapsed = await run_load(
+            client, workload, args.concurrency, args.duration, args.max_requests, args.retrieve_timeout
+        )
+    report = summarize(samples, elapsed)
+    if workers:
+        print("Waiting for the ingestion workers to drain", file=sys.stderr)
+        report["ingest_workers"] = await drain_ingest_workers(workers, worker_tasks)
+    report["config"] = {
+        key: value for key, value in vars(args).items() if key not in ("output", "log_level")
+    }
+    report["target"] = args.url or "in-process app with stub backends"
+    return report
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
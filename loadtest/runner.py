@@ -0,0 +1,171 @@
+"""
+Load generation against the HTTP API and the latency report it produces.
+"""
+import asyncio
+import datetime
+import time
+import uuid
+
+import numpy as np
+
+CONVERSATION_ENDPOINT = "POST /conversation/"
+RETRIEVE_ENDPOINT = "GET /retrieve_memory/"
+
+# Topic vocabularies; messages on the same topic share words, so searches find related messages
+TOPICS = {
+    "travel": "flight hotel booking itinerary passport visa airport luggage beach museum train tickets",
+    "cooking": "recipe oven garlic pasta sauce baking flour butter dinner spices vegetables grill",
+    "fitness": "running workout gym marathon stretching protein weights cardio training recovery",
+    "finance": "budget savings mortgage investment retirement taxes portfolio interest loan pension",
+    "software": "python database deployment latency index query service cluster bug release api",
+    "gardening": "tomatoes soil compost seeds watering pruning roses greenhouse fertilizer harvest",
+}
+FILLER = "i want to plan the next steps for my and remember that we should check this week please".split()
+
+
+class Workload:
+    """Random mix of message writes and memory retrievals over a fixed population of users"""
+
+    def __init__(self, users, conversations_per_user, read_ratio, rng):
+        self.rng = rng
+        self.read_ratio = read_ratio
+        run_id = uuid.uuid4().hex[:6]
+        self.users = [f"load_user_{run_id}_{index}" for index in range(users)]
+        self.topics = {user: rng.sample(sorted(TOPICS), k=min(3, len(TOPICS))) for user in self.users}
+        self.conversations = {
+            user: [f"conv_{index}" for index in range(conversations_per_user)] for user in self.users
+        }
+
+    def _sentence(self, topic, words):
+        vocabulary = TOPICS[topic].split()
+        chosen = self.rng.sample(vocabulary, k=min(words, len(vocabulary)))
+        chosen += self.rng.sample(FILLER, k=words // 2)
+        self.rng.shuffle(chosen)
+        return " ".join(chosen).capitalize() + "."
+
+    def message(self, user=None):
+        user = user or self.rng.choice(self.users)
+        return {
+            "user_id": user,
+            "conversation_id": self.rng.choice(self.conversations[user]),
+            "type": "human" if self.rng.random() < 0.5 else "ai",
+            "text": self._sentence(self.rng.choice(self.topics[user]), self.rng.randint(5, 10)),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+
+    def query(self):
+        user = self.rng.choice(self.users)
+        return {"user_id": user, "text": self._sentence(self.rng.choice(self.topics[user]), 3)}
+
+    def next_request(self):
+        if self.rng.random() < self.read_ratio:
+            return RETRIEVE_ENDPOINT, self.query()
+        return CONVERSATION_ENDPOINT, self.message()
+
+
+async def send(client, endpoint, payload, timeout=None):
+    """
+    Issue one request and classify its outcome.
+
+    Returns:
+        (ok, outcome, body) where `outcome` is "ok" or a short error class. Handlers report failures
+        as an HTTPException serialized into a 200 response, so the body is checked as well.
+    """
+    try:
+        if endpoint == CONVERSATION_ENDPOINT:
+            response = await client.post("/conversation/", json=payload)
+        else:
+            params = dict(payload, **({"timeout": timeout} if timeout else {}))
+            response = await client.get("/retrieve_memory/", params=params)
+    except Exception as error:
+        return False, type(error).__name__, None
+    if response.status_code >= 400:
+        return False, f"HTTP {response.status_code}", None
+    try:
+        body = response.json()
+    except ValueError:
+        return False, "invalid JSON", None
+    if isinstance(body, dict) and isinstance(body.get("status_code"), int) and body["status_code"] >= 400:
+        return False, f"HTTP {body['status_code']} (in body)", body
+    return True, "ok", body
+
+
+async def seed(client, workload, messages_per_user, concurrency):
+    """Write initial messages for every user so retrievals have something to find; not measured"""
+    queue = asyncio.Queue()
+    for user in workload.users:
+        for _ in range(messages_per_user):
+            queue.put_nowait(workload.message(user))
+
+    async def worker():
+        while not queue.empty():
+            await send(client, CONVERSATION_ENDPOINT, queue.get_nowait())
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_load(client, workload, concurrency, duration, max_requests=None, retrieve_timeout=None):
+    """
+    Drive the API from `concurrency` closed-loop workers for `duration` seconds (or until
+    `max_requests` have been issued).
+
+    Returns:
+        (samples, elapsed seconds) with one (endpoint, latency seconds, ok, outcome, body) per request
+    """
+    samples = []
+    issued = 0
+    started = time.monotonic()
+    stop_at = started + duration
+
+    async def worker():
+        nonlocal issued
+        while time.monotonic() < stop_at and (max_requests is None or issued < max_requests):
+            issued += 1
+            endpoint, payload = workload.next_request()
+            request_started = time.monotonic()
+            ok, outcome, body = await send(client, endpoint, payload, retrieve_timeout)
+            samples.append((endpoint, time.monotonic() - request_started, ok, outcome, body))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.monotonic() - started
+
+
+def summarize(samples, elapsed):
+    """Per-endpoint and overall throughput, latency percentiles (ms) and error rates"""
+
+    def stats(group):
+        latencies = np.array([sample[1] for sample in group]) * 1000
+        errors = {}
+        for _, _, ok, outcome, _ in group:
+            if not ok:
+                errors[outcome] = errors.get(outcome, 0) + 1
+        error_count = sum(errors.values())
+        report = {
+            "requests": len(group),
+            "errors": error_count,
+            "error_rate": round(error_count / len(group), 4) if group else 0.0,
+            "throughput_rps": round(len(group) / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": {
+                "p50": round(float(np.percentile(latencies, 50)), 2),
+                "p95": round(float(np.percentile(latencies, 95)), 2),
+                "p99": round(float(np.percentile(latencies, 99)), 2),
+                "mean": round(float(latencies.mean()), 2),
+                "max": round(float(latencies.max()), 2),
+            } if group else None,
+            "error_breakdown": errors,
+        }
+        return report
+
+    endpoints = {}
+    for endpoint in (CONVERSATION_ENDPOINT, RETRIEVE_ENDPOINT):
+        group = [sample for sample in samples if sample[0] == endpoint]
+        endpoints[endpoint] = stats(group)
+        if endpoint == RETRIEVE_ENDPOINT and group:
+            bodies = [sample[4] for sample in group if sample[2] and isinstance(sample[4], dict)]
+            endpoints[endpoint]["cached"] = sum(1 for body in bodies if body.get("cached"))
+            endpoints[endpoint]["partial"] = sum(1 for body in bodies if body.get("partial"))
+    return {
+        "duration_seconds": round(elapsed, 3),
+        "endpoints": endpoints,
+        "overall": stats(samples),
+    }
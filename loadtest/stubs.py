@@ -0,0 +1,1122 @@
+"""
+In-memory stand-ins for MongoDB and Bedrock used by the load test.
+
+They implement the subset of the pymongo and bedrock-runtime APIs the service uses, including the
+Atlas `$vectorSearch` and `$search` stages, and sleep for a configurable latency on every call so the
+service can be exercised under realistic backend timings without an Atlas cluster or AWS account.
+"""
+import collections
+import copy
+import datetime
+import hashlib
+import io
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pymongo
+import pymongo.errors
+from bson.objectid import ObjectId
+
+_MISSING = object()
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Shortest prompt prefix Bedrock caches for Claude 3.7 Sonnet; shorter cache points are ignored
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+
+class Latency:
+    """Injected latency: `mean_ms` milliseconds, varied uniformly by +/- `jitter` (a fraction of the mean)"""
+
+    def __init__(self, mean_ms, jitter=0.0, rng=None):
+        self.mean_ms = mean_ms
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+
+    def sleep(self):
+        if self.mean_ms <= 0:
+            return
+        spread = self.mean_ms * self.jitter
+        time.sleep(max(0.0, self.rng.uniform(self.mean_ms - spread, self.mean_ms + spread)) / 1000)
+
+
+def _tokens(text):
+    return _TOKEN_PATTERN.findall(str(text).lower())
+
+
+def _to_bson(value):
+    """Copy a value the way a BSON round trip would: aware datetimes come back as naive UTC"""
+    if isinstance(value, dict):
+        return {key: _to_bson(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_bson(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None, microsecond=0)
+
+
+def _lookup(doc, path):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        elif isinstance(value, list):
+            value = [item[part] for item in value if isinstance(item, dict) and part in item]
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+def _get(doc, path):
+    value = _lookup(doc, path)
+    return None if value is _MISSING else value
+
+
+def _set_path(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _unset_path(doc, path):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+def _comparable(a, b):
+    if a is None or b is None:
+        return False
+    numbers = (int, float)
+    return (isinstance(a, numbers) and isinstance(b, numbers)) or type(a) is type(b)
+
+
+def _equals(value, expected):
+    if value is _MISSING:
+        return expected is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value == expected
+
+
+def _matches_operator(value, operator, argument):
+    argument = _to_bson(argument)
+    if operator == "$eq":
+        return _equals(value, argument)
+    if operator == "$ne":
+        return not _equals(value, argument)
+    if operator == "$in":
+        return any(_equals(value, item) for item in argument)
+    if operator == "$nin":
+        return not any(_equals(value, item) for item in argument)
+    if operator == "$exists":
+        return (value is not _MISSING) == bool(argument)
+    if operator == "$not":
+        return not _matches_condition(value, argument)
+    if operator == "$mod":
+        return isinstance(value, int) and value % argument[0] == argument[1]
+    if operator in ("$gt", "$gte", "$lt", "$lte"):
+        if value is _MISSING or not _comparable(value, argument):
+            return False
+        return {
+            "$gt": value > argument,
+            "$gte": value >= argument,
+            "$lt": value < argument,
+            "$lte": value <= argument,
+        }[operator]
+    raise NotImplementedError(f"Query operator {operator} is not supported by the stub")
+
+
+def _matches_condition(value, condition):
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        return all(_matches_operator(value, operator, argument) for operator, argument in condition.items())
+    return _equals(value, _to_bson(condition))
+
+
+def matches(doc, query):
+    """Whether a document satisfies a MongoDB query filter"""
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, clause) for clause in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, clause) for clause in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, clause) for clause in condition):
+                return False
+        elif not _matches_condition(_lookup(doc, key), condition):
+            return False
+    return True
+
+
+def evaluate(expression, doc, variables=None):
+    """Evaluate an aggregation expression against a document"""
+    variables = variables or {}
+    if isinstance(expression, str) and expression.startswith("$$"):
+        name, _, path = expression[2:].partition(".")
+        value = _now() if name == "NOW" else variables.get(name, doc if name == "ROOT" else None)
+        return _get(value, path) if path else value
+    if isinstance(expression, str) and expression.startswith("$"):
+        return _get(doc, expression[1:])
+    if isinstance(expression, list):
+        return [evaluate(item, doc, variables) for item in expression]
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            operator, argument = next(iter(expression.items()))
+            if operator.startswith("$"):
+                return _operator(operator, argument, doc, variables)
+        return {key: evaluate(value, doc, variables) for key, value in expression.items()}
+    return expression
+
+
+def _arithmetic_difference(a, b):
+    if isinstance(a, datetime.datetime) and isinstance(b, datetime.datetime):
+        return (a - b).total_seconds() * 1000
+    if isinstance(a, datetime.datetime):
+        return a - datetime.timedelta(milliseconds=b)
+    return a - b
+
+
+def _operator(operator, argument, doc, variables):
+    if operator == "$literal":
+        return argument
+    if operator == "$meta":
+        return doc.get(f"__{argument}")
+    if operator == "$map":
+        items = evaluate(argument["input"], doc, variables) or []
+        name = argument.get("as", "this")
+        return [evaluate(argument["in"], doc, {**variables, name: item}) for item in items]
+    if operator == "$zip":
+        inputs = [evaluate(item, doc, variables) for item in argument["inputs"]]
+        return [list(items) for items in zip(*inputs)]
+    if operator == "$cond":
+        if isinstance(argument, dict):
+            argument = [argument["if"], argument["then"], argument["else"]]
+        condition, then, otherwise = argument
+        return evaluate(then if evaluate(condition, doc, variables) else otherwise, doc, variables)
+    if operator == "$ifNull":
+        for item in argument:
+            value = evaluate(item, doc, variables)
+            if value is not None:
+                return value
+        return None
+    if operator == "$let":
+        bound = {name: evaluate(value, doc, variables) for name, value in argument["vars"].items()}
+        return evaluate(argument["in"], doc, {**variables, **bound})
+
+    values = evaluate(argument, doc, variables)
+    if not isinstance(argument, list):
+        values = [values]
+    if operator in ("$add", "$multiply", "$divide", "$pow", "$subtract") and any(v is None for v in values):
+        return None
+    if operator == "$add":
+        total = values[0]
+        for value in values[1:]:
+            total = total + (datetime.timedelta(milliseconds=value) if isinstance(total, datetime.datetime) else value)
+        return total
+    if operator == "$subtract":
+        return _arithmetic_difference(values[0], values[1])
+    if operator == "$multiply":
+        return math.prod(values)
+    if operator == "$divide":
+        return values[0] / values[1]
+    if operator == "$pow":
+        return values[0] ** values[1]
+    if operator == "$ln":
+        return math.log(values[0]) if values[0] is not None else None
+    if operator == "$exp":
+        return math.exp(values[0]) if values[0] is not None else None
+    if operator == "$sqrt":
+        return math.sqrt(values[0]) if values[0] is not None else None
+    if operator == "$abs":
+        return abs(values[0]) if values[0] is not None else None
+    if operator in ("$max", "$min"):
+        if len(values) == 1 and isinstance(values[0], list):
+            values = values[0]
+        values = [value for value in values if value is not None]
+        if not values:
+            return None
+        return max(values) if operator == "$max" else min(values)
+    if operator == "$sum":
+        if len(values) == 1 and isinstance(values[0], list):
+            values = values[0]
+        return sum(value for value in values if isinstance(value, (int, float)))
+    if operator == "$arrayElemAt":
+        array, index = values
+        return array[index] if array is not None and -len(array) <= index < len(array) else None
+    if operator == "$size":
+        return len(values[0])
+    if operator == "$toString":
+        return str(values[0])
+    if operator in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte"):
+        a, b = values
+        if operator == "$eq":
+            return a == b
+        if operator == "$ne":
+            return a != b
+        if not _comparable(a, b):
+            # BSON ordering puts null below everything else
+            return operator in ("$gt", "$gte") if b is None and a is not None else False
+        return {"$gt": a > b, "$gte": a >= b, "$lt": a < b, "$lte": a <= b}[operator]
+    if operator == "$and":
+        return all(values)
+    if operator == "$or":
+        return any(values)
+    if operator == "$not":
+        return not values[0]
+    if operator == "$in":
+        return values[0] in values[1]
+    raise NotImplementedError(f"Expression operator {operator} is not supported by the stub")
+
+
+def _project(doc, projection, variables=None):
+    """Apply a find() projection or a $project stage"""
+    if not projection:
+        return doc
+    specs = {key: value for key, value in projection.items()}
+    include_id = specs.pop("_id", 1)
+    exclusion = specs and all(value in (0, False) for value in specs.values())
+    if exclusion or (not specs and include_id in (0, False)):
+        result = copy.deepcopy(doc)
+        for key in specs:
+            _unset_path(result, key)
+        if include_id in (0, False):
+            result.pop("_id", None)
+        return result
+    result = {}
+    if include_id not in (0, False) and "_id" in doc:
+        result["_id"] = doc["_id"] if include_id in (1, True) else evaluate(include_id, doc, variables)
+    for key, value in specs.items():
+        if value in (1, True):
+            top = key.split(".")[0]
+            if top in doc:
+                result[top] = copy.deepcopy(doc[top])
+        else:
+            result[key] = evaluate(value, doc, variables)
+    return result
+
+
+def _sort(docs, keys):
+    if isinstance(keys, dict):
+        keys = list(keys.items())
+    for field, direction in reversed(keys):
+        present = [doc for doc in docs if _get(doc, field) is not None]
+        absent = [doc for doc in docs if _get(doc, field) is None]
+        present.sort(key=lambda doc: _get(doc, field), reverse=direction < 0)
+        docs = absent + present if direction > 0 else present + absent
+    return docs
+
+
+def _apply_update(doc, update, inserting=False):
+    """Apply update operators or an update pipeline to a document in place"""
+    if isinstance(update, list):
+        result = doc
+        for stage in update:
+            result = _run_stage_on_one(result, stage)
+        doc.clear()
+        doc.update(result)
+        return
+    for operator, fields in update.items():
+        fields = _to_bson(fields)
+        for path, value in fields.items():
+            current = _get(doc, path)
+            if operator == "$set":
+                _set_path(doc, path, value)
+            elif operator == "$setOnInsert":
+                if inserting:
+                    _set_path(doc, path, value)
+            elif operator == "$unset":
+                _unset_path(doc, path)
+            elif operator == "$inc":
+                _set_path(doc, path, (current or 0) + value)
+            elif operator == "$min":
+                _set_path(doc, path, value if current is None or value < current else current)
+            elif operator == "$max":
+                _set_path(doc, path, value if current is None or value > current else current)
+            elif operator == "$push":
+                _set_path(doc, path, (current or []) + [value])
+            elif operator == "$pull":
+                _set_path(doc, path, [item for item in current or [] if item != value])
+            elif operator == "$currentDate":
+                _set_path(doc, path, _now())
+            else:
+                raise NotImplementedError(f"Update operator {operator} is not supported by the stub")
+
+
+def _run_stage_on_one(doc, stage):
+    (name, spec), = stage.items()
+    if name in ("$set", "$addFields"):
+        result = copy.deepcopy(doc)
+        for key, expression in spec.items():
+            _set_path(result, key, evaluate(expression, doc))
+        return result
+    if name == "$unset":
+        result = copy.deepcopy(doc)
+        for key in [spec] if isinstance(spec, str) else spec:
+            _unset_path(result, key)
+        return result
+    if name == "$project":
+        return _project(doc, spec)
+    raise NotImplementedError(f"Update pipeline stage {name} is not supported by the stub")
+
+
+def _cosine_scores(vector, docs, path):
+    """Atlas cosine scores, (1 + cosine) / 2, of `vector` against the vectors at `path` of each doc"""
+    query = np.asarray(vector, dtype=np.float64)
+    query /= max(float(np.linalg.norm(query)), 1e-12)
+    scored = []
+    for doc in docs:
+        value = _get(doc, path)
+        if not isinstance(value, list) or len(value) != len(query):
+            continue
+        row = np.asarray(value, dtype=np.float64)
+        norm = float(np.linalg.norm(row))
+        if norm == 0:
+            continue
+        scored.append(((1 + float(row @ query) / norm) / 2, doc))
+    return scored
+
+
+def _search_clauses(spec):
+    """Text queries and filters of an Atlas $search stage (text, or compound with text/equals/range/in)"""
+    texts, filters = [], []
+
+    def collect(operator, clause, filtering):
+        if operator == "text":
+            texts.append((clause["query"], clause["path"]))
+        elif operator == "equals":
+            filters.append({clause["path"]: clause["value"]})
+        elif operator == "in":
+            values = clause["value"] if isinstance(clause["value"], list) else [clause["value"]]
+            filters.append({clause["path"]: {"$in": values}})
+        elif operator == "range":
+            bounds = {f"${key}": value for key, value in clause.items() if key in ("gt", "gte", "lt", "lte")}
+            filters.append({clause["path"]: bounds})
+        elif operator == "compound":
+            for kind in ("must", "should", "filter"):
+                for sub in clause.get(kind, []):
+                    (sub_operator, sub_clause), = ((k, v) for k, v in sub.items() if k != "score")
+                    collect(sub_operator, sub_clause, filtering or kind == "filter")
+        else:
+            raise NotImplementedError(f"$search operator {operator} is not supported by the stub")
+
+    for operator, clause in spec.items():
+        if operator not in ("index", "highlight", "count", "returnStoredSource", "scoreDetails"):
+            collect(operator, clause, False)
+    return texts, filters
+
+
+class StubCursor:
+    """Cursor over a materialized result; the backend latency is paid when iteration starts"""
+
+    def __init__(self, producer, latency):
+        self._producer = producer
+        self._latency = latency
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+        self._iterator = None
+
+    def sort(self, key, direction=pymongo.ASCENDING):
+        self._sort = [(key, direction)] if isinstance(key, str) else list(key)
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def batch_size(self, _size):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._iterator is None:
+            self._latency.sleep()
+            docs = self._producer(self._sort)
+            docs = docs[self._skip:]
+            if self._limit:
+                docs = docs[:self._limit]
+            self._iterator = iter(docs)
+        return next(self._iterator)
+
+    def close(self):
+        self._iterator = iter(())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_change_ids = itertools.count(1)
+
+
+class StubChangeStream:
+    """
+    Change stream delivering insert events that match the pipeline's $match stages. Events are not
+    retained, so resuming starts from the current position.
+    """
+
+    def __init__(self, collection, pipeline, max_await_time_ms=None, **_options):
+        self.collection = collection
+        self.resume_token = _options.get("resume_after")
+        self._queries = [stage["$match"] for stage in pipeline or [] if "$match" in stage]
+        self._events = collections.deque()
+        self._condition = threading.Condition()
+        self._max_await = (max_await_time_ms or 1000) / 1000
+
+    def _publish(self, doc):
+        event = {
+            "_id": {"_data": f"{next(_change_ids):016x}"},
+            "operationType": "insert",
+            "ns": {"db": self.collection.database.name, "coll": self.collection.name},
+            "documentKey": {"_id": doc["_id"]},
+            "fullDocument": copy.deepcopy(doc),
+        }
+        if all(matches(event, query) for query in self._queries):
+            with self._condition:
+                self._events.append(event)
+                self._condition.notify()
+
+    def try_next(self):
+        with self._condition:
+            if not self._events:
+                self._condition.wait(self._max_await)
+            if not self._events:
+                return None
+            event = self._events.popleft()
+        self.resume_token = event["_id"]
+        return event
+
+    def close(self):
+        if self in self.collection._streams:
+            self.collection._streams.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
+
+
+class StubCollection:
+    """In-memory collection implementing the pymongo Collection methods the service calls"""
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self._docs = {}
+        self._tokens = {}
+        self._unique_indexes = []
+        self._search_indexes = {}
+        self._streams = []
+        self._options = {}
+
+    @property
+    def _lock(self):
+        return self.database.lock
+
+    @property
+    def _latency(self):
+        return self.database.client.mongo_latency
+
+    def with_options(self, **_options):
+        return self
+
+    def options(self):
+        return dict(self._options)
+
+    def watch(self, pipeline=None, **options):
+        stream = StubChangeStream(self, pipeline, **options)
+        with self._lock:
+            self._streams.append(stream)
+        return stream
+
+    # Indexes
+
+    def create_index(self, keys, unique=False, **_options):
+        if isinstance(keys, str):
+            keys = [(keys, pymongo.ASCENDING)]
+        if unique:
+            fields = tuple(field for field, _ in keys)
+            if fields not in self._unique_indexes:
+                self._unique_indexes.append(fields)
+        return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+    def create_search_index(self, model):
+        model = getattr(model, "document", model)
+        self._search_indexes[model["name"]] = {
+            "name": model["name"],
+            "type": model.get("type", "search"),
+            "status": "READY",
+            "queryable": True,
+            "latestDefinition": copy.deepcopy(model["definition"]),
+        }
+        return model["name"]
+
+    def list_search_indexes(self, name=None):
+        return [copy.deepcopy(index) for key, index in self._search_indexes.items() if name in (None, key)]
+
+    def update_search_index(self, name, definition):
+        self._search_indexes[name]["latestDefinition"] = copy.deepcopy(definition)
+
+    def drop_search_index(self, name):
+        self._search_indexes.pop(name, None)
+
+    # Storage
+
+    def _check_unique(self, doc, ignore_id=None):
+        if doc["_id"] in self._docs and doc["_id"] != ignore_id:
+            raise pymongo.errors.DuplicateKeyError(f"E11000 duplicate key on _id {doc['_id']}", 11000)
+        for fields in self._unique_indexes:
+            key = [_get(doc, field) for field in fields]
+            for other in self._docs.values():
+                if other["_id"] != doc["_id"] and [_get(other, field) for field in fields] == key:
+                    raise pymongo.errors.DuplicateKeyError(f"E11000 duplicate key on {fields}", 11000)
+
+    def _store(self, doc, replacing=None):
+        self._check_unique(doc, ignore_id=replacing)
+        self._docs[doc["_id"]] = doc
+        self._tokens[doc["_id"]] = None
+
+    def _matching(self, query):
+        return [doc for doc in self._docs.values() if matches(doc, query)]
+
+    def _insert(self, document):
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        doc = _to_bson(document)
+        self._store(doc)
+        for stream in self._streams:
+            stream._publish(doc)
+        return doc["_id"]
+
+    # Writes
+
+    def insert_one(self, document, **_options):
+        self._latency.sleep()
+        with self._lock:
+            return SimpleNamespace(inserted_id=self._insert(document), acknowledged=True)
+
+    def insert_many(self, documents, ordered=True, **_options):
+        self._latency.sleep()
+        inserted, errors = [], []
+        with self._lock:
+            for index, document in enumerate(documents):
+                try:
+                    inserted.append(self._insert(document))
+                except pymongo.errors.DuplicateKeyError as error:
+                    errors.append({"index": index, "code": 11000, "errmsg": str(error)})
+                    if ordered:
+                        break
+        if errors:
+            raise pymongo.errors.BulkWriteError({"writeErrors": errors, "nInserted": len(inserted)})
+        return SimpleNamespace(inserted_ids=inserted, acknowledged=True)
+
+    def _update(self, query, update, upsert, multi):
+        targets = self._matching(query)
+        if not multi:
+            targets = targets[:1]
+        for doc in targets:
+            updated = copy.deepcopy(doc)
+            _apply_update(updated, update)
+            updated["_id"] = doc["_id"]
+            self._store(updated, replacing=doc["_id"])
+        upserted_id = None
+        if not targets and upsert:
+            doc = {
+                key: _to_bson(value)
+                for key, value in query.items()
+                if not key.startswith("$") and not (isinstance(value, dict) and any(k.startswith("$") for k in value))
+            }
+            _apply_update(doc, update, inserting=True)
+            upserted_id = self._insert(doc)
+        return SimpleNamespace(
+            matched_count=len(targets), modified_count=len(targets), upserted_id=upserted_id, acknowledged=True
+        )
+
+    def update_one(self, filter, update, upsert=False, **_options):
+        self._latency.sleep()
+        with self._lock:
+            return self._update(filter, update, upsert, multi=False)
+
+    def update_many(self, filter, update, upsert=False, **_options):
+        self._latency.sleep()
+        with self._lock:
+            return self._update(filter, update, upsert, multi=True)
+
+    def replace_one(self, filter, replacement, upsert=False, **_options):
+        self._latency.sleep()
+        with self._lock:
+            targets = self._matching(filter)[:1]
+            if targets:
+                doc = _to_bson(replacement)
+                doc["_id"] = targets[0]["_id"]
+                self._store(doc, replacing=doc["_id"])
+                return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+            upserted_id = self._insert(dict(replacement)) if upsert else None
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=upserted_id)
+
+    def find_one_and_update(
+        self, filter, update, projection=None, sort=None, upsert=False,
+        return_document=pymongo.ReturnDocument.BEFORE, **_options
+    ):
+        self._latency.sleep()
+        with self._lock:
+            targets = _sort(self._matching(filter), sort) if sort else self._matching(filter)
+            if not targets:
+                if not upsert:
+                    return None
+                result = self._update(filter, update, True, multi=False)
+                doc = self._docs[result.upserted_id]
+                return _project(copy.deepcopy(doc), projection) if return_document else None
+            before = copy.deepcopy(targets[0])
+            self._update({"_id": before["_id"]}, update, False, multi=False)
+            doc = self._docs[before["_id"]] if return_document else before
+            return _project(copy.deepcopy(doc), projection)
+
+    def delete_one(self, filter, **_options):
+        self._latency.sleep()
+        with self._lock:
+            targets = self._matching(filter)[:1]
+            for doc in targets:
+                del self._docs[doc["_id"]]
+                self._tokens.pop(doc["_id"], None)
+            return SimpleNamespace(deleted_count=len(targets))
+
+    def delete_many(self, filter, **_options):
+        self._latency.sleep()
+        with self._lock:
+            targets = self._matching(filter)
+            for doc in targets:
+                del self._docs[doc["_id"]]
+                self._tokens.pop(doc["_id"], None)
+            return SimpleNamespace(deleted_count=len(targets))
+
+    def bulk_write(self, requests, ordered=True, **_options):
+        self._latency.sleep()
+        matched = modified = inserted = upserted = 0
+        with self._lock:
+            for request in requests:
+                kind = type(request).__name__
+                if kind == "InsertOne":
+                    self._insert(request._doc)
+                    inserted += 1
+                elif kind in ("UpdateOne", "UpdateMany"):
+                    result = self._update(request._filter, request._doc, request._upsert, multi=kind == "UpdateMany")
+                    matched += result.matched_count
+                    modified += result.modified_count
+                    upserted += result.upserted_id is not None
+                elif kind == "ReplaceOne":
+                    targets = self._matching(request._filter)[:1]
+                    if targets:
+                        doc = _to_bson(request._doc)
+                        doc["_id"] = targets[0]["_id"]
+                        self._store(doc, replacing=doc["_id"])
+                        matched += 1
+                        modified += 1
+                    elif request._upsert:
+                        self._insert(dict(request._doc))
+                        upserted += 1
+                elif kind in ("DeleteOne", "DeleteMany"):
+                    targets = self._matching(request._filter)
+                    for doc in targets[:1] if kind == "DeleteOne" else targets:
+                        del self._docs[doc["_id"]]
+                else:
+                    raise NotImplementedError(f"Bulk operation {kind} is not supported by the stub")
+        return SimpleNamespace(
+            matched_count=matched, modified_count=modified, inserted_count=inserted, upserted_count=upserted
+        )
+
+    # Reads
+
+    def find(self, filter=None, projection=None, **_options):
+        def produce(sort):
+            with self._lock:
+                docs = self._matching(filter)
+                if sort:
+                    docs = _sort(docs, sort)
+                return [_project(copy.deepcopy(doc), projection) for doc in docs]
+
+        return StubCursor(produce, self._latency)
+
+    def find_one(self, filter=None, projection=None, sort=None, **_options):
+        cursor = self.find(filter, projection)
+        if sort:
+            cursor.sort(sort)
+        return next(cursor.limit(1), None)
+
+    def count_documents(self, filter, **_options):
+        self._latency.sleep()
+        with self._lock:
+            return len(self._matching(filter))
+
+    def estimated_document_count(self, **_options):
+        return len(self._docs)
+
+    def distinct(self, key, filter=None, **_options):
+        self._latency.sleep()
+        with self._lock:
+            values = []
+            for doc in self._matching(filter):
+                value = _get(doc, key)
+                for item in value if isinstance(value, list) else [value]:
+                    if item is not None and item not in values:
+                        values.append(item)
+            return values
+
+    def aggregate(self, pipeline, **_options):
+        def produce(_sort):
+            with self._lock:
+                return [
+                    {key: value for key, value in doc.items() if not key.startswith("__")}
+                    for doc in self._run_pipeline(None, pipeline)
+                ]
+
+        return StubCursor(produce, self._latency)
+
+    # Aggregation
+
+    def _run_pipeline(self, docs, pipeline):
+        for stage in pipeline:
+            (name, spec), = stage.items()
+            if docs is None and name not in ("$vectorSearch", "$search", "$documents"):
+                docs = [copy.deepcopy(doc) for doc in self._docs.values()]
+            docs = getattr(self, f"_stage_{name[1:]}")(docs, spec)
+        return docs if docs is not None else [copy.deepcopy(doc) for doc in self._docs.values()]
+
+    def _stage_vectorSearch(self, _docs, spec):
+        if bool(spec.get("exact")) == ("numCandidates" in spec):
+            raise pymongo.errors.OperationFailure("$vectorSearch takes numCandidates for ANN or exact: true for ENN")
+        candidates = [doc for doc in self._docs.values() if matches(doc, spec.get("filter"))]
+        scored = sorted(_cosine_scores(spec["queryVector"], candidates, spec["path"]), key=lambda item: -item[0])
+        results = []
+        for score, doc in scored[:spec["limit"]]:
+            result = copy.deepcopy(doc)
+            result["__vectorSearchScore"] = score
+            results.append(result)
+        return results
+
+    def _stage_search(self, _docs, spec):
+        texts, filters = _search_clauses(spec)
+        results = []
+        for doc in self._docs.values():
+            if not all(matches(doc, clause) for clause in filters):
+                continue
+            score = 0.0
+            for query, path in texts:
+                doc_tokens = self._tokens.get(doc["_id"])
+                if doc_tokens is None:
+                    doc_tokens = self._tokens[doc["_id"]] = set(_tokens(_get(doc, path) or ""))
+                score += sum(1.0 for token in set(_tokens(query)) if token in doc_tokens)
+            if score > 0 or not texts:
+                result = copy.deepcopy(doc)
+                result["__searchScore"] = score
+                results.append(result)
+        return sorted(results, key=lambda doc: -doc["__searchScore"])
+
+    def _stage_documents(self, _docs, spec):
+        return copy.deepcopy(_to_bson(spec))
+
+    def _stage_match(self, docs, spec):
+        return [doc for doc in docs if matches(doc, spec)]
+
+    def _stage_addFields(self, docs, spec):
+        results = []
+        for doc in docs:
+            result = dict(doc)
+            for key, expression in spec.items():
+                _set_path(result, key, evaluate(expression, doc))
+            results.append(result)
+        return results
+
+    _stage_set = _stage_addFields
+
+    def _stage_project(self, docs, spec):
+        return [{**_project(doc, spec), **{k: v for k, v in doc.items() if k.startswith("__")}} for doc in docs]
+
+    def _stage_unset(self, docs, spec):
+        return [_run_stage_on_one(doc, {"$unset": spec}) for doc in docs]
+
+    def _stage_sort(self, docs, spec):
+        return _sort(docs, spec)
+
+    def _stage_limit(self, docs, spec):
+        return docs[:spec]
+
+    def _stage_skip(self, docs, spec):
+        return docs[spec:]
+
+    def _stage_sample(self, docs, spec):
+        return random.sample(docs, min(spec["size"], len(docs)))
+
+    def _stage_count(self, docs, spec):
+        return [{spec: len(docs)}]
+
+    def _stage_replaceWith(self, docs, spec):
+        return [evaluate(spec, doc) for doc in docs]
+
+    def _stage_setWindowFields(self, docs, spec):
+        if "partitionBy" in spec or "sortBy" in spec:
+            raise NotImplementedError("Only unpartitioned, unsorted $setWindowFields is supported by the stub")
+        outputs = {}
+        for field, accumulator in spec["output"].items():
+            (operator, expression), = ((k, v) for k, v in accumulator.items() if k != "window")
+            values = [evaluate(expression, doc) for doc in docs]
+            outputs[field] = _accumulate(operator, values)
+        return [{**doc, **outputs} for doc in docs]
+
+    def _stage_group(self, docs, spec):
+        groups = {}
+        for doc in docs:
+            key = evaluate(spec["_id"], doc)
+            hashable = json.dumps(key, default=str, sort_keys=True)
+            groups.setdefault(hashable, (key, []))[1].append(doc)
+        results = []
+        for key, members in groups.values():
+            result = {"_id": key}
+            for field, accumulator in spec.items():
+                if field == "_id":
+                    continue
+                (operator, expression), = accumulator.items()
+                result[field] = _accumulate(operator, [evaluate(expression, doc) for doc in members])
+            results.append(result)
+        return results
+
+    def _stage_unionWith(self, docs, spec):
+        if isinstance(spec, str):
+            spec = {"coll": spec}
+        other = self.database[spec["coll"]]
+        return docs + other._run_pipeline(None, spec.get("pipeline", []))
+
+    def _stage_lookup(self, docs, spec):
+        other = self.database[spec["from"]]
+        results = []
+        for doc in docs:
+            local = _get(doc, spec["localField"])
+            joined = [copy.deepcopy(o) for o in other._docs.values() if _equals(_lookup(o, spec["foreignField"]), local)]
+            results.append({**doc, spec["as"]: joined})
+        return results
+
+    def _stage_graphLookup(self, docs, spec):
+        other = self.database[spec["from"]]
+        results = []
+        for doc in docs:
+            found, seen = [], set()
+            frontier = evaluate(spec["startWith"], doc)
+            frontier = frontier if isinstance(frontier, list) else [frontier]
+            depth = 0
+            while frontier and depth <= spec.get("maxDepth", math.inf):
+                next_frontier = []
+                for match in other._docs.values():
+                    if match["_id"] in seen or not any(_equals(_lookup(match, spec["connectToField"]), v) for v in frontier):
+                        continue
+                    seen.add(match["_id"])
+                    joined = copy.deepcopy(match)
+                    if "depthField" in spec:
+                        joined[spec["depthField"]] = depth
+                    found.append(joined)
+                    next_frontier.append(_get(match, spec["connectFromField"]))
+                frontier = [value for value in next_frontier if value is not None]
+                depth += 1
+            results.append({**doc, spec["as"]: found})
+        return results
+
+
+def _accumulate(operator, values):
+    present = [value for value in values if value is not None]
+    if operator == "$max":
+        return max(present) if present else None
+    if operator == "$min":
+        return min(present) if present else None
+    if operator == "$first":
+        return values[0] if values else None
+    if operator == "$last":
+        return values[-1] if values else None
+    if operator == "$sum":
+        return sum(value for value in present if isinstance(value, (int, float)))
+    if operator == "$avg":
+        numbers = [value for value in present if isinstance(value, (int, float))]
+        return sum(numbers) / len(numbers) if numbers else None
+    if operator == "$push":
+        return values
+    if operator == "$addToSet":
+        return [value for index, value in enumerate(values) if value not in values[:index]]
+    raise NotImplementedError(f"Accumulator {operator} is not supported by the stub")
+
+
+class StubDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.lock = threading.RLock()
+        self._collections = {}
+        self._created = set()
+
+    def __getitem__(self, name):
+        with self.lock:
+            if name not in self._collections:
+                self._collections[name] = StubCollection(self, name)
+            return self._collections[name]
+
+    __getattr__ = __getitem__
+
+    def with_options(self, **_options):
+        return self
+
+    def get_collection(self, name, **_options):
+        return self[name]
+
+    def list_collection_names(self, **_options):
+        return sorted(self._created)
+
+    def create_collection(self, name, **options):
+        if name in self._created:
+            raise pymongo.errors.CollectionInvalid(f"collection {name} already exists")
+        self._created.add(name)
+        self[name]._options = options
+        return self[name]
+
+    def drop_collection(self, name, **_options):
+        self._created.discard(name)
+        self._collections.pop(name, None)
+
+    def aggregate(self, pipeline, **options):
+        return self["$cmd.aggregate"].aggregate(pipeline, **options)
+
+    def command(self, command, *_args, **_options):
+        return {"ok": 1}
+
+
+class StubSession:
+    """Stand-in for a pymongo ClientSession; the stub has a single member, so reads are always causal"""
+
+    def __init__(self):
+        self.cluster_time = None
+        self.operation_time = None
+        self.has_ended = False
+
+    def advance_cluster_time(self, cluster_time):
+        self.cluster_time = cluster_time
+
+    def advance_operation_time(self, operation_time):
+        self.operation_time = operation_time
+
+    def end_session(self):
+        self.has_ended = True
+
+
+class StubMongoClient:
+    """Stand-in for pymongo.MongoClient; databases persist for the lifetime of the client"""
+
+    def __init__(self, mongo_latency=None):
+        self.mongo_latency = mongo_latency or Latency(0)
+        self._databases = {}
+
+    def start_session(self, **_options):
+        return StubSession()
+
+    def __getitem__(self, name):
+        if name not in self._databases:
+            self._databases[name] = StubDatabase(self, name)
+        return self._databases[name]
+
+    def get_database(self, name, **_options):
+        return self[name]
+
+    def close(self):
+        pass
+
+
+def stub_embedding(text, dimensions=1536):
+    """
+    Deterministic embedding hashing each word of `text` to a signed bucket, so texts sharing words get
+    similar vectors the way real embeddings of related texts do.
+    """
+    vector = np.zeros(dimensions, dtype=np.float64)
+    for token in _tokens(text):
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dimensions
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = float(np.linalg.norm(vector))
+    if norm == 0:
+        vector[0] = 1.0
+        norm = 1.0
+    return (vector / norm).tolist()
+
+
+class StubBedrockClient:
+    """Stand-in for the bedrock-runtime client: hashed embeddings and canned Converse replies"""
+
+    def __init__(self, embedding_latency=None, llm_latency=None, dimensions=1536):
+        self.embedding_latency = embedding_latency or Latency(0)
+        self.llm_latency = llm_latency or Latency(0)
+        self.dimensions = dimensions
+        self._prompt_cache = set()
+
+    def invoke_model(self, modelId, body, **_options):
+        self.embedding_latency.sleep()
+        payload = json.loads(body)
+        embedding = stub_embedding(payload["inputText"], payload.get("dimensions", self.dimensions))
+        response = {"embedding": embedding, "inputTextTokenCount": len(_tokens(payload["inputText"]))}
+        return {"body": io.BytesIO(json.dumps(response).encode("utf-8")), "contentType": "application/json"}
+
+    def converse(self, modelId, messages, system=None, **_options):
+        self.llm_latency.sleep()
+        blocks = list(system or []) + [block for message in messages for block in message["content"]]
+        prompt = " ".join(block["text"] for block in blocks if "text" in block)
+        if "scale of 1-10" in prompt:
+            text = str(5 + len(prompt) % 5)
+        else:
+            text = "Summary: " + " ".join(prompt.split()[-40:])
+        # Prompt cache: the prefix up to each cache point is cached once it is long enough, and a call reads the
+        # longest of its prefixes sent before and writes the rest up to its last cacheable cache point
+        prefixes = [
+            " ".join(block["text"] for block in blocks[:index] if "text" in block)
+            for index, block in enumerate(blocks) if "cachePoint" in block
+        ]
+        cacheable = [(prefix, len(_tokens(prefix))) for prefix in prefixes]
+        cacheable = [(prefix, tokens) for prefix, tokens in cacheable if tokens >= PROMPT_CACHE_MIN_TOKENS]
+        read_tokens = max((tokens for prefix, tokens in cacheable if prefix in self._prompt_cache), default=0)
+        cached_tokens = max((tokens for _prefix, tokens in cacheable), default=0)
+        self._prompt_cache.update(prefix for prefix, _count in cacheable)
+        input_tokens = len(_tokens(prompt)) - cached_tokens
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": text}]}},
+            "stopReason": "end_turn",
+            "usage": {
+                "inputTokens": input_tokens,
+                "outputTokens": len(text.split()),
+                "totalTokens": input_tokens + cached_tokens + len(text.split()),
+                "cacheReadInputTokens": read_tokens,
+                "cacheWriteInputTokens": cached_tokens - read_tokens,
+            },
+            "metrics": {"latencyMs": int(self.llm_latency.mean_ms)},
+        }
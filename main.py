@@ -1,20 +1,25 @@
+import hmac
+import asyncio
+import datetime
 import uvicorn
-from fastapi import FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
 import config
 from database.mongodb import initialize_mongodb
+from database.read_routing import read_metrics
+from database.search_scope import SearchScope
 
 # Import models and services
-from models.pydantic_models import ErrorResponse, MessageInput
-from services.bedrock_service import generate_embedding
-from services.conversation_service import (
-    add_conversation_message,
-    generate_conversation_summary,
-    get_conversation_context,
-    search_memory,
-)
-from services.memory_service import find_similar_memories
+from models.pydantic_models import BatchRetrieveRequest, ErrorResponse, MessageInput
+from services.bedrock_service import token_usage
+from services.conversation_service import add_conversation_message
+from services.retrieval_service import retrieve, retrieve_batch
+from services.snapshot_service import SnapshotRestore, snapshot_user
 from utils import error_utils
+from utils.admission import AdmissionRejected, ingest_admission, retrieve_admission
+from utils.profiler import ProfilingMiddleware, profiler
+from utils.snapshot_format import ENCODINGS, FrameReader
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -24,11 +29,22 @@ app = FastAPI(
     docs_url="/docs",
     redoc_url="/redoc",
 )
+app.add_middleware(ProfilingMiddleware)
 
 # Initialize MongoDB on startup
 initialize_mongodb()
 
 
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request, error):
+    """Shed requests are answered at once with 429 and the time after which a retry is likely to succeed"""
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": str(error)},
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -36,76 +52,160 @@ async def health_check():
 
 
 @app.post("/conversation/")
-async def add_message(message: MessageInput):
+async def add_message(
+    message: MessageInput, idempotency_key: str | None = Header(None, max_length=255)
+):
     """Add a message to the conversation history"""
+    async with ingest_admission.admit(message.user_id):
+        try:
+            if idempotency_key and not message.idempotency_key:
+                message.idempotency_key = idempotency_key
+            return await add_conversation_message(message)
+        except Exception as error:
+            error_response = error_utils.handle_exception(error)
+            return HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=ErrorResponse(**error_response),
+            )
+
+
+def search_scope(conversation_id=None, message_type=None, start=None, end=None):
+    """SearchScope of a request, rejecting an inverted time window"""
     try:
-        return await add_conversation_message(message)
-    except Exception as error:
-        error_response = error_utils.handle_exception(error)
-        return HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=ErrorResponse(**error_response),
-        )
+        return SearchScope(conversation_id, message_type, start, end)
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
 
 
 @app.get("/retrieve_memory/")
-async def retrieve_memory(user_id: str, text: str):
+async def retrieve_memory(
+    user_id: str,
+    text: str,
+    timeout: float | None = Query(None, gt=0),
+    conversation_id: str | None = Query(None, min_length=1),
+    type: str | None = Query(None, pattern="^(human|ai)$"),
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+    top_n: int = Query(config.SIMILAR_MEMORIES_TOP_N, ge=1, le=config.SIMILAR_MEMORIES_MAX_TOP_N),
+):
     """
-    Retrieve memory items, context, summary, and similar memory nodes in a single request
+    Retrieve memory items, context, summary, and similar memory nodes in a single request.
+    `timeout` is the latency budget in seconds; partial results are returned when it runs out.
+    `conversation_id`, `type` and the `start`/`end` time window (ISO 8601, UTC unless an offset is
+    given) narrow the search to matching messages and memories. `top_n` is the number of similar memory
+    nodes returned, best first by a blend of similarity, importance and recency.
     """
-    try:
-        # Generate embedding for the query text
-        vector_query = generate_embedding(text)
-
-        # Search for relevant memory items
-        memory_items = await search_memory(user_id, text)
-
-        # Get similar memory nodes from the memory tree
-        similar_memories = await find_similar_memories(user_id, vector_query)
-
-        if memory_items["documents"] == "No documents found":
-            return {
-                "related_conversation": "No conversation found",
-                "conversation_summary": "No summary found",
-                "similar_memories": (
-                    similar_memories
-                    if similar_memories
-                    else "No similar memories found"
-                ),
-            }
-
-        # Extract conversation ID from the first memory item
-        object_id = memory_items["documents"][0]["_id"]
-
-        # Retrieve conversation context around the matching memory item
-        context = await get_conversation_context(object_id)
-
-        # Generate a detailed summary for the conversation
-        summary = await generate_conversation_summary(context["documents"])
-
-        memories = [
-            {
-                "content": memory["content"],
-                "summary": memory["summary"],
-                "similarity": memory["similarity"],
-                "importance": memory["effective_importance"],
-            }
-            for memory in similar_memories
-        ]
-
-        result = {
-            "related_conversation": context["documents"],
-            "conversation_summary": summary["summary"],
-            "similar_memories": memories if memories else "No similar memories found",
-        }
-
-        return result
-    except Exception as error:
-        error_response = error_utils.handle_exception(error)
-        return HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=ErrorResponse(**error_response),
+    scope = search_scope(conversation_id, type, start, end)
+    async with retrieve_admission.admit(user_id):
+        try:
+            return await retrieve(user_id, text, timeout, scope, top_n)
+        except Exception as error:
+            error_response = error_utils.handle_exception(error)
+            return HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=ErrorResponse(**error_response),
+            )
+
+
+@app.post("/retrieve_memory/batch")
+async def retrieve_memory_batch(request: BatchRetrieveRequest):
+    """
+    Retrieve for several (user_id, text) queries, each optionally scoped like /retrieve_memory/, in one
+    request; `results` are in request order, each shaped like a /retrieve_memory/ response. `timeout` is
+    the latency budget of the whole batch.
+    """
+    queries = [
+        (
+            query.user_id, query.text, search_scope(query.conversation_id, query.type, query.start, query.end),
+            query.top_n,
         )
+        for query in request.queries
+    ]
+    # A batch takes one retrieval slot; it counts against a user's limit when all its queries are theirs
+    user_ids = {query.user_id for query in request.queries}
+    async with retrieve_admission.admit(user_ids.pop() if len(user_ids) == 1 else None):
+        try:
+            return {"results": await retrieve_batch(queries, request.timeout)}
+        except Exception as error:
+            error_response = error_utils.handle_exception(error)
+            return HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=ErrorResponse(**error_response),
+            )
+
+
+def require_admin(x_admin_token: str | None = Header(None)):
+    """Reject admin requests that do not carry the configured ADMIN_TOKEN"""
+    if not config.ADMIN_TOKEN or not hmac.compare_digest(
+        (x_admin_token or "").encode(), config.ADMIN_TOKEN.encode()
+    ):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin token required")
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles(path: str | None = None):
+    """Summaries of recently profiled requests, newest first"""
+    return [
+        profile.summary(profiler.interval_ms)
+        for profile in reversed(profiler.recent)
+        if path in (None, profile.path)
+    ]
+
+
+@app.get("/admin/profiles/collapsed", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def merged_profile(path: str | None = None):
+    """Collapsed stacks of all recent profiles (optionally of one path) added together, for a flame graph"""
+    return profiler.merged(path)
+
+
+@app.get("/admin/profiles/{profile_id}", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    """Collapsed stacks of one profiled request"""
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    return profile.collapsed()
+
+
+@app.get("/admin/read_metrics", dependencies=[Depends(require_admin)])
+async def get_read_metrics():
+    """How MongoDB reads and writes of this process were split between primary and secondaries"""
+    return read_metrics.snapshot()
+
+
+@app.get("/admin/llm_usage", dependencies=[Depends(require_admin)])
+async def get_llm_usage():
+    """LLM token usage of this process per kind of prompt, including prompt cache reads and writes"""
+    return token_usage.snapshot()
+
+
+@app.get("/admin/admission", dependencies=[Depends(require_admin)])
+async def get_admission():
+    """Running and queued requests, and admissions and rejections so far, per admission pool of this process"""
+    return {pool.name: pool.snapshot() for pool in (ingest_admission, retrieve_admission)}
+
+
+@app.get("/admin/snapshot/{user_id}", dependencies=[Depends(require_admin)])
+async def get_snapshot(user_id: str, encoding: str = config.SNAPSHOT_VECTOR_ENCODING):
+    """Stream a snapshot of a user's conversations and memories, to load with POST /admin/snapshot"""
+    if encoding not in ENCODINGS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"encoding must be one of {ENCODINGS}")
+    return StreamingResponse(snapshot_user(user_id, encoding), media_type="application/octet-stream")
+
+
+@app.post("/admin/snapshot", dependencies=[Depends(require_admin)])
+async def restore_snapshot(request: Request):
+    """Restore a snapshot sent as the request body, frame by frame as it arrives"""
+    reader, restore = FrameReader(), SnapshotRestore()
+    try:
+        async for chunk in request.stream():
+            for frame in reader.feed(chunk):
+                # Inserting a frame's documents blocks, keep it off the event loop
+                await asyncio.to_thread(restore.apply, frame)
+        reader.close()
+        return await asyncio.to_thread(restore.finish)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 
 if __name__ == "__main__":
@@ -114,4 +214,6 @@ if __name__ == "__main__":
         host=config.SERVICE_HOST,
         port=config.SERVICE_PORT,
         reload=config.DEBUG,
+        # Keep uvicorn's loggers on the root handler, so the log format, queue and LOG_* filters apply to them
+        log_config=None,
     )
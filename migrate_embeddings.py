@@ -0,0 +1,58 @@
+import argparse
+import asyncio
+import json
+
+import config
+from services.embedding_migration_service import (
+    abort_migration, backfill, cutover, drop_retired, migration_status, start_migration
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Migrate stored vectors to another embedding model or size without downtime: new vector indexes "
+            "are built next to the live ones, the new vectors are backfilled into a shadow field while the "
+            "service writes both, and reads switch over once the backfill completes."
+        )
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    start = commands.add_parser("start", help="Create the new indexes and start writing new vectors alongside the active ones")
+    run_all = commands.add_parser("run", help="start, backfill and cutover in one go")
+    backfill_only = commands.add_parser("backfill", help="Embed stored documents missing a vector of the running migration (resumable)")
+    cutover_only = commands.add_parser("cutover", help="Finish the backfill, wait for the new indexes and switch reads over")
+    commands.add_parser("status", help="Show the active, migrating and retired embedding spaces")
+    commands.add_parser("abort", help="Stop the running migration and drop its indexes")
+    commands.add_parser("drop-retired", help="Delete the vectors and indexes of spaces replaced by a cutover")
+    for command in (start, run_all):
+        command.add_argument("--model-id", required=True, help="Embedding model, e.g. amazon.titan-embed-text-v2:0")
+        command.add_argument("--dimensions", type=int, required=True, help="Vector size, e.g. 256, 512 or 1024 for Titan v2")
+        command.add_argument("--field", help="Shadow field for the new vectors (default: embeddings_<dimensions>)")
+    for command in (run_all, backfill_only, cutover_only):
+        command.add_argument("--batch-size", type=int, default=config.REEMBED_BATCH_SIZE)
+        command.add_argument("--concurrency", type=int, default=config.REEMBED_CONCURRENCY)
+        command.add_argument(
+            "--rate-limit", type=float, default=config.REEMBED_RATE_LIMIT, help="Embedding requests per second (0 = unlimited)"
+        )
+    return parser.parse_args()
+
+
+async def run(args):
+    if args.command in ("start", "run"):
+        print(f"Migrating to {start_migration(args.model_id, args.dimensions, args.field)}")
+    if args.command in ("run", "backfill", "cutover"):
+        options = {"batch_size": args.batch_size, "concurrency": args.concurrency, "rate_limit": args.rate_limit}
+        if args.command != "cutover":
+            for collection_name, checkpoint in (await backfill(**options)).items():
+                print(f"{collection_name}: processed={checkpoint['processed']} completed={checkpoint['completed']}")
+        if args.command != "backfill":
+            print(f"Active embedding space is now {await cutover(**options)}")
+    elif args.command == "abort":
+        print(f"Aborted migration to {abort_migration()}")
+    elif args.command == "drop-retired":
+        print(f"Dropped {drop_retired()}")
+    print(json.dumps(migration_status(), indent=2, default=str))
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -1,6 +1,7 @@
 import datetime
 from typing import Optional, List
 from pydantic import BaseModel, Field
+from config import RETRIEVE_BATCH_MAX_QUERIES, SIMILAR_MEMORIES_TOP_N, SIMILAR_MEMORIES_MAX_TOP_N
 
 class MessageInput(BaseModel):
     user_id: str = Field(..., min_length=1, description="User ID cannot be empty")
@@ -8,14 +9,33 @@ class MessageInput(BaseModel):
     type: str = Field(..., pattern="^(human|ai)$", description="Must be 'human' or 'ai'")
     text: str = Field(..., min_length=1, description="Message text cannot be empty.")
     timestamp: str | None = Field(None, description="UTC timestamp (optional)")
+    idempotency_key: str | None = Field(
+        None, max_length=255, description="Key making retries of this request safe (optional)"
+    )
 
 class SearchRequest(BaseModel):
     user_id: str = Field(..., description="User ID")
     query: str = Field(..., description="Search query")
 
+class RetrieveQuery(BaseModel):
+    user_id: str = Field(..., min_length=1, description="User ID cannot be empty")
+    text: str = Field(..., min_length=1, description="Query text cannot be empty")
+    conversation_id: str | None = Field(None, min_length=1, description="Only search this conversation (optional)")
+    type: str | None = Field(None, pattern="^(human|ai)$", description="Only search messages of this type (optional)")
+    start: datetime.datetime | None = Field(None, description="Only search from this time on (optional)")
+    end: datetime.datetime | None = Field(None, description="Only search up to this time (optional)")
+    top_n: int = Field(
+        SIMILAR_MEMORIES_TOP_N, ge=1, le=SIMILAR_MEMORIES_MAX_TOP_N, description="Number of similar memories to return"
+    )
+
+class BatchRetrieveRequest(BaseModel):
+    queries: List[RetrieveQuery] = Field(..., min_length=1, max_length=RETRIEVE_BATCH_MAX_QUERIES)
+    timeout: float | None = Field(None, gt=0, description="Latency budget in seconds for the whole batch (optional)")
+
 class RememberRequest(BaseModel):
     user_id: str = Field(..., description="User ID")
     content: str = Field(..., description="Content to remember")
+    conversation_id: str | None = Field(None, description="Conversation the content comes from (optional)")
 
 class MemoryNode(BaseModel):
     """Hierarchical memory node with importance scoring"""
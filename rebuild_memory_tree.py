@@ -0,0 +1,26 @@
+import argparse
+import asyncio
+
+from database.mongodb import memory_nodes
+from services.memory_tree_service import rebuild_memory_tree
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Rebuild memory trees from their leaf memories (after upgrading or re-embedding)."
+    )
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--user-id", help="Rebuild the tree of a single user")
+    target.add_argument("--all", action="store_true", help="Rebuild the trees of all users")
+    return parser.parse_args()
+
+
+async def run(args):
+    user_ids = [args.user_id] if args.user_id else memory_nodes.distinct("user_id")
+    for user_id in user_ids:
+        clusters = await rebuild_memory_tree(user_id)
+        print(f"{user_id}: {clusters} clusters")
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,71 @@
+import argparse
+import asyncio
+
+import config
+from services.reembed_service import SOURCE_FIELDS, create_shadow_index, reembed_collection
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Re-embed stored conversations, memory nodes and rollups with the active (or given) embedding model."
+    )
+    parser.add_argument(
+        "--collection",
+        choices=list(SOURCE_FIELDS) + ["all"],
+        default="all",
+        help="Collection to re-embed (default: all)",
+    )
+    parser.add_argument("--model-id", help="Embedding model ID (default: that of the active embedding space)")
+    parser.add_argument(
+        "--target-field",
+        default="embeddings",
+        help="Field to write vectors to; use a shadow field (e.g. embeddings_v2) for zero-downtime cutover",
+    )
+    parser.add_argument("--batch-size", type=int, default=config.REEMBED_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=config.REEMBED_CONCURRENCY)
+    parser.add_argument(
+        "--rate-limit", type=float, default=config.REEMBED_RATE_LIMIT, help="Embedding requests per second (0 = unlimited)"
+    )
+    parser.add_argument("--only-missing", action="store_true", help="Skip documents that already have the target field")
+    parser.add_argument("--reset", action="store_true", help="Discard the saved checkpoint and start over")
+    parser.add_argument(
+        "--create-index",
+        metavar="INDEX_NAME",
+        help="Create a vector search index with this name over the target field before backfilling",
+    )
+    parser.add_argument(
+        "--dimensions",
+        type=int,
+        default=config.EMBEDDING_DIMENSIONS,
+        help="Output dimensions for models that support several (e.g. Titan v2), and for --create-index",
+    )
+    return parser.parse_args()
+
+
+async def run(args):
+    collections = list(SOURCE_FIELDS) if args.collection == "all" else [args.collection]
+    for collection_name in collections:
+        if args.create_index:
+            index_name = args.create_index
+            if len(collections) > 1:
+                index_name = f"{collection_name}_{args.create_index}"
+            create_shadow_index(collection_name, index_name, args.target_field, args.dimensions)
+        checkpoint = await reembed_collection(
+            collection_name,
+            target_field=args.target_field,
+            model_id=args.model_id,
+            dimensions=args.dimensions if args.model_id else None,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            rate_limit=args.rate_limit,
+            only_missing=args.only_missing,
+            reset=args.reset,
+        )
+        print(
+            f"{collection_name}: processed={checkpoint['processed']} "
+            f"skipped={checkpoint['skipped']} completed={checkpoint['completed']}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,151 @@
+import json
+import datetime
+import pymongo
+import pymongo.errors
+from bson import json_util
+from config import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE
+from database.embedding_space import active_space, vector_projection
+from database.mongodb import conversations, conversation_rollups, conversation_archive
+from database.archive_layout import archive_filter, archive_is_timeseries, to_archive_document
+from services.bedrock_service import generate_embedding, migration_embeddings, send_to_bedrock
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Instructions of rollup prompts; the same on every call, so Bedrock can cache them
+ROLLUP_SUMMARY_INSTRUCTIONS = (
+    "You maintain a long-term summary of an archived conversation. "
+    "Update the existing summary with the new messages so that it captures the topic, key facts, "
+    "user preferences, decisions made and unresolved questions. Keep it concise and self-contained; "
+    "respond with the updated summary only.\n"
+)
+
+
+async def summarize_for_rollup(previous_summary, messages):
+    """Fold newly archived messages into the running rollup summary of a conversation"""
+    transcript = json.dumps(
+        [{"type": m["type"], "text": m["text"], "timestamp": m["timestamp"]} for m in messages],
+        default=json_util.default,
+    )
+    prompt = f"Existing summary: {previous_summary or 'None'}\n\nNew messages (JSON): {transcript}"
+    return await send_to_bedrock(prompt, instructions=ROLLUP_SUMMARY_INSTRUCTIONS, name="rollup_summary")
+
+
+def _copy_to_archive(user_id, conversation_id, messages):
+    """Copy raw messages (without vectors) into the archive, tolerating rows copied by an earlier run"""
+    if archive_is_timeseries():
+        # Time-series collections do not enforce unique _ids, so skip rows a crashed pass already copied
+        copied = {
+            doc["_id"]
+            for doc in conversation_archive.find(
+                {
+                    **archive_filter(user_id, conversation_id),
+                    "timestamp": {"$gte": messages[0]["timestamp"], "$lte": messages[-1]["timestamp"]},
+                    "_id": {"$in": [m["_id"] for m in messages]},
+                },
+                projection={"_id": 1},
+            )
+        }
+        messages = [m for m in messages if m["_id"] not in copied]
+        if messages:
+            conversation_archive.insert_many([to_archive_document(m) for m in messages], ordered=False)
+        return
+    try:
+        conversation_archive.insert_many(messages, ordered=False)
+    except pymongo.errors.BulkWriteError as e:
+        non_duplicate = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+        if non_duplicate:
+            raise
+
+
+async def archive_conversation(user_id, conversation_id, cutoff):
+    """
+    Roll up and archive the messages of one conversation older than `cutoff`.
+
+    The rollup keeps `archived_until`, the newest timestamp already folded into its summary, so a
+    pass that crashed between writing the rollup and deleting the hot messages can be re-run
+    without summarizing the same messages twice.
+    """
+    messages = list(
+        conversations.find(
+            {"user_id": user_id, "conversation_id": conversation_id, "timestamp": {"$lt": cutoff}},
+            projection=vector_projection(),
+        ).sort("timestamp", pymongo.ASCENDING)
+    )
+    if not messages:
+        return 0
+    rollup = conversation_rollups.find_one(
+        {"user_id": user_id, "conversation_id": conversation_id},
+        projection={"summary": 1, "archived_until": 1},
+    ) or {}
+    archived_until = rollup.get("archived_until")
+    new_messages = [m for m in messages if archived_until is None or m["timestamp"] > archived_until]
+
+    _copy_to_archive(user_id, conversation_id, messages)
+
+    if new_messages:
+        summary = await summarize_for_rollup(rollup.get("summary"), new_messages)
+        conversation_rollups.update_one(
+            {"user_id": user_id, "conversation_id": conversation_id},
+            {
+                "$set": {
+                    "summary": summary,
+                    active_space().field: generate_embedding(summary),
+                    **migration_embeddings(summary),
+                    "archived_until": new_messages[-1]["timestamp"],
+                    "updated_at": datetime.datetime.now(datetime.timezone.utc),
+                },
+                "$min": {"first_timestamp": new_messages[0]["timestamp"]},
+                "$max": {"last_timestamp": new_messages[-1]["timestamp"]},
+                "$inc": {"message_count": len(new_messages)},
+            },
+            upsert=True,
+        )
+
+    conversations.delete_many({"_id": {"$in": [m["_id"] for m in messages]}})
+    return len(messages)
+
+
+async def archive_old_conversations(older_than_days=ARCHIVE_AFTER_DAYS, max_conversations=ARCHIVE_BATCH_SIZE):
+    """
+    Move conversation messages older than `older_than_days` out of the hot collection.
+
+    Each affected conversation gets a single rollup document (summary plus one embedding) and its
+    raw messages are copied without vectors into the archive collection, keeping the hot vector
+    index limited to recent messages.
+
+    Returns:
+        Dict with the number of conversations and messages archived in this pass, and of conversations
+        whose archiving failed (they are picked up again by a later pass)
+    """
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=older_than_days)
+    try:
+        candidates = list(
+            conversations.aggregate(
+                [
+                    {"$match": {"timestamp": {"$lt": cutoff}}},
+                    {"$group": {"_id": {"user_id": "$user_id", "conversation_id": "$conversation_id"}}},
+                    {"$limit": max_conversations},
+                ]
+            )
+        )
+        archived_conversations = archived_messages = failed = 0
+        for candidate in candidates:
+            key = candidate["_id"]
+            try:
+                archived_messages += await archive_conversation(
+                    key["user_id"], key["conversation_id"], cutoff
+                )
+                archived_conversations += 1
+            except Exception as e:
+                failed += 1
+                logger.error(
+                    "Error archiving conversation %s of user %s: %s", key["conversation_id"], key["user_id"], e
+                )
+        logger.info(
+            "Archived %s messages from %s conversations, %s failed", archived_messages, archived_conversations, failed
+        )
+        return {"conversations": archived_conversations, "messages": archived_messages, "failed": failed}
+    except Exception as e:
+        logger.error("Error in archive_old_conversations: %s", e)
+        raise
@@ -1,50 +1,213 @@
 import json
+import time
 import boto3
+import threading
 import asyncio
+import numpy as np
+from collections import deque
 from botocore.exceptions import ClientError
-from config import AWS_REGION, EMBEDDING_MODEL_ID, LLM_MODEL_ID
-from utils.logger import logger
+from config import (
+    AWS_REGION, LLM_MODEL_ID,
+    BEDROCK_HEDGE_ENABLED, BEDROCK_HEDGE_PERCENTILE, BEDROCK_HEDGE_MIN_SAMPLES, BEDROCK_PROMPT_CACHING_ENABLED
+)
+from database.embedding_space import active_space, settings as embedding_settings, supported_dimensions
+from services.system_prompt import SYSTEM_PROMPT
+from utils.logger import get_logger
+from utils.vector_math import normalize_embedding
+
+logger = get_logger(__name__)
 
 # Initialize a shared boto3 client for Bedrock service
 bedrock_client = boto3.client("bedrock-runtime", region_name=AWS_REGION)
 
-def generate_embedding(text: str) -> list:
+
+class LatencyTracker:
+    """Rolling window of call latencies used to pick the hedging delay"""
+
+    def __init__(self, window=200):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, percentile):
+        if len(self.samples) < BEDROCK_HEDGE_MIN_SAMPLES:
+            return None
+        return float(np.percentile(self.samples, percentile))
+
+
+query_embedding_latency = LatencyTracker()
+
+
+async def _hedged(tracker, func, *args, **kwargs):
     """
-    Generate embeddings for text using AWS Bedrock's embedding model
+    Run a blocking Bedrock call in a worker thread. If it is still running after the
+    BEDROCK_HEDGE_PERCENTILE latency of recent calls, send one identical backup request and
+    return whichever succeeds first. Only used for calls without token usage to account for,
+    since the losing request's usage is never seen.
+    """
+    def timed_call():
+        started = time.monotonic()
+        result = func(*args, **kwargs)
+        tracker.record(time.monotonic() - started)
+        return result
+
+    attempts = [asyncio.ensure_future(asyncio.to_thread(timed_call))]
+    try:
+        hedge_after = tracker.percentile(BEDROCK_HEDGE_PERCENTILE) if BEDROCK_HEDGE_ENABLED else None
+        if hedge_after is not None:
+            done, _ = await asyncio.wait(attempts, timeout=hedge_after)
+            if not done:
+                logger.info("Bedrock call slower than %.2fs, sending hedged request", hedge_after)
+                attempts.append(asyncio.ensure_future(asyncio.to_thread(timed_call)))
+        pending = set(attempts)
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for attempt in done:
+                if attempt.exception() is None:
+                    return attempt.result()
+            if not pending:
+                raise done.pop().exception()
+    finally:
+        # The losing thread cannot be interrupted; its result is simply discarded
+        for attempt in attempts:
+            attempt.cancel()
+
+
+def generate_embedding(text: str, model_id: str = None, dimensions: int = None) -> list:
+    """
+    Generate embeddings for text using AWS Bedrock's embedding model.
+    `model_id` and `dimensions` override those of the active embedding space (used by backfills).
+    Embeddings are returned with unit length, so every stored vector is already normalized.
     """
     if not text.strip():
         raise ValueError("Input text cannot be empty.")
+    if model_id is None:
+        space = active_space()
+        model_id, dimensions = space.model_id, space.dimensions
     try:
         max_tokens = 8000  # Embedding model input token limit
         tokens = text.split()  # Simple tokenization by spaces
         text = " ".join(tokens[:max_tokens])  # Keep only allowed tokens
         payload = {"inputText": text}
-        response = bedrock_client.invoke_model(
-            modelId=EMBEDDING_MODEL_ID, body=json.dumps(payload)
-        )
+        if dimensions and supported_dimensions(model_id):
+            payload["dimensions"] = dimensions
+            payload["normalize"] = True
+        response = bedrock_client.invoke_model(modelId=model_id, body=json.dumps(payload))
         result = json.loads(response["body"].read())
-        return result["embedding"]
+        return normalize_embedding(result["embedding"])
     except Exception as e:
-        logger.error(f"Failed to generate embeddings: {e}")
+        logger.error("Failed to generate embeddings: %s", e)
         raise
 
-async def send_to_bedrock(prompt):
+async def generate_embedding_async(text: str, model_id: str = None, dimensions: int = None) -> list:
+    """
+    Generate embeddings without blocking the event loop.
+    """
+    return await asyncio.to_thread(generate_embedding, text, model_id, dimensions)
+
+async def generate_query_embedding_async(text: str) -> list:
+    """
+    Embed a retrieval query, hedging slow requests when BEDROCK_HEDGE_ENABLED is set. Retrieval waits on
+    this call, so a backup request is worth its cost here; elsewhere it would only add load when Bedrock
+    is already slow.
+    """
+    return await _hedged(query_embedding_latency, generate_embedding, text)
+
+def migration_embeddings(text: str) -> dict:
+    """
+    Vectors a new document needs besides the active one, by field: while an embedding migration is
+    backfilling, documents written in the meantime also get a vector of the migration target.
+    """
+    target = embedding_settings.migration()
+    if target is None:
+        return {}
+    return {target.field: generate_embedding(text, target.model_id, target.dimensions)}
+
+async def migration_embeddings_async(text: str) -> dict:
+    """`migration_embeddings` without blocking the event loop"""
+    if embedding_settings.migration() is None:
+        return {}
+    return await asyncio.to_thread(migration_embeddings, text)
+
+class TokenUsage:
+    """Converse token usage and latency per kind of prompt, including prompt cache reads and writes"""
+
+    FIELDS = {
+        "inputTokens": "input_tokens",
+        "outputTokens": "output_tokens",
+        "cacheReadInputTokens": "cache_read_input_tokens",
+        "cacheWriteInputTokens": "cache_write_input_tokens",
+    }
+
+    def __init__(self):
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, response):
+        usage = response.get("usage", {})
+        with self._lock:
+            totals = self._totals.setdefault(name, {"calls": 0, "latency_ms": 0, **dict.fromkeys(self.FIELDS.values(), 0)})
+            totals["calls"] += 1
+            totals["latency_ms"] += response.get("metrics", {}).get("latencyMs", 0)
+            for key, field in self.FIELDS.items():
+                totals[field] += usage.get(key, 0)
+
+    def snapshot(self):
+        """
+        Totals per prompt kind, with the share of prompt tokens read from the cache and the mean model
+        latency. `input_tokens` counts only the tokens processed without the cache
+        """
+        with self._lock:
+            totals = {name: dict(values) for name, values in self._totals.items()}
+        for values in totals.values():
+            prompt_tokens = values["input_tokens"] + values["cache_read_input_tokens"] + values["cache_write_input_tokens"]
+            values["cache_read_ratio"] = round(values["cache_read_input_tokens"] / prompt_tokens, 4) if prompt_tokens else 0.0
+            values["mean_latency_ms"] = round(values["latency_ms"] / values["calls"], 1)
+        return totals
+
+
+token_usage = TokenUsage()
+
+
+def _static_segment(text):
+    """Content blocks of a prompt segment that is identical across calls, closed by a cache point"""
+    blocks = [{"text": text}]
+    if BEDROCK_PROMPT_CACHING_ENABLED:
+        blocks.append({"cachePoint": {"type": "default"}})
+    return blocks
+
+
+async def send_to_bedrock(prompt, instructions=None, name="prompt"):
     """
     Send a prompt to the Bedrock Claude model asynchronously.
+
+    Every call starts with the shared SYSTEM_PROMPT, followed in the user message by `instructions`, which
+    must be static text identical on every call of a kind, and `prompt`, the part that varies. Each static
+    segment ends with a cache point, so Bedrock can serve that prefix from its prompt cache instead of
+    processing it again. Prefixes shorter than the model's minimum (1024 tokens for Claude 3.7 Sonnet) are
+    not cached, which is why the guidance common to all kinds lives in the system prompt.
+    Token usage, including cache reads and writes, is added to `token_usage` under `name`.
     """
-    payload = [{"role": "user", "content": [{"text": prompt}]}]
-    model_id = LLM_MODEL_ID
+    content = (_static_segment(instructions) if instructions else []) + [{"text": prompt}]
+    request = {
+        "modelId": LLM_MODEL_ID,
+        "system": _static_segment(SYSTEM_PROMPT),
+        "messages": [{"role": "user", "content": content}],
+    }
     try:
-        # Use asyncio.to_thread to call the blocking boto3 client method
-        response = await asyncio.to_thread(
-            bedrock_client.converse,
-            modelId=model_id,
-            messages=payload,
+        # Call the blocking boto3 client method in a worker thread
+        response = await asyncio.to_thread(bedrock_client.converse, **request)
+        token_usage.record(name, response)
+        usage = response.get("usage", {})
+        logger.debug(
+            "Bedrock %s call: %d input tokens, %d read from and %d written to the prompt cache",
+            name, usage.get("inputTokens", 0), usage.get("cacheReadInputTokens", 0), usage.get("cacheWriteInputTokens", 0),
         )
         model_response = response["output"]["message"]
         # Concatenate text parts from the model response
         response_text = " ".join(i["text"] for i in model_response["content"])
         return response_text
     except ClientError as err:
-        logger.error(f"A client error occurred: {err.response['Error']['Message']}")
-        raise
\ No newline at end of file
+        logger.error("A client error occurred: %s", err.response["Error"]["Message"])
+        raise
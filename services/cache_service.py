@@ -0,0 +1,125 @@
+import time
+import asyncio
+import numpy as np
+from collections import OrderedDict
+from utils.vector_math import one_to_many, to_unit
+from database.mongodb import user_versions
+from config import (
+    SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_MAX_DISTANCE, SEMANTIC_CACHE_TTL_SECONDS,
+    SEMANTIC_CACHE_MAX_ENTRIES_PER_USER, SEMANTIC_CACHE_MAX_USERS
+)
+
+
+class SemanticCache:
+    """
+    Per-user cache of retrieval results keyed by query embedding and search scope.
+
+    A query whose embedding lies within `max_distance` cosine distance of a cached query with the same
+    scope returns the cached result. Every write for a user bumps the user's generation, which both drops the cached
+    entries and keeps computations that started before the write from storing their results.
+    """
+
+    def __init__(self, max_distance, ttl_seconds, max_entries_per_user, max_users):
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_user = max_entries_per_user
+        self.max_users = max_users
+        self._entries = OrderedDict()  # user_id -> list of (unit vector, result, expires_at, scope key), LRU by user
+        # user_id -> clock value of the user's last write. Users without an entry are at `_floor`, which
+        # moves past every generation that gets evicted, so forgetting a user never revives stale results
+        self._generations = OrderedDict()
+        self._clock = 0
+        self._floor = 0
+        self._in_flight = {}
+
+    def generation(self, user_id):
+        return self._generations.get(user_id, self._floor)
+
+    def invalidate(self, user_id):
+        """Forget everything cached for a user"""
+        self._clock += 1
+        self._generations[user_id] = self._clock
+        self._generations.move_to_end(user_id)
+        while len(self._generations) > self.max_users:
+            _, evicted_generation = self._generations.popitem(last=False)
+            self._floor = max(self._floor, evicted_generation)
+        self._entries.pop(user_id, None)
+
+    def lookup(self, user_id, embedding, scope=None):
+        entries = self._entries.get(user_id)
+        if not entries:
+            return None
+        now = time.monotonic()
+        query = to_unit(embedding)
+        # Entries from before an embedding migration cutover have a different size and are dropped
+        entries[:] = [entry for entry in entries if entry[2] > now and entry[0].shape == query.shape]
+        if not entries:
+            del self._entries[user_id]
+            return None
+        candidates = [entry for entry in entries if entry[3] == scope]
+        if not candidates:
+            return None
+        similarities = one_to_many(query, np.stack([entry[0] for entry in candidates]))
+        best = int(np.argmax(similarities))
+        if 1.0 - float(similarities[best]) > self.max_distance:
+            return None
+        self._entries.move_to_end(user_id)
+        return candidates[best][1]
+
+    def store(self, user_id, embedding, result, generation, scope=None):
+        """Cache a result computed while the user was at `generation`; stale results are dropped"""
+        if generation != self.generation(user_id):
+            return
+        entries = self._entries.setdefault(user_id, [])
+        entries.append((to_unit(embedding), result, time.monotonic() + self.ttl_seconds, scope))
+        del entries[:-self.max_entries_per_user]
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+
+    async def single_flight(self, key, compute):
+        """Run `compute()` once for concurrent callers with the same key and share its result"""
+        future = self._in_flight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        # Nobody may be waiting; mark the outcome as retrieved to avoid "exception never retrieved"
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._in_flight[key] = future
+        try:
+            result = await compute()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+
+retrieval_cache = SemanticCache(
+    SEMANTIC_CACHE_MAX_DISTANCE,
+    SEMANTIC_CACHE_TTL_SECONDS,
+    SEMANTIC_CACHE_MAX_ENTRIES_PER_USER,
+    SEMANTIC_CACHE_MAX_USERS,
+)
+
+
+def write_versions(user_ids):
+    """
+    {user id: number of writes recorded for the user by any process}. Retrievals key their cached results
+    on it, so a write elsewhere (e.g. by an ingestion worker) retires them in this process too.
+    """
+    versions = dict.fromkeys(user_ids, 0)
+    versions.update((doc["_id"], doc["version"]) for doc in user_versions.find({"_id": {"$in": list(versions)}}))
+    return versions
+
+
+def invalidate_user(user_id):
+    """Drop cached retrieval results of a user after a write, here and, by bumping its write version, everywhere"""
+    retrieval_cache.invalidate(user_id)
+    if SEMANTIC_CACHE_ENABLED:
+        user_versions.update_one({"_id": user_id}, {"$inc": {"version": 1}}, upsert=True)
@@ -1,27 +1,47 @@
-import json
+import asyncio
 import pymongo
 from bson.objectid import ObjectId
-from bson import json_util
-from database.mongodb import conversations
+from database.mongodb import (
+    conversations, conversation_rollups, conversation_archive, union_aggregate, user_session
+)
+from database.read_routing import for_reads
+from database.embedding_space import active_space, vector_projection
+from database.search_scope import UNSCOPED
+from database.search_tuning import candidate_options, prefetch_cardinalities
+from database.archive_layout import archive_filter, from_archive_document
 from database.models import Message
-from services.bedrock_service import generate_embedding, send_to_bedrock
+from services.bedrock_service import generate_embedding
 from models.pydantic_models import RememberRequest
 from services.memory_service import remember_content
-from utils.logger import logger
+from services.summary_service import schedule_summary_update
+from services.cache_service import invalidate_user
+from services.idempotency_service import (
+    idempotency_key, begin_idempotent_request, record_idempotent_step,
+    complete_idempotent_request, fail_idempotent_request, idempotency_lease
+)
+from utils.logger import get_logger
 import config
 
-def hybrid_search(query, vector_query, user_id, weight=0.5, top_n=10):
+logger = get_logger(__name__)
+
+def hybrid_search_pipeline(query, vector_query, user_id, weight=0.5, top_n=10, include_rollups=False, scope=UNSCOPED):
     """
-    Perform a hybrid search operation on MongoDB by combining full-text and vector (semantic) search results.
+    Aggregation pipeline combining full-text and vector (semantic) search results over a user's messages.
+    With `include_rollups`, summaries of archived conversations are searched as well and returned with
+    type "rollup". A `scope` (SearchScope) restricts both searches through their pre-filters. The vector
+    searches are approximate or exact as VECTOR_SEARCH_CANDIDATES decides, see `candidate_options`.
     """
+    space = active_space()
     pipeline = [
         {
             "$search": {
                 "index":config.CONVERSATIONS_FULLTEXT_SEARCH_INDEX_NAME,
-                "text": {"query": query, "path": "text"},
+                "compound": {
+                    "must": [{"text": {"query": query, "path": "text"}}],
+                    "filter": [{"equals": {"path": "user_id", "value": user_id}}] + scope.search_clauses(),
+                },
             }
         },
-        {"$match": {"user_id": user_id}},
         {"$addFields": {"fts_score": {"$meta": "searchScore"}}},
         {"$setWindowFields": {"output": {"maxScore": {"$max": "$fts_score"}}}},
         {
@@ -44,39 +64,62 @@ def hybrid_search(query, vector_query, user_id, weight=0.5, top_n=10):
                 "pipeline": [
                     {
                         "$vectorSearch": {
-                            "index": config.CONVERSATIONS_VECTOR_SEARCH_INDEX_NAME,
+                            "index": space.index_name(config.CONVERSATIONS_VECTOR_SEARCH_INDEX_NAME),
                             "queryVector": vector_query,
-                            "path": "embeddings",
-                            "numCandidates": 200,
+                            "path": space.field,
+                            **candidate_options(config.CONVERSATIONS_COLLECTION, user_id, top_n, 200),
                             "limit": top_n,
-                            "filter": {"user_id": user_id},
+                            "filter": {"user_id": user_id, **scope.message_filter()},
                         }
                     },
                     {"$addFields": {"vs_score": {"$meta": "vectorSearchScore"}}},
-                    {
-                        "$setWindowFields": {
-                            "output": {"maxScore": {"$max": "$vs_score"}}
-                        }
-                    },
-                    {
-                        "$addFields": {
-                            "normalized_vs_score": {
-                                "$divide": ["$vs_score", "$maxScore"]
-                            }
-                        }
-                    },
                     {
                         "$project": {
                             "text": 1,
                             "type": 1,
                             "timestamp": 1,
                             "conversation_id": 1,
-                            "normalized_vs_score": 1,
+                            "vs_score": 1,
                         }
                     },
                 ],
             }
         },
+    ]
+    if include_rollups and scope.includes_rollups:
+        pipeline.append(
+            {
+                "$unionWith": {
+                    "coll": config.CONVERSATION_ROLLUPS_COLLECTION,
+                    "pipeline": [
+                        {
+                            "$vectorSearch": {
+                                "index": space.index_name(config.CONVERSATION_ROLLUPS_VECTOR_SEARCH_INDEX_NAME),
+                                "queryVector": vector_query,
+                                "path": space.field,
+                                **candidate_options(config.CONVERSATION_ROLLUPS_COLLECTION, user_id, top_n, 100),
+                                "limit": top_n,
+                                "filter": {"user_id": user_id, **scope.rollup_filter()},
+                            }
+                        },
+                        {
+                            "$project": {
+                                "text": "$summary",
+                                "type": {"$literal": "rollup"},
+                                "timestamp": "$last_timestamp",
+                                "conversation_id": 1,
+                                "vs_score": {"$meta": "vectorSearchScore"},
+                            }
+                        },
+                    ],
+                }
+            }
+        )
+    pipeline += [
+        # Message and rollup vector scores are normalized by the same maximum, so a rollup only scores
+        # high when it matches as well as the best message does
+        {"$setWindowFields": {"output": {"maxVsScore": {"$max": "$vs_score"}}}},
+        {"$addFields": {"normalized_vs_score": {"$divide": ["$vs_score", "$maxVsScore"]}}},
         {
             "$group": {
                 "_id": "$_id",  # Group by document ID
@@ -113,158 +156,224 @@ def hybrid_search(query, vector_query, user_id, weight=0.5, top_n=10):
             }
         },
     ]
+    return pipeline
+
+def hybrid_search(query, vector_query, user_id, weight=0.5, top_n=10, include_rollups=False, scope=UNSCOPED):
+    """
+    Perform a hybrid search operation on MongoDB by combining full-text and vector (semantic) search results.
+    See `hybrid_search_pipeline` for the arguments.
+    """
+    pipeline = hybrid_search_pipeline(query, vector_query, user_id, weight, top_n, include_rollups, scope)
     # Execute the aggregation pipeline and return the results
     try:
-        results = list(conversations.aggregate(pipeline))
+        with user_session(user_id):
+            results = list(for_reads(conversations, "search").aggregate(pipeline))
         return results
     except Exception as e:
-        logger.error(f"Error in hybrid_search: {e}")
-        raise
-
-async def add_conversation_message(message_input):
-    """Add a message to the conversation history"""
-    try:
-        new_message = Message(message_input)
-        conversations.insert_one(new_message.to_dict())
-        # For significant human messages, create a memory node
-        if message_input.type == "human" and len(message_input.text) > 30:
-            try:
-                memory_content = (
-                    f"From conversation {message_input.conversation_id}: {message_input.text}"
-                )
-                logger.info(f"Creating memory for user {message_input.user_id}: {memory_content}")
-                await remember_content(
-                    RememberRequest(user_id=message_input.user_id, content=memory_content)
-                )
-            except Exception as memory_error:
-                logger.error(f"Error creating memory: {str(memory_error)}")
-                raise
-        return {"message": "Message added successfully"}
-    except Exception as error:
-        logger.error(str(error))
+        logger.error("Error in hybrid_search: %s", e)
         raise
 
-async def search_memory(user_id, query):
+def batch_hybrid_search(queries, weight=0.5, top_n=10, include_rollups=False):
     """
-    Searches memory items by user_id and a textual query using hybrid search.
+    Hybrid search for several (query, vector_query, user_id, scope) tuples in a single aggregation round trip.
+
+    Returns:
+        One list of results per query, in order
     """
+    user_ids = {user_id for _, _, user_id, _ in queries}
     try:
-        # Generate embedding for the query text
-        vector_query = generate_embedding(query)
-        # Perform hybrid search over the stored messages
-        documents = hybrid_search(query, vector_query, user_id, weight=0.8, top_n=5)
-        # Filter results by minimum hybrid score threshold
-        relevant_results = [doc for doc in documents if doc["score"] >= 0.70]
-        if not relevant_results:
-            return {"documents": "No documents found"}
-        else:
-            return {"documents": [serialize_document(doc) for doc in relevant_results]}
-    except Exception as error:
-        logger.error(str(error))
+        prefetch_cardinalities(config.CONVERSATIONS_COLLECTION, user_ids)
+        if include_rollups:
+            prefetch_cardinalities(config.CONVERSATION_ROLLUPS_COLLECTION, user_ids)
+        pipelines = [
+            hybrid_search_pipeline(query, vector_query, user_id, weight, top_n, include_rollups, scope)
+            for query, vector_query, user_id, scope in queries
+        ]
+        # A session can only be of one user; batches mixing users read without read-your-writes
+        with user_session(user_ids.pop() if len(user_ids) == 1 else None):
+            return union_aggregate(config.CONVERSATIONS_COLLECTION, pipelines, operation="search")
+    except Exception as e:
+        logger.error("Error in batch_hybrid_search: %s", e)
         raise
 
-async def get_conversation_context(_id):
+async def add_conversation_message(message_input):
     """
-    Fetches conversation records with context surrounding a specific message
+    Add a message to the conversation history.
+
+    Requests with an idempotency key are processed at most once: a retry returns the original result
+    without embedding the message or calling the LLM again, and a retry of a failed request resumes
+    after the steps that already succeeded. Both steps, storing the message and writing its memory,
+    are recorded as soon as their write is done.
     """
+    key = idempotency_key(message_input)
+    record = await begin_idempotent_request(key, message_input.user_id.strip()) if key else {}
+    if record.get("status") == "done":
+        logger.info("Duplicate request for user %s, returning original result", message_input.user_id)
+        return record["result"]
+    inline = config.INGEST_MODE == "inline"
+    with user_session(message_input.user_id):
+        async with idempotency_lease(record):
+            try:
+                if not record.get("message_id"):
+                    # In worker mode only the raw message is stored; ingestion workers embed it later
+                    new_message = Message(message_input, embed=inline)
+                    inserted = conversations.insert_one(new_message.to_dict())
+                    if key:
+                        record_idempotent_step(record, message_id=inserted.inserted_id)
+                    invalidate_user(new_message.user_id)
+                    if inline:
+                        # Fold the message into the stored conversation summary without blocking the response
+                        schedule_summary_update(new_message.user_id, new_message.conversation_id)
+                if inline and not record.get("memory_id"):
+                    await create_message_memory(
+                        message_input.user_id, message_input.conversation_id, message_input.type, message_input.text,
+                        on_stored=(lambda memory_id: record_idempotent_step(record, memory_id=memory_id)) if key else None,
+                    )
+                result = {"message": "Message added successfully"}
+                if key:
+                    complete_idempotent_request(record, result)
+                return result
+            except Exception as error:
+                if key:
+                    fail_idempotent_request(record)
+                logger.error("%s", error)
+                raise
+
+async def create_message_memory(user_id, conversation_id, message_type, text, on_stored=None):
+    """For significant human messages, create a memory node (see `remember_content` for `on_stored`)"""
+    if message_type != "human" or len(text) <= 30:
+        return
     try:
-        # Fetch the conversation record for the given object ID
-        conversation_record = conversations.find_one(
-            {"_id": ObjectId(_id)},
-            projection={
-                "_id": 0,
-                "embeddings": 0,
-            },
+        memory_content = f"From conversation {conversation_id}: {text}"
+        logger.info(
+            "Creating memory for user %s from conversation %s (%d characters)",
+            user_id, conversation_id, len(memory_content),
         )
-        if not conversation_record:
-            return {"documents": "No documents found"}
-        # Extract metadata
-        user_id = conversation_record["user_id"]
-        conversation_id = conversation_record["conversation_id"]
-        timestamp = conversation_record["timestamp"]
-        message_type = conversation_record["type"]
-        if message_type == "ai":
-            # Get more preceding context for AI messages
-            prev_limit = 4
-            next_limit = 2
-        else:
-            # Balance for human messages
-            prev_limit = 3
-            next_limit = 3
-        # Get messages before target
-        prev_cursor = (
-            conversations.find(
-                {
-                    "user_id": user_id,
-                    "conversation_id": conversation_id,
-                    "timestamp": {"$lte": timestamp},
-                },
-                projection={
-                    "_id": 0,
-                    "embeddings": 0,
-                },
-            )
-            .sort("timestamp", pymongo.DESCENDING)
-            .limit(prev_limit)
+        await remember_content(
+            RememberRequest(user_id=user_id, content=memory_content, conversation_id=conversation_id), on_stored
         )
-        context = list(prev_cursor)
-        # Get messages after target
-        next_cursor = (
-            conversations.find(
-                {
-                    "user_id": user_id,
-                    "conversation_id": conversation_id,
-                    "timestamp": {"$gt": timestamp},
-                },
-                projection={
-                    "_id": 0,
-                    "embeddings": 0,
-                },
-            )
-            .sort("timestamp", pymongo.ASCENDING)
-            .limit(next_limit)
-        )
-        context_after = list(next_cursor)
-        # Combine and sort all messages by timestamp
-        conversation_with_context = sorted(
-            context + context_after,
-            key=lambda x: x["timestamp"],
-        )
-        return {"documents": conversation_with_context}
-    except Exception as error:
-        logger.error(str(error))
+    except Exception as memory_error:
+        logger.error("Error creating memory: %s", memory_error)
         raise
 
-async def generate_conversation_summary(documents):
+def relevant_documents(documents):
+    """Keep the hybrid search results above the minimum hybrid score threshold"""
+    relevant_results = [doc for doc in documents if doc["score"] >= 0.70]
+    if not relevant_results:
+        return {"documents": "No documents found"}
+    else:
+        return {"documents": [serialize_document(doc) for doc in relevant_results]}
+
+async def search_memory(user_id, query, vector_query=None, scope=UNSCOPED):
     """
-    Generates a detailed and structured summary for a conversation provided in JSON format.
+    Searches memory items by user_id and a textual query using hybrid search, within an optional `scope`.
+    Pass `vector_query` when the query embedding has already been computed.
     """
     try:
-        # Construct a prompt with detailed instructions and conversation history
-        prompt = (
-            f"You are an advanced AI assistant skilled in analyzing and summarizing conversation histories while preserving all essential details.\n"
-            f"Given the following conversation data in JSON format, generate a detailed and structured summary that captures all key points, topics discussed, decisions made, and relevant insights.\n\n"
-            f"Ensure your summary follows these guidelines:\n"
-            f"- **Maintain Clarity & Accuracy:** Include all significant details, technical discussions, and conclusions.\n"
-            f"- **Preserve Context & Meaning:** Avoid omitting important points that could alter the conversation's intent.\n"
-            f"- **Organized Structure:** Present the summary in a logical flow or chronological order.\n"
-            f"- **Key Highlights:** Explicitly state major questions asked, AI responses, decisions made, and follow-up discussions.\n"
-            f"- **Avoid Redundancy:** Summarize effectively without unnecessary repetition.\n\n"
-            f"### Output Format:\n"
-            f"- **Topic:** Briefly describe the conversation's purpose.\n"
-            f"- **Key Discussion Points:** Outline the main topics covered.\n"
-            f"- **Decisions & Takeaways:** Highlight key conclusions or next steps.\n"
-            f"- **Unresolved Questions (if any):** Mention pending queries or areas needing further clarification.\n\n"
-            f"Provide a **clear, structured, and comprehensive** summary ensuring no critical detail is overlooked.\n\n"
-            f"Input JSON: {json.dumps(documents, default=json_util.default)}"
+        if vector_query is None:
+            # Generate embedding for the query text
+            vector_query = generate_embedding(query)
+        # Perform hybrid search over the stored messages off the event loop
+        documents = await asyncio.to_thread(
+            hybrid_search, query, vector_query, user_id, weight=0.8, top_n=5,
+            include_rollups=config.HYBRID_SEARCH_INCLUDE_ROLLUPS, scope=scope,
         )
-        # Send prompt to Bedrock and wait for summary response
-        summary = await send_to_bedrock(prompt)
-        return {"summary": summary}
+        return relevant_documents(documents)
     except Exception as error:
-        logger.error(str(error))
+        logger.error("%s", error)
         raise
 
+async def get_conversation_context(_id, user_id=None):
+    """
+    Fetches conversation records with context surrounding a specific message. Pass the `user_id` of the
+    message to read in the user's causally consistent session.
+    """
+    with user_session(user_id):
+        try:
+            messages = for_reads(conversations, "context")
+            # Fetch the conversation record for the given object ID
+            conversation_record = messages.find_one(
+                {"_id": ObjectId(_id)},
+                projection={"_id": 0, **vector_projection()},
+            )
+            if not conversation_record:
+                return {"documents": "No documents found"}
+            # Extract metadata
+            user_id = conversation_record["user_id"]
+            conversation_id = conversation_record["conversation_id"]
+            timestamp = conversation_record["timestamp"]
+            message_type = conversation_record["type"]
+            if message_type == "ai":
+                # Get more preceding context for AI messages
+                prev_limit = 4
+                next_limit = 2
+            else:
+                # Balance for human messages
+                prev_limit = 3
+                next_limit = 3
+            # Get messages before target
+            prev_cursor = (
+                messages.find(
+                    {
+                        "user_id": user_id,
+                        "conversation_id": conversation_id,
+                        "timestamp": {"$lte": timestamp},
+                    },
+                    projection={"_id": 0, **vector_projection()},
+                )
+                .sort("timestamp", pymongo.DESCENDING)
+                .limit(prev_limit)
+            )
+            context = list(prev_cursor)
+            # Get messages after target
+            next_cursor = (
+                messages.find(
+                    {
+                        "user_id": user_id,
+                        "conversation_id": conversation_id,
+                        "timestamp": {"$gt": timestamp},
+                    },
+                    projection={"_id": 0, **vector_projection()},
+                )
+                .sort("timestamp", pymongo.ASCENDING)
+                .limit(next_limit)
+            )
+            context_after = list(next_cursor)
+            # Combine and sort all messages by timestamp
+            conversation_with_context = sorted(
+                context + context_after,
+                key=lambda x: x["timestamp"],
+            )
+            return {"documents": conversation_with_context}
+        except Exception as error:
+            logger.error("%s", error)
+            raise
+
+async def get_rollup_context(_id, limit=6, user_id=None):
+    """
+    Fetches the rollup summary of an archived conversation together with its last archived messages
+    """
+    with user_session(user_id):
+        try:
+            rollup = for_reads(conversation_rollups, "context").find_one(
+                {"_id": ObjectId(_id)}, projection=vector_projection()
+            )
+            if not rollup:
+                return {"documents": "No documents found", "summary": "No summary found"}
+            cursor = (
+                for_reads(conversation_archive, "context").find(
+                    archive_filter(rollup["user_id"], rollup["conversation_id"]),
+                    projection={"_id": 0},
+                )
+                .sort("timestamp", pymongo.DESCENDING)
+                .limit(limit)
+            )
+            documents = sorted((from_archive_document(doc) for doc in cursor), key=lambda x: x["timestamp"])
+            return {"documents": documents, "summary": rollup["summary"]}
+        except Exception as error:
+            logger.error("%s", error)
+            raise
+
 def serialize_document(doc):
     """Helper function to serialize MongoDB documents."""
     doc["_id"] = str(doc["_id"])  # Convert ObjectId to string
@@ -0,0 +1,215 @@
+import asyncio
+import datetime
+from config import EMBEDDING_SETTINGS_REFRESH_SECONDS, EMBEDDING_INDEX_READY_TIMEOUT_SECONDS
+from database.embedding_space import SETTINGS_ID, EmbeddingSpace, settings
+from database.mongodb import (
+    VECTOR_SEARCH_INDEXES, db, embedding_settings, memory_nodes, reembed_checkpoints, sync_vector_indexes
+)
+from services.memory_tree_service import LEAF_FILTER, rebuild_memory_tree
+from services.reembed_service import SOURCE_FIELDS, job_name, reembed_collection
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _index_names(space):
+    return {
+        collection_name: space.index_name(base_name)
+        for collection_name, (base_name, _) in VECTOR_SEARCH_INDEXES.items()
+    }
+
+
+def start_migration(model_id, dimensions, field=None):
+    """
+    Start migrating to a new embedding space: build its vector indexes next to the active ones and make
+    every process write the new vectors alongside the active ones, so nothing written from now on needs
+    a backfill. Starting the migration that is already running again is a no-op.
+
+    Returns:
+        The migration target
+    """
+    settings.invalidate()
+    active, running = settings.active(), settings.migration()
+    target = EmbeddingSpace(field or f"embeddings_{dimensions}", model_id, dimensions)
+    if running is not None:
+        if (running.model_id, running.dimensions) == (model_id, dimensions) and field in (None, running.field):
+            return running
+        raise ValueError(f"Migration to {running} is already running; finish or abort it first")
+    if target.field in settings.vector_fields():
+        raise ValueError(f"Field {target.field} already holds vectors of the active or a retired space")
+    if (target.model_id, target.dimensions) == (active.model_id, active.dimensions):
+        raise ValueError(f"{active} already uses {model_id} with {dimensions} dimensions")
+    indexes = sync_vector_indexes(target)
+    embedding_settings.update_one(
+        {"_id": SETTINGS_ID}, {"$set": {"migration": target.to_dict(), "updated_at": _now()}}, upsert=True
+    )
+    settings.invalidate()
+    logger.info("Started embedding migration from %s to %s, building indexes %s", active, target, indexes)
+    return target
+
+
+async def backfill(target=None, sweep=False, **options):
+    """
+    Embed every stored document that lacks a vector in the migration target (default: the running
+    migration), checkpointed per collection (see `reembed_collection`). A `sweep` starts a fresh pass,
+    catching documents written by processes that had not yet seen the migration start.
+
+    Returns:
+        {collection name: final checkpoint}
+    """
+    if target is None:
+        settings.invalidate()
+        target = settings.migration()
+        if target is None:
+            raise ValueError("No embedding migration is running")
+    checkpoints = {}
+    for collection_name in SOURCE_FIELDS:
+        name = job_name(collection_name, target.field, f"{target.model_id}:{target.dimensions}")
+        checkpoints[collection_name] = await reembed_collection(
+            collection_name,
+            target_field=target.field,
+            model_id=target.model_id,
+            dimensions=target.dimensions,
+            only_missing=True,
+            reset=sweep,
+            name=f"{name}:sweep" if sweep else name,
+            **options,
+        )
+    return checkpoints
+
+
+def index_status(space):
+    """{index name: status} of the vector indexes of an embedding space, "READY" once queryable"""
+    statuses = {}
+    for collection_name, name in _index_names(space).items():
+        existing = list(db[collection_name].list_search_indexes(name))
+        if not existing:
+            statuses[name] = "MISSING"
+        elif existing[0].get("queryable"):
+            statuses[name] = "READY"
+        else:
+            statuses[name] = existing[0].get("status", "PENDING")
+    return statuses
+
+
+async def wait_for_indexes(space, timeout=EMBEDDING_INDEX_READY_TIMEOUT_SECONDS, interval=10):
+    """Wait until every vector index of an embedding space is queryable"""
+    loop = asyncio.get_running_loop()
+    give_up = loop.time() + timeout
+    while True:
+        statuses = index_status(space)
+        if all(status == "READY" for status in statuses.values()):
+            return statuses
+        if loop.time() >= give_up:
+            raise TimeoutError(f"Vector indexes of {space} not ready after {timeout}s: {statuses}")
+        logger.info("Waiting for vector indexes of %s: %s", space, statuses)
+        await asyncio.sleep(interval)
+
+
+async def cutover(**options):
+    """
+    Switch reads and writes over to the migration target once its backfill is complete: sweep for
+    documents still missing a vector, wait for the new indexes, make the target the active space and
+    rebuild every memory tree, whose cluster centroids only exist in the previous space. The previous
+    space is retired; its vectors and indexes stay until `drop_retired`.
+
+    Returns:
+        The new active space
+    """
+    settings.invalidate()
+    previous, target = settings.active(), settings.migration()
+    if target is None:
+        raise ValueError("No embedding migration is running")
+    await backfill(target, sweep=True, **options)
+    await wait_for_indexes(target)
+    embedding_settings.update_one(
+        {"_id": SETTINGS_ID},
+        {
+            "$set": {"active": target.to_dict(), "migration": None, "updated_at": _now()},
+            "$push": {"retired": previous.to_dict()},
+        },
+    )
+    settings.invalidate()
+    logger.info("Switched the active embedding space from %s to %s", previous, target)
+    # Let every process pick up the new space before the trees are rebuilt in it. Until then, searches
+    # find no clusters in the new space and fall back to ranking all of a user's leaves
+    await asyncio.sleep(EMBEDDING_SETTINGS_REFRESH_SECONDS)
+    users = memory_nodes.distinct("user_id", LEAF_FILTER)
+    for user_id in users:
+        await rebuild_memory_tree(user_id)
+    logger.info("Rebuilt the memory trees of %d users in %s", len(users), target)
+    return target
+
+
+def abort_migration(drop_indexes=True):
+    """Stop writing the migration target. Its indexes are dropped and it is retired, see `drop_retired`"""
+    settings.invalidate()
+    target = settings.migration()
+    if target is None:
+        return None
+    embedding_settings.update_one(
+        {"_id": SETTINGS_ID},
+        {"$set": {"migration": None, "updated_at": _now()}, "$push": {"retired": target.to_dict()}},
+    )
+    settings.invalidate()
+    if drop_indexes:
+        for collection_name, name in _index_names(target).items():
+            if list(db[collection_name].list_search_indexes(name)):
+                db[collection_name].drop_search_index(name)
+    logger.info("Aborted embedding migration to %s", target)
+    return target
+
+
+def drop_retired():
+    """
+    Remove the vectors and vector indexes of retired embedding spaces, once no process can still be
+    reading them (more than EMBEDDING_SETTINGS_REFRESH_SECONDS after the cutover)
+
+    Returns:
+        The dropped spaces
+    """
+    settings.invalidate()
+    retired = settings.retired()
+    for space in retired:
+        for collection_name, name in _index_names(space).items():
+            collection = db[collection_name]
+            if list(collection.list_search_indexes(name)):
+                collection.drop_search_index(name)
+            fields = {space.field: "", space.sum_field: ""}
+            collection.update_many({"$or": [{field: {"$exists": True}} for field in fields]}, {"$unset": fields})
+        embedding_settings.update_one({"_id": SETTINGS_ID}, {"$pull": {"retired": space.to_dict()}})
+        logger.info("Dropped the vectors and indexes of retired embedding space %s", space)
+    settings.invalidate()
+    return retired
+
+
+def migration_status():
+    """Active, migrating and retired embedding spaces, with backfill progress and index status"""
+    settings.invalidate()
+    active, target = settings.active(), settings.migration()
+    status = {
+        "active": active.to_dict(),
+        "migration": None,
+        "retired": [space.to_dict() for space in settings.retired()],
+    }
+    if target is not None:
+        model = f"{target.model_id}:{target.dimensions}"
+        names = [job_name(collection_name, target.field, model) for collection_name in SOURCE_FIELDS]
+        checkpoints = {doc["_id"]: doc for doc in reembed_checkpoints.find({"_id": {"$in": names}})}
+        status["migration"] = {
+            **target.to_dict(),
+            "indexes": index_status(target),
+            "backfill": {
+                collection_name: {
+                    "processed": checkpoints[name]["processed"],
+                    "completed": checkpoints[name]["completed"],
+                }
+                if name in checkpoints else None
+                for collection_name, name in zip(SOURCE_FIELDS, names)
+            },
+        }
+    return status
@@ -0,0 +1,148 @@
+import asyncio
+import contextlib
+import datetime
+import hashlib
+import pymongo
+from bson import ObjectId
+import pymongo.errors
+from fastapi import HTTPException, status
+from config import IDEMPOTENCY_LEASE_SECONDS, IDEMPOTENCY_WAIT_SECONDS
+from database.mongodb import ingest_requests
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def idempotency_key(message_input):
+    """
+    Key identifying a POST /conversation/ request across retries.
+
+    A client-supplied key is scoped to the user. Otherwise the key is derived from
+    (user_id, conversation_id, timestamp, text hash); without a client timestamp a retry cannot be told
+    apart from a genuinely repeated message, so no key is derived.
+    """
+    user_id = message_input.user_id.strip()
+    if message_input.idempotency_key:
+        raw = f"client|{user_id}|{message_input.idempotency_key}"
+    elif message_input.timestamp:
+        text_hash = hashlib.sha256(message_input.text.strip().encode("utf-8")).hexdigest()
+        raw = f"derived|{user_id}|{message_input.conversation_id.strip()}|{message_input.timestamp}|{text_hash}"
+    else:
+        return None
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def begin_idempotent_request(key, user_id):
+    """
+    Claim an idempotency key before processing a request.
+
+    A claim is a lease: its owner keeps it alive with `idempotency_lease` while processing, and another
+    request may only take the key over once the lease has not been renewed for IDEMPOTENCY_LEASE_SECONDS
+    (the owner crashed) or the owner released it as failed. Every claim carries a fresh `claim` token, and
+    progress is only recorded under the current token, so an owner that lost its lease cannot overwrite
+    the new owner's record.
+
+    Returns:
+        The ingest record. Status "done" means the request was already processed and `result` holds the
+        original response; otherwise the caller owns the request, holds it with `idempotency_lease` and
+        resumes after any step recorded on it (e.g. `message_id` once the message was stored).
+    Raises:
+        HTTPException 409 if the original request is still being processed after IDEMPOTENCY_WAIT_SECONDS
+    """
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        try:
+            record = {
+                "_id": key, "user_id": user_id, "status": "pending", "claim": ObjectId(), "claimed_at": now,
+                "created_at": now,
+            }
+            ingest_requests.insert_one(record)
+            return record
+        except pymongo.errors.DuplicateKeyError:
+            pass
+        # Take over requests that failed, or whose owner stopped renewing its lease (it crashed)
+        record = ingest_requests.find_one_and_update(
+            {
+                "_id": key,
+                "$or": [
+                    {"status": "failed"},
+                    {
+                        "status": "pending",
+                        "claimed_at": {"$lt": now - datetime.timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)},
+                    },
+                ],
+            },
+            {"$set": {"status": "pending", "claim": ObjectId(), "claimed_at": now}},
+            return_document=pymongo.ReturnDocument.AFTER,
+        )
+        if record:
+            logger.info("Resuming unfinished request %s", key)
+            return record
+        record = ingest_requests.find_one({"_id": key})
+        if record and record["status"] == "done":
+            return record
+        if record and loop.time() >= give_up_at:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with the same idempotency key is still being processed",
+            )
+        await asyncio.sleep(0.2)
+
+
+def _renew_lease(key, claim):
+    """Push the lease of a claim forward; False once the claim is no longer the current one"""
+    renewed = ingest_requests.update_one(
+        {"_id": key, "claim": claim, "status": "pending"},
+        {"$set": {"claimed_at": datetime.datetime.now(datetime.timezone.utc)}},
+    )
+    return renewed.matched_count == 1
+
+
+@contextlib.asynccontextmanager
+async def idempotency_lease(record):
+    """
+    Renew the lease of a claimed request every third of IDEMPOTENCY_LEASE_SECONDS while the enclosed
+    block runs, so a retry cannot take over a request that is slow rather than dead
+    """
+    if not record.get("claim"):
+        yield
+        return
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(IDEMPOTENCY_LEASE_SECONDS / 3)
+            if not _renew_lease(record["_id"], record["claim"]):
+                logger.warning("Lost the lease of request %s to a retry", record["_id"])
+                return
+
+    task = asyncio.create_task(heartbeat())
+    try:
+        yield
+    finally:
+        task.cancel()
+
+
+def record_idempotent_step(record, **fields):
+    """Persist progress of a claimed request so a retry can resume after it"""
+    ingest_requests.update_one({"_id": record["_id"], "claim": record["claim"]}, {"$set": fields})
+
+
+def complete_idempotent_request(record, result):
+    """Store the response returned to every later retry of the request"""
+    ingest_requests.update_one(
+        {"_id": record["_id"], "claim": record["claim"]},
+        {
+            "$set": {
+                "status": "done",
+                "result": result,
+                "completed_at": datetime.datetime.now(datetime.timezone.utc),
+            }
+        },
+    )
+
+
+def fail_idempotent_request(record):
+    """Release a claimed request so that a retry can take it over"""
+    ingest_requests.update_one({"_id": record["_id"], "claim": record["claim"]}, {"$set": {"status": "failed"}})
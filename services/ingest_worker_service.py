@@ -0,0 +1,238 @@
+import asyncio
+import datetime
+import collections
+import pymongo.errors
+from config import (
+    INGEST_WORKER_CONCURRENCY, INGEST_WORKER_MAX_RETRIES, INGEST_CHECKPOINT_INTERVAL_SECONDS,
+    INGEST_RESCAN_INTERVAL_SECONDS
+)
+from database.embedding_space import active_space, vector_projection
+from database.mongodb import conversations, ingest_checkpoints, user_session
+from services.bedrock_service import generate_embedding_async, migration_embeddings_async
+from services.cache_service import invalidate_user
+from services.conversation_service import create_message_memory
+from services.summary_service import schedule_summary_update
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Server error code when a resume token has fallen off the oplog
+CHANGE_STREAM_HISTORY_LOST = 286
+# `enrichment` states of a stored message; the field is removed once the message is fully enriched
+PENDING, EMBEDDED = "pending", "embedded"
+
+
+def partition_filter(partition, partitions):
+    """Query matching the messages of one partition of the users that still await enrichment"""
+    query = {"enrichment": {"$in": [PENDING, EMBEDDED]}}
+    if partitions > 1:
+        query["user_hash"] = {"$mod": [partitions, partition]}
+    return query
+
+
+async def enrich_message(message_id):
+    """
+    Embed a stored message and consolidate it into the user's memories. Progress is recorded on the
+    message, so a message delivered again (e.g. after a restart) only repeats the unfinished steps.
+
+    Returns:
+        False if the message is gone or was already enriched
+    """
+    message = conversations.find_one({"_id": message_id}, projection=vector_projection())
+    if not message or message.get("enrichment") not in (PENDING, EMBEDDED):
+        return False
+    user_id, conversation_id = message["user_id"], message["conversation_id"]
+    with user_session(user_id):
+        if message["enrichment"] == PENDING:
+            field = active_space().field
+            embeddings = await generate_embedding_async(message["text"])
+            vectors = await migration_embeddings_async(message["text"])
+            conversations.update_one(
+                {"_id": message_id, "enrichment": PENDING},
+                {"$set": {field: embeddings, **vectors, "enrichment": EMBEDDED}},
+            )
+            # The message is searchable now; results cached by the API processes are stale
+            invalidate_user(user_id)
+        await create_message_memory(user_id, conversation_id, message["type"], message["text"])
+        conversations.update_one({"_id": message_id}, {"$unset": {"enrichment": ""}})
+    schedule_summary_update(user_id, conversation_id)
+    return True
+
+
+class IngestWorker:
+    """
+    Enriches new messages of one partition of the users by tailing the conversations change stream.
+
+    Messages of a user are processed one at a time in insertion order, different users concurrently.
+    The resume token of the newest event whose predecessors have all been processed is checkpointed,
+    so a restarted worker picks up where it stopped: events may be redelivered, but none are lost.
+    Messages the stream cannot account for (no checkpoint yet, history lost, failed enrichment) are
+    found by rescanning for messages still awaiting enrichment.
+    """
+
+    def __init__(
+        self,
+        partition: int = 0,
+        partitions: int = 1,
+        concurrency: int = INGEST_WORKER_CONCURRENCY,
+        checkpoint_interval: float = INGEST_CHECKPOINT_INTERVAL_SECONDS,
+        rescan_interval: float = INGEST_RESCAN_INTERVAL_SECONDS,
+    ):
+        if not 0 <= partition < partitions:
+            raise ValueError(f"Partition {partition} is not in [0, {partitions})")
+        self.partition = partition
+        self.partitions = partitions
+        self.checkpoint_id = f"conversations:{partition}/{partitions}"
+        self.checkpoint_interval = checkpoint_interval
+        self.rescan_interval = rescan_interval
+        self.processed = 0
+        self.failed = 0
+        self._slots = asyncio.Semaphore(concurrency)
+        # [resume token, done] per dispatched message in stream order; rescanned messages have no token
+        self._pending = collections.deque()
+        # Last task of each user with messages in flight
+        self._user_tails = {}
+        self._resume_token = None
+        self._saved_token = None
+        self._stopping = False
+
+    def stop(self):
+        """Stop reading the change stream; in-flight messages are finished and the checkpoint saved"""
+        self._stopping = True
+
+    def _load_checkpoint(self):
+        checkpoint = ingest_checkpoints.find_one({"_id": self.checkpoint_id})
+        return checkpoint["resume_token"] if checkpoint else None
+
+    def _save_checkpoint(self):
+        if self._resume_token is None or self._resume_token == self._saved_token:
+            return
+        ingest_checkpoints.update_one(
+            {"_id": self.checkpoint_id},
+            {
+                "$set": {
+                    "resume_token": self._resume_token,
+                    "processed": self.processed,
+                    "updated_at": datetime.datetime.now(datetime.timezone.utc),
+                }
+            },
+            upsert=True,
+        )
+        self._saved_token = self._resume_token
+
+    def _advance(self):
+        """Move the resume token past the leading run of processed messages"""
+        while self._pending and self._pending[0][1]:
+            token = self._pending.popleft()[0]
+            if token is not None:
+                self._resume_token = token
+
+    async def _process(self, message_id, previous, entry):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            for attempt in range(INGEST_WORKER_MAX_RETRIES + 1):
+                try:
+                    if await enrich_message(message_id):
+                        self.processed += 1
+                    return
+                except Exception as e:
+                    if attempt == INGEST_WORKER_MAX_RETRIES:
+                        # Left awaiting enrichment; the next rescan retries it
+                        self.failed += 1
+                        logger.error("Giving up on message %s for now: %s", message_id, e)
+                        return
+                    await asyncio.sleep(min(2 ** attempt, 30))
+        finally:
+            entry[1] = True
+            self._advance()
+            self._slots.release()
+
+    async def dispatch(self, message_id, user_id, token=None):
+        """Queue a message behind the user's in-flight messages; waits while all slots are busy"""
+        await self._slots.acquire()
+        entry = [token, False]
+        self._pending.append(entry)
+        task = asyncio.create_task(self._process(message_id, self._user_tails.get(user_id), entry))
+        self._user_tails[user_id] = task
+        task.add_done_callback(
+            lambda done: self._user_tails.pop(user_id) if self._user_tails.get(user_id) is done else None
+        )
+
+    async def rescan(self):
+        """Dispatch every message of the partition still awaiting enrichment, oldest first"""
+        # Read all ids up front; dispatching may wait for slots longer than a cursor stays open
+        docs = list(
+            conversations.find(
+                partition_filter(self.partition, self.partitions), projection={"_id": 1, "user_id": 1}
+            ).sort("_id", pymongo.ASCENDING)
+        )
+        for doc in docs:
+            await self.dispatch(doc["_id"], doc["user_id"])
+        if docs:
+            logger.info(
+                "Rescan of partition %s/%s found %d messages awaiting enrichment",
+                self.partition, self.partitions, len(docs),
+            )
+
+    async def _tail(self, stream):
+        loop = asyncio.get_running_loop()
+        next_checkpoint = loop.time() + self.checkpoint_interval
+        next_rescan = loop.time() + self.rescan_interval
+        while not self._stopping:
+            # Blocks for at most the stream's max_await_time_ms
+            change = await asyncio.to_thread(stream.try_next)
+            if change is not None:
+                document = change["fullDocument"]
+                await self.dispatch(document["_id"], document["user_id"], change["_id"])
+            elif not self._pending:
+                # Idle: the stream's position still advances, keeping the checkpoint inside the oplog window
+                self._resume_token = stream.resume_token
+            now = loop.time()
+            if now >= next_checkpoint:
+                self._save_checkpoint()
+                next_checkpoint = now + self.checkpoint_interval
+            if now >= next_rescan:
+                await self.rescan()
+                next_rescan = now + self.rescan_interval
+
+    async def run(self):
+        """Process the partition until `stop` is called"""
+        pipeline = [
+            {
+                "$match": {
+                    "operationType": "insert",
+                    **{
+                        f"fullDocument.{field}": condition
+                        for field, condition in partition_filter(self.partition, self.partitions).items()
+                    },
+                }
+            }
+        ]
+        token = self._load_checkpoint()
+        logger.info(
+            "Ingest worker for partition %s/%s starting %s",
+            self.partition, self.partitions, "from its checkpoint" if token else "without a checkpoint",
+        )
+        try:
+            while not self._stopping:
+                try:
+                    with conversations.watch(pipeline, resume_after=token, max_await_time_ms=1000) as stream:
+                        # Catch up on messages the stream will not deliver: those from before the first
+                        # checkpoint or from lost history, and earlier failures
+                        await self.rescan()
+                        await self._tail(stream)
+                except pymongo.errors.OperationFailure as e:
+                    if e.code != CHANGE_STREAM_HISTORY_LOST:
+                        raise
+                    logger.warning("Resume token of partition %s/%s is no longer in the oplog", self.partition, self.partitions)
+                    token = self._resume_token = self._saved_token = None
+        finally:
+            in_flight = list(self._user_tails.values())
+            if in_flight:
+                await asyncio.wait(in_flight)
+            self._save_checkpoint()
+            logger.info(
+                "Ingest worker for partition %s/%s stopped: %d messages enriched, %d failed",
+                self.partition, self.partitions, self.processed, self.failed,
+            )
@@ -1,86 +1,256 @@
 import datetime
 from bson.objectid import ObjectId
 import pymongo
-from config import MAX_DEPTH, SIMILARITY_THRESHOLD, REINFORCEMENT_FACTOR, DECAY_FACTOR
-from database.mongodb import memory_nodes
-from services.bedrock_service import generate_embedding, send_to_bedrock
-from utils.helpers import cosine_similarity
+from config import (
+    MAX_MEMORIES_PER_USER, SIMILARITY_THRESHOLD, REINFORCEMENT_FACTOR, DECAY_FACTOR,
+    DECAY_MODEL, DECAY_HALF_LIFE_DAYS, MEMORY_NODES_COLLECTION, MEMORY_RANK_CANDIDATE_MULTIPLIER,
+    MEMORY_RANK_SIMILARITY_WEIGHT, MEMORY_RANK_IMPORTANCE_WEIGHT, MEMORY_RANK_RECENCY_WEIGHT,
+    MEMORY_RANK_RECENCY_HALF_LIFE_DAYS, SIMILAR_MEMORIES_TOP_N
+)
+from database.mongodb import memory_nodes, union_aggregate, user_session
+from database.read_routing import for_reads
+from database.embedding_space import active_space
+from database.search_scope import UNSCOPED
+from database.search_tuning import num_candidates, prefetch_cardinalities
+from services.bedrock_service import generate_embedding, migration_embeddings, send_to_bedrock
+from services.cache_service import invalidate_user
+from services.memory_tree_service import (
+    LEAF_FILTER, attach_leaf, batch_candidate_parents, candidate_parents, detach_leaf, leaf_vector_search,
+    schedule_summary_refresh
+)
+from utils.vector_math import centroid, one_to_many, to_array, to_list
 from typing import List, Dict
-from config import MEMORY_NODES_VECTOR_SEARCH_INDEX_NAME
-from utils.logger import logger
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Instructions of the memory prompts, sent as cacheable prefixes ahead of the content
+IMPORTANCE_INSTRUCTIONS = (
+    "On a scale of 1-10, rate the importance of remembering this information long-term. "
+    "Consider factors like: uniqueness of information, actionability, personal significance, "
+    "and whether it contains key facts or decisions. Respond with just a number.\n"
+)
+SUMMARY_INSTRUCTIONS = "Create a one-sentence summary of the key information in this text. Be specific and concise:\n"
+MERGE_INSTRUCTIONS = (
+    "These two texts contain related information. Combine them into a single cohesive text "
+    "that preserves all important details from both without redundancy:\n"
+)
+MERGED_SUMMARY_INSTRUCTIONS = "Create a one-sentence summary capturing the key information:\n"
+
+def decayed_importance_expression():
+    """
+    Aggregation expression for a memory's current importance.
+
+    With the time decay model the stored `importance` is halved every DECAY_HALF_LIFE_DAYS since
+    `last_reinforced` (falling back to `timestamp` for older nodes), so decay costs nothing at write
+    time. With the eager model the stored value is already decayed.
+    """
+    if DECAY_MODEL == "eager":
+        return "$importance"
+    half_life_ms = DECAY_HALF_LIFE_DAYS * 24 * 60 * 60 * 1000
+    elapsed_ms = {
+        "$max": [
+            0,
+            {"$subtract": ["$$NOW", {"$ifNull": ["$last_reinforced", "$timestamp"]}]},
+        ]
+    }
+    return {
+        "$multiply": [
+            "$importance",
+            {"$pow": [0.5, {"$divide": [elapsed_ms, half_life_ms]}]},
+        ]
+    }
+
+
+def reinforcement_update():
+    """
+    Update pipeline that reinforces a memory: its decayed importance is materialized, multiplied by
+    REINFORCEMENT_FACTOR and the decay clock restarts.
+    """
+    return [
+        {
+            "$set": {
+                "importance": {"$multiply": [decayed_importance_expression(), REINFORCEMENT_FACTOR]},
+                "access_count": {"$add": [{"$ifNull": ["$access_count", 0]}, 1]},
+                "last_reinforced": "$$NOW",
+                "last_accessed": "$$NOW",
+            }
+        }
+    ]
+
+
+def ranking_score_expression():
+    """
+    Aggregation expression blending the signals of a candidate memory into one score, each term in [0, 1]:
+    the vector search score, effective importance squashed as e / (1 + e), and recency, halving every
+    MEMORY_RANK_RECENCY_HALF_LIFE_DAYS since the memory was last accessed
+    """
+    half_life_ms = MEMORY_RANK_RECENCY_HALF_LIFE_DAYS * 24 * 60 * 60 * 1000
+    importance = {"$ifNull": ["$effective_importance", 0]}
+    age_ms = {"$max": [0, {"$subtract": ["$$NOW", {"$ifNull": ["$last_accessed", "$timestamp"]}]}]}
+    return {
+        "$add": [
+            {"$multiply": [MEMORY_RANK_SIMILARITY_WEIGHT, "$similarity"]},
+            {"$multiply": [MEMORY_RANK_IMPORTANCE_WEIGHT, {"$divide": [importance, {"$add": [1, importance]}]}]},
+            {"$multiply": [MEMORY_RANK_RECENCY_WEIGHT, {"$pow": [0.5, {"$divide": [age_ms, half_life_ms]}]}]},
+        ]
+    }
+
+
+def similar_memories_pipeline(
+    user_id, embedding, parent_ids, top_n, scope=UNSCOPED, rank=True, include_embeddings=False
+):
+    """
+    Pipeline returning the user's `top_n` leaf memories under `parent_ids`, see `find_similar_memories`.
+    With `rank`, top_n * MEMORY_RANK_CANDIDATE_MULTIPLIER nearest leaves are fetched and ordered by
+    `ranking_score_expression`; otherwise the `top_n` nearest are returned in similarity order.
+    """
+    limit = top_n * MEMORY_RANK_CANDIDATE_MULTIPLIER if rank else top_n
+    pipeline = leaf_vector_search(
+        user_id, embedding, parent_ids, limit, num_candidates=max(100, num_candidates(limit, 10)),
+        filters=scope.memory_filter(),
+    ) + [
+        {
+            "$addFields": {
+                "similarity": {"$meta": "vectorSearchScore"},
+                "decayed_importance": decayed_importance_expression(),
+            }
+        },
+        {
+            "$addFields": {
+                "effective_importance": {
+                    "$multiply": [
+                        "$decayed_importance",
+                        {"$add": [1, {"$ln": {"$add": ["$access_count", 1]}}]},
+                    ]
+                },
+            }
+        },
+    ]
+    projection = {
+        "_id": 1,
+        "content": 1,
+        "summary": 1,
+        "importance": 1,
+        "decayed_importance": 1,
+        "effective_importance": 1,
+        "similarity": 1,
+        "access_count": 1,
+        "timestamp": 1,
+    }
+    if rank:
+        pipeline += [
+            {"$addFields": {"score": ranking_score_expression()}},
+            {"$sort": {"score": -1}},
+            {"$limit": top_n},
+        ]
+        projection["score"] = 1
+    if include_embeddings:
+        projection["embeddings"] = f"${active_space().field}"
+    return pipeline + [{"$project": projection}]
+
 
 async def find_similar_memories(
-    user_id: str, embedding: List[float], top_n: int = 3
+    user_id: str, embedding: List[float], top_n: int = SIMILAR_MEMORIES_TOP_N, scope=UNSCOPED,
+    rank: bool = True, include_embeddings: bool = False
 ) -> List[Dict]:
     """
     Find most similar memory nodes from the memory tree using vector search. Returns memories ranked by 
-    a combination of vector similarity and effective importance (which balances inherent information value 
-    with usage patterns). While raw importance represents the AI-assessed significance of information on 
+    a combination of vector similarity, effective importance (which balances inherent information value 
+    with usage patterns) and recency: the nearest candidates are over-fetched and re-ranked inside the
+    aggregation, so an important memory just outside the `top_n` nearest can still be returned. While raw importance represents the AI-assessed significance of information on 
     a 0.1-1.0 scale, effective importance (importance * (1 + ln(access_count + 1))) amplifies this based 
     on access frequency, creating a memory retrieval system that adapts to both content quality and user 
-    interaction patterns.
+    interaction patterns. Under the time decay model, importance is decayed by the time elapsed since the 
+    memory was last reinforced before it is amplified. Once a user has enough memories to form a tree, the 
+    search descends through the cluster centroids first and only ranks the leaves of the closest clusters.
+    A `scope` restricting the source conversation or creation time of memories pre-filters the leaves
+    directly instead: clusters mix conversations and times, so their centroids could lead away from the
+    only leaves in scope.
     
     Args:
         user_id: User ID to filter by
         embedding: Query embedding vector
         top_n: Number of similar memories to return
+        scope: SearchScope of the retrieval
+        rank: Order by the blended `score` rather than by similarity alone
+        include_embeddings: Also return each memory's vector, as `embeddings`
     Returns:
-        List of similar memory nodes with similarity scores
+        List of similar memory nodes with similarity and, when ranked, blended scores
     """
-    try:
-        response = memory_nodes.aggregate(
-            [
-                {
-                    "$vectorSearch": {
-                        "index": MEMORY_NODES_VECTOR_SEARCH_INDEX_NAME,
-                        "path": "embeddings",
-                        "queryVector": embedding,
-                        "numCandidates": 100,
-                        "limit": top_n,
-                        "filter": {"user_id": user_id},
-                    }
-                },
-                {"$addFields": {"similarity": {"$meta": "vectorSearchScore"}}},
-                {
-                    "$project": {
-                        "_id": 1,
-                        "content": 1,
-                        "summary": 1,
-                        "importance": 1,
-                        "effective_importance": {
-                            "$multiply": [
-                                "$importance",
-                                {"$add": [1, {"$ln": {"$add": ["$access_count", 1]}}]},
-                            ]
-                        },
-                        "similarity": 1,
-                        "access_count": 1,
-                        "timestamp": 1,
-                        "embeddings": 1,
-                    }
-                },
-            ]
-        )
+    with user_session(user_id):
+        try:
+            parent_ids = None if scope.restricts_memories else await candidate_parents(user_id, embedding)
+            response = for_reads(memory_nodes, "memory").aggregate(
+                similar_memories_pipeline(user_id, embedding, parent_ids, top_n, scope, rank, include_embeddings)
+            )
 
-        results = []
-        for doc in response:
-            doc_id = str(doc.pop("_id"))
-            doc["id"] = doc_id
-            results.append(doc)
+            results = []
+            for doc in response:
+                doc_id = str(doc.pop("_id"))
+                doc["id"] = doc_id
+                results.append(doc)
 
-        return results
+            return results
+        except Exception as e:
+            logger.error("Error finding similar memory nodes: %s", e)
+            raise
+
+
+def batch_find_similar_memories(queries):
+    """
+    `find_similar_memories` for several (user_id, embedding, scope, top_n) tuples, with one aggregation
+    round trip per memory tree level plus one for the leaves of all queries.
+
+    Returns:
+        One list of similar memory nodes per query, in order
+    """
+    user_ids = {user_id for user_id, _, _, _ in queries}
+    try:
+        prefetch_cardinalities(MEMORY_NODES_COLLECTION, user_ids)
+        with user_session(user_ids.pop() if len(user_ids) == 1 else None):
+            # Scoped queries rank their leaves directly, see find_similar_memories
+            descending = [index for index, (_, _, scope, _) in enumerate(queries) if not scope.restricts_memories]
+            parent_ids = [None] * len(queries)
+            found = batch_candidate_parents([queries[index][:2] for index in descending]) if descending else []
+            for index, parents in zip(descending, found):
+                parent_ids[index] = parents
+            branches = union_aggregate(
+                MEMORY_NODES_COLLECTION,
+                [
+                    similar_memories_pipeline(user_id, embedding, parents, top_n, scope)
+                    for (user_id, embedding, scope, top_n), parents in zip(queries, parent_ids)
+                ],
+                operation="memory",
+            )
+        for docs in branches:
+            for doc in docs:
+                doc["id"] = str(doc.pop("_id"))
+        return branches
     except Exception as e:
-        logger.error(f"Error finding similar memory nodes: {str(e)}")
+        logger.error("Error finding similar memory nodes: %s", e)
         raise
 
 
 async def update_importance(user_id, embedding):
     """Update importance of memories based on similarity to new content"""
-    cursor = memory_nodes.find({"user_id": user_id})
-    for doc in cursor:
-        doc_id = doc["_id"]
-        memory_embedding = doc["embeddings"]
-        similarity = cosine_similarity(embedding, memory_embedding)
+    if DECAY_MODEL != "eager":
+        # Decay is computed at read time, so only the reinforced memories need a write
+        await reinforce_similar_memories(user_id, embedding)
+        return
+    field = active_space().field
+    docs = list(
+        memory_nodes.find(
+            {"user_id": user_id, **LEAF_FILTER},
+            projection={"importance": 1, "access_count": 1, field: 1},
+        )
+    )
+    if not docs:
+        return
+    # Score all memories against the new content in one matrix-vector product; both are stored unit vectors
+    similarities = one_to_many(to_array(embedding), to_array([doc[field] for doc in docs]))
+    operations = []
+    for doc, similarity in zip(docs, similarities):
         if similarity > SIMILARITY_THRESHOLD:
             # Reinforce similar memories
             new_importance = doc["importance"] * REINFORCEMENT_FACTOR
@@ -89,156 +259,190 @@ async def update_importance(user_id, embedding):
             # Decay less relevant memories
             new_importance = doc["importance"] * DECAY_FACTOR
             new_access_count = doc["access_count"]
-        # Update in database
-        memory_nodes.update_one(
-            {"_id": doc_id},
-            {"$set": {"importance": new_importance, "access_count": new_access_count}},
+        operations.append(
+            pymongo.UpdateOne(
+                {"_id": doc["_id"]},
+                {"$set": {"importance": new_importance, "access_count": new_access_count}},
+            )
         )
+    # Update in database
+    memory_nodes.bulk_write(operations, ordered=False)
+
+
+async def reinforce_similar_memories(user_id, embedding, candidates=20):
+    """Reinforce the memories whose cosine similarity to new content exceeds SIMILARITY_THRESHOLD"""
+    parent_ids = await candidate_parents(user_id, embedding)
+    response = memory_nodes.aggregate(
+        leaf_vector_search(user_id, embedding, parent_ids, candidates, max(100, candidates * 5))
+        + [{"$project": {"_id": 1, "embeddings": f"${active_space().field}"}}]
+    )
+    docs = list(response)
+    if not docs:
+        return
+    similarities = one_to_many(to_array(embedding), to_array([doc["embeddings"] for doc in docs]))
+    reinforced_ids = [doc["_id"] for doc, similarity in zip(docs, similarities) if similarity > SIMILARITY_THRESHOLD]
+    if reinforced_ids:
+        memory_nodes.update_many({"_id": {"$in": reinforced_ids}}, reinforcement_update())
 
 
 async def prune_memories(user_id):
-    """Prune less important memories exceeding the maximum depth"""
-    count = memory_nodes.count_documents({"user_id": user_id})
-    if count > MAX_DEPTH:
-        # Find low importance memories to delete
-        cursor = (
-            memory_nodes.find({"user_id": user_id})
-            .sort([("importance", pymongo.ASCENDING)])
-            .limit(count - MAX_DEPTH)
+    """Prune less important memories exceeding the per-user limit"""
+    count = memory_nodes.count_documents({"user_id": user_id, **LEAF_FILTER})
+    if count > MAX_MEMORIES_PER_USER:
+        # Find low importance memories to delete, ranked by their current (decayed) importance
+        cursor = memory_nodes.aggregate(
+            [
+                {"$match": {"user_id": user_id, **LEAF_FILTER}},
+                {"$project": {"current_importance": decayed_importance_expression()}},
+                {"$sort": {"current_importance": pymongo.ASCENDING}},
+                {"$limit": count - MAX_MEMORIES_PER_USER},
+            ]
         )
-        # Delete them
-        for doc in cursor:
-            memory_nodes.delete_one({"_id": doc["_id"]})
+        pruned_ids = [doc["_id"] for doc in cursor]
+        # Take them out of the memory tree, then delete them
+        for doc_id in pruned_ids:
+            await detach_leaf(doc_id)
+        memory_nodes.delete_many({"_id": {"$in": pruned_ids}})
 
 
-async def remember_content(request):
-    """Store a new memory for the user, integrating with existing memories"""
-    try:
-        # Input validation
-        if not request.content.strip():
-            return {"message": "Cannot remember empty content"}
-        # Generate embedding for the content
-        embeddings = generate_embedding(request.content)
-        # Check for similar existing memories before creating a new one
-        similar_memories = await find_similar_memories(request.user_id, embeddings)
-        # If we already have very similar memories, reinforce them instead
-        for memory in similar_memories:
-            if memory["similarity"] > 0.85:  # High similarity threshold
-                # Update existing memory instead of creating a new one
-                memory_nodes.update_one(
-                    {"_id": ObjectId(memory["id"])},
-                    {
-                        "$set": {
-                            "importance": memory["importance"] * REINFORCEMENT_FACTOR,
-                            "access_count": memory["access_count"] + 1,
-                            "last_accessed": datetime.datetime.now(
-                                datetime.timezone.utc
-                            ),
-                        }
-                    },
-                )
-                return {
-                    "message": "Reinforced existing memory",
-                    "memory_id": memory["id"],
-                }
-        # For new memories, assess importance
-        importance_assessment_prompt = (
-            "On a scale of 1-10, rate the importance of remembering this information long-term. "
-            "Consider factors like: uniqueness of information, actionability, personal significance, "
-            "and whether it contains key facts or decisions. Respond with just a number.\n\n"
-            f"Text to evaluate: {request.content}"
-        )
-        importance_rating_text = await send_to_bedrock(importance_assessment_prompt)
-        # Extract numeric rating (handle potential non-numeric responses)
+async def remember_content(request, on_stored=None):
+    """
+    Store a new memory for the user, integrating with existing memories. `on_stored(memory_id)` is called
+    as soon as the memory is written (or an existing one reinforced), before the follow-up maintenance
+    that may still fail, so a caller can record that the write happened.
+    """
+    with user_session(request.user_id):
         try:
-            importance_rating = float(
-                "".join(c for c in importance_rating_text if c.isdigit() or c == ".")
+            # Input validation
+            if not request.content.strip():
+                return {"message": "Cannot remember empty content"}
+            # Generate embedding for the content
+            field = active_space().field
+            embeddings = generate_embedding(request.content)
+            # Check for similar existing memories before creating a new one
+            similar_memories = await find_similar_memories(request.user_id, embeddings, rank=False)
+            # If we already have very similar memories, reinforce them instead
+            for memory in similar_memories:
+                if memory["similarity"] > 0.85:  # High similarity threshold
+                    # Update existing memory instead of creating a new one
+                    memory_nodes.update_one(
+                        {"_id": ObjectId(memory["id"])}, reinforcement_update()
+                    )
+                    if on_stored:
+                        on_stored(memory["id"])
+                    return {
+                        "message": "Reinforced existing memory",
+                        "memory_id": memory["id"],
+                    }
+            # For new memories, assess importance
+            importance_rating_text = await send_to_bedrock(
+                f"Text to evaluate: {request.content}", instructions=IMPORTANCE_INSTRUCTIONS, name="importance"
             )
-            # Normalize to 0-1 range
-            importance_score = min(max(importance_rating / 10, 0.1), 1.0)
-        except ValueError:
-            # Default if we can't parse the rating
-            importance_score = 0.5
-        # Generate a concise summary
-        summary_prompt = (
-            "Create a one-sentence summary of the key information in this text. Be specific and concise:\n\n"
-            + request.content
-        )
-        summary = await send_to_bedrock(summary_prompt)
-        # Create new memory node
-        new_memory = {
-            "user_id": request.user_id,
-            "content": request.content,
-            "summary": summary,
-            "importance": importance_score,
-            "access_count": 0,
-            "timestamp": datetime.datetime.now(datetime.timezone.utc),
-            "last_accessed": datetime.datetime.now(datetime.timezone.utc),
-            "embeddings": embeddings,
-        }
-        # Save to database
-        result = memory_nodes.insert_one(new_memory)
-        memory_id = str(result.inserted_id)
-        # Find similar memories for potential merging
-        similar_memories = await find_similar_memories(request.user_id, embeddings)
-        # Merge with similar memories if they exceed threshold but aren't identical
-        for memory in similar_memories:
-            if memory["id"] != memory_id and 0.7 < memory["similarity"] < 0.85:
-                # Combine content using AI
-                combined_content_prompt = (
-                    "These two texts contain related information. Combine them into a single cohesive text "
-                    "that preserves all important details from both without redundancy:\n\n"
-                    f"TEXT 1: {new_memory['content']}\n\n"
-                    f"TEXT 2: {memory['content']}"
-                )
-                combined_content = await send_to_bedrock(
-                    f"{combined_content_prompt}\n\nCombine these texts effectively."
-                )
-                # Update metrics
-                updated_importance = (
-                    max(new_memory["importance"], memory["importance"]) * 1.1
+            # Extract numeric rating (handle potential non-numeric responses)
+            try:
+                importance_rating = float(
+                    "".join(c for c in importance_rating_text if c.isdigit() or c == ".")
                 )
-                updated_access_count = (
-                    new_memory["access_count"] + memory["access_count"]
-                )
-                # Average embeddings
-                updated_embeddings = [
-                    (a + b) / 2 for a, b in zip(embeddings, memory["embeddings"])
-                ]
-                # Generate new summary
-                summary_prompt = (
-                    "Create a one-sentence summary capturing the key information:\n\n"
-                    + combined_content
-                )
-                summary = await send_to_bedrock(
-                    f"{summary_prompt}\n\nCreate a concise summary."
-                )
-                # Update the memory
-                memory_nodes.update_one(
-                    {"_id": ObjectId(memory_id)},
-                    {
-                        "$set": {
-                            "content": combined_content,
-                            "summary": summary,
-                            "importance": updated_importance,
-                            "access_count": updated_access_count,
-                            "embeddings": updated_embeddings,
-                        }
-                    },
-                )
-                # Delete the merged memory
-                memory_nodes.delete_one({"_id": ObjectId(memory["id"])})
-                break
-        # Update importance of other memories based on relationship to this memory
-        await update_importance(request.user_id, embeddings)
-        # Prune excessive memories if needed
-        await prune_memories(request.user_id)
-        logger.info(f"Memory created for user {request.user_id}: {summary[:50]}...")
-        return {
-            "message": f"Remembered: {new_memory['summary']}",
-            "memory_id": memory_id,
-            "importance": importance_score,
-        }
-    except Exception as error:
-        logger.error(f"Error remembering content: {error}")
-        raise
+                # Normalize to 0-1 range
+                importance_score = min(max(importance_rating / 10, 0.1), 1.0)
+            except ValueError:
+                # Default if we can't parse the rating
+                importance_score = 0.5
+            # Generate a concise summary
+            summary = await send_to_bedrock(request.content, instructions=SUMMARY_INSTRUCTIONS, name="memory_summary")
+            # Create new memory node
+            new_memory = {
+                "user_id": request.user_id,
+                "content": request.content,
+                "summary": summary,
+                "importance": importance_score,
+                "access_count": 0,
+                "timestamp": datetime.datetime.now(datetime.timezone.utc),
+                "last_accessed": datetime.datetime.now(datetime.timezone.utc),
+                "last_reinforced": datetime.datetime.now(datetime.timezone.utc),
+                field: embeddings,
+                **migration_embeddings(request.content),
+                "level": 0,
+                "parent_id": None,
+            }
+            if request.conversation_id:
+                new_memory["conversation_id"] = request.conversation_id
+            # Save to database
+            result = memory_nodes.insert_one(new_memory)
+            memory_id = str(result.inserted_id)
+            if on_stored:
+                on_stored(memory_id)
+            leaf_embeddings = embeddings
+            # Find similar memories for potential merging
+            similar_memories = await find_similar_memories(
+                request.user_id, embeddings, rank=False, include_embeddings=True
+            )
+            # Merge with similar memories if they exceed threshold but aren't identical
+            for memory in similar_memories:
+                if memory["id"] != memory_id and 0.7 < memory["similarity"] < 0.85:
+                    # Combine content using AI
+                    combined_content = await send_to_bedrock(
+                        f"TEXT 1: {new_memory['content']}\n\n"
+                        f"TEXT 2: {memory['content']}\n\n"
+                        "Combine these texts effectively.",
+                        instructions=MERGE_INSTRUCTIONS,
+                        name="memory_merge",
+                    )
+                    # Update metrics
+                    updated_importance = (
+                        max(new_memory["importance"], memory["decayed_importance"]) * 1.1
+                    )
+                    updated_access_count = (
+                        new_memory["access_count"] + memory["access_count"]
+                    )
+                    # Average embeddings, stored normalized like every other embedding
+                    updated_embeddings = to_list(
+                        centroid([embeddings, memory["embeddings"]], normalize=True)
+                    )
+                    # Generate new summary
+                    summary = await send_to_bedrock(
+                        f"{combined_content}\n\nCreate a concise summary.",
+                        instructions=MERGED_SUMMARY_INSTRUCTIONS,
+                        name="merged_summary",
+                    )
+                    # Update the memory
+                    memory_nodes.update_one(
+                        {"_id": ObjectId(memory_id)},
+                        {
+                            "$set": {
+                                "content": combined_content,
+                                "summary": summary,
+                                "importance": updated_importance,
+                                "access_count": updated_access_count,
+                                "last_reinforced": datetime.datetime.now(datetime.timezone.utc),
+                                field: updated_embeddings,
+                                # A migration target gets the vector its backfill would compute
+                                **migration_embeddings(combined_content),
+                            }
+                        },
+                    )
+                    leaf_embeddings = updated_embeddings
+                    # Delete the merged memory
+                    await detach_leaf(ObjectId(memory["id"]))
+                    memory_nodes.delete_one({"_id": ObjectId(memory["id"])})
+                    break
+            # Place the new memory in the memory tree
+            await attach_leaf(result.inserted_id, request.user_id, leaf_embeddings)
+            # Update importance of other memories based on relationship to this memory
+            await update_importance(request.user_id, embeddings)
+            # Prune excessive memories if needed
+            await prune_memories(request.user_id)
+            # Refresh cluster summaries that have gone stale without holding up the caller
+            schedule_summary_refresh(request.user_id)
+            logger.info("Memory created for user %s: %.50s...", request.user_id, summary)
+            return {
+                "message": f"Remembered: {new_memory['summary']}",
+                "memory_id": memory_id,
+                "importance": importance_score,
+            }
+        except Exception as error:
+            logger.error("Error remembering content: %s", error)
+            raise
+        finally:
+            # Any memory written above makes cached retrieval results stale
+            invalidate_user(request.user_id)
@@ -0,0 +1,467 @@
+import asyncio
+import datetime
+import numpy as np
+import pymongo
+from config import (
+    MAX_DEPTH, MEMORY_TREE_BRANCHING, MEMORY_TREE_BEAM_WIDTH, MEMORY_TREE_SUMMARY_REFRESH,
+    MEMORY_NODES_COLLECTION, MEMORY_NODES_VECTOR_SEARCH_INDEX_NAME, VECTOR_SEARCH_CANDIDATES
+)
+from database.mongodb import memory_nodes, union_aggregate
+from database.read_routing import for_reads
+from database.embedding_space import active_space
+from database.search_tuning import candidate_options
+from services.bedrock_service import send_to_bedrock
+from utils.logger import get_logger
+from utils.vector_math import many_to_many, one_to_many, to_array, to_unit, vector_sum
+
+logger = get_logger(__name__)
+
+# Matches leaf memories; memories stored before the tree existed are given level 0 by initialize_mongodb
+LEAF_FILTER = {"level": 0}
+# Users with a cluster summary refresh running, and those that stored memories meanwhile
+_refreshing = set()
+_refresh_dirty = set()
+# Strong references so scheduled refreshes are not garbage collected mid-flight
+_background_tasks = set()
+# Instructions of cluster summary prompts, a cacheable prefix (see send_to_bedrock)
+CLUSTER_SUMMARY_INSTRUCTIONS = (
+    "The following are summaries of related memories. Create a one-sentence summary of the "
+    "common theme and the key facts they share. Be specific and concise:\n"
+)
+
+
+def _two_means(vectors, weights, iterations=10):
+    """Split vectors into two groups by spherical 2-means, seeded with the two most dissimilar vectors"""
+    points = to_unit(vectors)
+    weights = np.asarray(weights, dtype=points.dtype)[:, None]
+    centers = points[[0, int(np.argmin(one_to_many(points[0], points)))]]
+    for _ in range(iterations):
+        labels = np.argmax(many_to_many(points, centers), axis=1)
+        if labels.min() == labels.max():
+            # Identical vectors: any balanced split is as good as another
+            return np.arange(len(points)) % 2
+        new_centers = to_unit(np.stack([(weights[labels == g] * points[labels == g]).sum(axis=0) for g in (0, 1)]))
+        if np.allclose(new_centers, centers, atol=1e-6):
+            break
+        centers = new_centers
+    return labels
+
+
+def _new_cluster(space, user_id, level, parent_id, embedding_sum, size, child_count):
+    embedding_sum = np.asarray(embedding_sum, dtype=np.float64)
+    return {
+        "user_id": user_id,
+        "level": level,
+        "parent_id": parent_id,
+        space.sum_field: embedding_sum.tolist(),
+        space.field: (embedding_sum / size).tolist(),
+        "size": size,
+        "child_count": child_count,
+        "summary": "",
+        # Start stale so the next refresh gives the cluster a summary
+        "pending_updates": MEMORY_TREE_SUMMARY_REFRESH,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc),
+    }
+
+
+def _group_totals(children, space):
+    """Sum of leaf embeddings and number of leaves below a group of child nodes"""
+    total = vector_sum([child.get(space.sum_field, child[space.field]) for child in children])
+    return total, sum(child.get("size", 1) for child in children)
+
+
+def _tree_height(user_id):
+    """Level of the user's root cluster(s), 0 when the user's memories are still a flat list"""
+    doc = memory_nodes.find_one(
+        {"user_id": user_id, "level": {"$gte": 1}},
+        projection={"level": 1},
+        sort=[("level", pymongo.DESCENDING)],
+    )
+    return doc["level"] if doc else 0
+
+
+def _tree_heights(user_ids):
+    """`_tree_height` of several users in one round trip; users without clusters are left out"""
+    response = for_reads(memory_nodes, "memory").aggregate(
+        [
+            {"$match": {"user_id": {"$in": list(user_ids)}, "level": {"$gte": 1}}},
+            {"$group": {"_id": "$user_id", "height": {"$max": "$level"}}},
+        ]
+    )
+    return {doc["_id"]: doc["height"] for doc in response}
+
+
+def _ancestor_ids(parent_id):
+    """Ids from `parent_id` up to its root, nearest first, fetched in one $graphLookup"""
+    docs = list(
+        memory_nodes.aggregate(
+            [
+                {"$match": {"_id": parent_id}},
+                {
+                    "$graphLookup": {
+                        "from": MEMORY_NODES_COLLECTION,
+                        "startWith": "$parent_id",
+                        "connectFromField": "parent_id",
+                        "connectToField": "_id",
+                        "as": "ancestors",
+                        "depthField": "depth",
+                    }
+                },
+                {"$project": {"ancestors._id": 1, "ancestors.depth": 1}},
+            ]
+        )
+    )
+    if not docs:
+        return []
+    ancestors = sorted(docs[0]["ancestors"], key=lambda doc: doc["depth"])
+    return [parent_id] + [doc["_id"] for doc in ancestors]
+
+
+def _shift_ancestors(ancestor_ids, delta, size_delta, space):
+    """
+    Add `delta` to the embedding sums of a leaf's ancestors and recompute their centroids server-side,
+    so concurrent inserts under the same cluster cannot lose each other's updates.
+    `ancestor_ids[0]` is the leaf's direct parent, whose child count changes by `size_delta`.
+    """
+    sum_path, centroid_path = f"${space.sum_field}", f"${space.field}"
+    memory_nodes.update_many(
+        {"_id": {"$in": ancestor_ids}},
+        [
+            {
+                "$set": {
+                    space.sum_field: {
+                        "$map": {
+                            "input": {"$zip": {"inputs": [sum_path, {"$literal": list(delta)}]}},
+                            "in": {"$add": [{"$arrayElemAt": ["$$this", 0]}, {"$arrayElemAt": ["$$this", 1]}]},
+                        }
+                    },
+                    "size": {"$add": ["$size", size_delta]},
+                    "child_count": {
+                        "$cond": [
+                            {"$eq": ["$_id", ancestor_ids[0]]},
+                            {"$add": ["$child_count", size_delta]},
+                            "$child_count",
+                        ]
+                    },
+                    "pending_updates": {"$add": [{"$ifNull": ["$pending_updates", 0]}, 1]},
+                }
+            },
+            {
+                "$set": {
+                    space.field: {
+                        "$cond": [
+                            {"$gt": ["$size", 0]},
+                            {"$map": {"input": sum_path, "in": {"$divide": ["$$this", "$size"]}}},
+                            centroid_path,
+                        ]
+                    }
+                }
+            },
+        ],
+    )
+
+
+def _search_options(user_id, parent_ids, limit, num_candidates):
+    """
+    $vectorSearch options of a memory node search. In `auto` candidate mode the children of given parents,
+    at most MEMORY_TREE_BRANCHING per parent, are compared exactly; see `candidate_options` otherwise.
+    """
+    if parent_ids and VECTOR_SEARCH_CANDIDATES == "auto":
+        return {"exact": True}
+    return candidate_options(MEMORY_NODES_COLLECTION, user_id, limit, num_candidates)
+
+
+def cluster_search_pipeline(user_id, embedding, level, parent_ids, limit):
+    """Pipeline finding the nearest clusters at `level`, restricted to the children of `parent_ids` below the root level"""
+    space = active_space()
+    search_filter = {"user_id": user_id, "level": level}
+    if parent_ids is not None:
+        search_filter["parent_id"] = {"$in": parent_ids}
+    return [
+        {
+            "$vectorSearch": {
+                "index": space.index_name(MEMORY_NODES_VECTOR_SEARCH_INDEX_NAME),
+                "path": space.field,
+                "queryVector": embedding,
+                **_search_options(user_id, parent_ids, limit, max(100, limit * 10)),
+                "limit": limit,
+                "filter": search_filter,
+            }
+        },
+        {"$project": {"_id": 1}},
+    ]
+
+
+def _search_clusters(user_id, embedding, level, parent_ids, limit):
+    """Nearest clusters at `level`, restricted to the children of `parent_ids` below the root level"""
+    response = for_reads(memory_nodes, "memory").aggregate(
+        cluster_search_pipeline(user_id, embedding, level, parent_ids, limit)
+    )
+    return [doc["_id"] for doc in response]
+
+
+async def candidate_parents(user_id, embedding, beam_width=MEMORY_TREE_BEAM_WIDTH):
+    """
+    Descend the user's memory tree towards `embedding`, keeping the `beam_width` closest clusters per level.
+
+    Returns:
+        Ids of the level-1 clusters whose leaves should be searched, or None when the user has no tree
+        (or the vector index has not caught up with it yet) and all leaves should be searched
+    """
+    height = _tree_height(user_id)
+    if height == 0:
+        return None
+    frontier = None
+    for level in range(height, 0, -1):
+        frontier = _search_clusters(user_id, embedding, level, frontier, beam_width)
+        if not frontier:
+            return None
+    return frontier
+
+
+def batch_candidate_parents(queries, beam_width=MEMORY_TREE_BEAM_WIDTH):
+    """
+    `candidate_parents` for several (user_id, embedding) pairs. All trees are descended together, with
+    one aggregation round trip per level.
+    """
+    heights = _tree_heights({user_id for user_id, _ in queries})
+    levels = [heights.get(user_id, 0) for user_id, _ in queries]
+    frontiers = [None] * len(queries)
+    active = [index for index, level in enumerate(levels) if level > 0]
+    while active:
+        branches = union_aggregate(
+            MEMORY_NODES_COLLECTION,
+            [
+                cluster_search_pipeline(*queries[index], levels[index], frontiers[index], beam_width)
+                for index in active
+            ],
+            operation="memory",
+        )
+        descending = []
+        for index, docs in zip(active, branches):
+            # As in candidate_parents, an empty level means all of the user's leaves are searched
+            frontiers[index] = [doc["_id"] for doc in docs] or None
+            levels[index] -= 1
+            if frontiers[index] and levels[index] > 0:
+                descending.append(index)
+        active = descending
+    return frontiers
+
+
+def leaf_vector_search(user_id, embedding, parent_ids, limit, num_candidates=100, filters=None):
+    """
+    Pipeline stages running a vector search over leaf memories, under `parent_ids` when given and
+    pre-filtered on `filters` (e.g. SearchScope.memory_filter). Clusters are excluded inside the search,
+    so they never take any of the `limit` results. `num_candidates` applies in `fixed` candidate mode,
+    see `_search_options`.
+    """
+    space = active_space()
+    search_filter = {"user_id": user_id, **LEAF_FILTER, **(filters or {})}
+    if parent_ids:
+        search_filter["parent_id"] = {"$in": parent_ids}
+    return [
+        {
+            "$vectorSearch": {
+                "index": space.index_name(MEMORY_NODES_VECTOR_SEARCH_INDEX_NAME),
+                "path": space.field,
+                "queryVector": embedding,
+                **_search_options(user_id, parent_ids, limit, num_candidates),
+                "limit": limit,
+                "filter": search_filter,
+            }
+        },
+    ]
+
+
+async def attach_leaf(leaf_id, user_id, embedding):
+    """
+    Insert a leaf memory into the user's tree under the closest level-1 cluster and update the centroids
+    on its path. The descent compares centroids exactly rather than through the vector index, so
+    clusters created moments ago by a split are already eligible.
+    """
+    height = _tree_height(user_id)
+    if height == 0:
+        if memory_nodes.count_documents({"user_id": user_id, **LEAF_FILTER}) > MEMORY_TREE_BRANCHING:
+            await rebuild_memory_tree(user_id)
+        return
+    space = active_space()
+    path = []
+    level = height
+    candidates = {"user_id": user_id, "level": height}
+    while level >= 1:
+        nodes = list(memory_nodes.find(candidates, projection={space.field: 1, "level": 1}))
+        if not nodes or any(node.get(space.field) is None for node in nodes):
+            # No children, or clusters built in an earlier embedding space
+            break
+        # Centroids are means of unit vectors and shorter than unit length, so only they are normalized
+        similarities = one_to_many(to_array(embedding), to_unit([node[space.field] for node in nodes]))
+        best = nodes[int(np.argmax(similarities))]
+        path.append(best["_id"])
+        level = best["level"] - 1
+        candidates = {"parent_id": best["_id"]}
+    if level != 0:
+        # The descent hit a cluster without children or centroid; start over from the leaves
+        logger.warning("Inconsistent memory tree for user %s, rebuilding", user_id)
+        await rebuild_memory_tree(user_id)
+        return
+    parent_id = path[-1]
+    memory_nodes.update_one({"_id": leaf_id}, {"$set": {"level": 0, "parent_id": parent_id}})
+    _shift_ancestors(path[::-1], embedding, 1, space)
+    await _split_if_needed(parent_id)
+
+
+async def detach_leaf(leaf_id):
+    """Remove a leaf from its cluster before it is deleted, dropping clusters left empty"""
+    space = active_space()
+    leaf = memory_nodes.find_one({"_id": leaf_id}, projection={"parent_id": 1, space.field: 1})
+    if not leaf or leaf.get("parent_id") is None:
+        return
+    ancestor_ids = _ancestor_ids(leaf["parent_id"])
+    if not ancestor_ids:
+        return
+    _shift_ancestors(ancestor_ids, [-value for value in leaf[space.field]], -1, space)
+    memory_nodes.update_one({"_id": leaf_id}, {"$set": {"parent_id": None}})
+    empty = {
+        doc["_id"]
+        for doc in memory_nodes.find({"_id": {"$in": ancestor_ids}, "size": {"$lte": 0}}, projection={"_id": 1})
+    }
+    if empty:
+        memory_nodes.delete_many({"_id": {"$in": list(empty)}})
+        for child_id, parent_id in zip(ancestor_ids, ancestor_ids[1:]):
+            if child_id in empty and parent_id not in empty:
+                memory_nodes.update_one({"_id": parent_id}, {"$inc": {"child_count": -1}})
+
+
+async def _split_if_needed(node_id):
+    """Split a cluster with more than MEMORY_TREE_BRANCHING children in two, growing the tree at the root"""
+    space = active_space()
+    node = memory_nodes.find_one({"_id": node_id}, projection={"user_id": 1, "level": 1, "parent_id": 1, "child_count": 1})
+    if not node or node.get("child_count", 0) <= MEMORY_TREE_BRANCHING:
+        return
+    children = list(
+        memory_nodes.find({"parent_id": node_id}, projection={space.field: 1, space.sum_field: 1, "size": 1})
+    )
+    if len(children) < 2:
+        return
+    labels = _two_means([child[space.field] for child in children], [child.get("size", 1) for child in children])
+    kept = [child for child, label in zip(children, labels) if label == 0]
+    moved = [child for child, label in zip(children, labels) if label == 1]
+
+    kept_sum, kept_size = _group_totals(kept, space)
+    moved_sum, moved_size = _group_totals(moved, space)
+    parent_id = node.get("parent_id")
+    sibling_id = memory_nodes.insert_one(
+        _new_cluster(space, node["user_id"], node["level"], parent_id, moved_sum, moved_size, len(moved))
+    ).inserted_id
+    memory_nodes.update_many({"_id": {"$in": [child["_id"] for child in moved]}}, {"$set": {"parent_id": sibling_id}})
+    refreshed = _new_cluster(space, node["user_id"], node["level"], parent_id, kept_sum, kept_size, len(kept))
+    refreshed.pop("summary")
+    refreshed.pop("timestamp")
+    memory_nodes.update_one({"_id": node_id}, {"$set": refreshed})
+
+    if parent_id is not None:
+        memory_nodes.update_one({"_id": parent_id}, {"$inc": {"child_count": 1}})
+    elif node["level"] < MAX_DEPTH:
+        # Root split: add a level so that a single root stays on top of the tree
+        root_id = memory_nodes.insert_one(
+            _new_cluster(space, node["user_id"], node["level"] + 1, None, kept_sum + moved_sum, kept_size + moved_size, 2)
+        ).inserted_id
+        memory_nodes.update_many({"_id": {"$in": [node_id, sibling_id]}}, {"$set": {"parent_id": root_id}})
+
+    # Either half of an oversized node (e.g. during a rebuild) may still be over the limit
+    await _split_if_needed(node_id)
+    await _split_if_needed(sibling_id)
+    if parent_id is not None:
+        await _split_if_needed(parent_id)
+
+
+async def refresh_stale_summaries(user_id, limit=4):
+    """
+    Regenerate the LLM summaries of clusters that received MEMORY_TREE_SUMMARY_REFRESH or more inserts
+    since their last summary, lowest level first so parents summarize fresh child summaries.
+    A `limit` of 0 refreshes all stale clusters.
+    """
+    stale = list(
+        memory_nodes.find(
+            {
+                "user_id": user_id,
+                "level": {"$gte": 1},
+                "pending_updates": {"$gte": MEMORY_TREE_SUMMARY_REFRESH},
+            },
+            projection={"_id": 1},
+        )
+        .sort("level", pymongo.ASCENDING)
+        .limit(limit)
+    )
+    for node in stale:
+        children = memory_nodes.find(
+            {"parent_id": node["_id"]}, projection={"summary": 1}
+        ).limit(MEMORY_TREE_BRANCHING * 2)
+        summaries = [child["summary"] for child in children if child.get("summary")]
+        summary = ""
+        if summaries:
+            summary = await send_to_bedrock(
+                "\n".join(f"- {text}" for text in summaries),
+                instructions=CLUSTER_SUMMARY_INSTRUCTIONS,
+                name="cluster_summary",
+            )
+        memory_nodes.update_one({"_id": node["_id"]}, {"$set": {"summary": summary, "pending_updates": 0}})
+
+
+async def _run_summary_refreshes(user_id):
+    try:
+        while True:
+            _refresh_dirty.discard(user_id)
+            try:
+                await refresh_stale_summaries(user_id)
+            except Exception as e:
+                logger.error("Error refreshing cluster summaries of user %s: %s", user_id, e)
+                return
+            if user_id not in _refresh_dirty:
+                return
+    finally:
+        _refreshing.discard(user_id)
+        _refresh_dirty.discard(user_id)
+
+
+def schedule_summary_refresh(user_id):
+    """
+    Refresh stale cluster summaries of a user in the background, off the ingest path. Memories stored
+    while a refresh is running for the same user lead to one follow-up refresh.
+    """
+    if user_id in _refreshing:
+        _refresh_dirty.add(user_id)
+        return
+    _refreshing.add(user_id)
+    task = asyncio.create_task(_run_summary_refreshes(user_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def rebuild_memory_tree(user_id):
+    """
+    Rebuild a user's memory tree from its leaves: all leaves start under a single root which is split
+    recursively until no cluster has more than MEMORY_TREE_BRANCHING children. Also used to migrate
+    flat memory lists and after re-embedding leaves.
+
+    Returns:
+        Number of clusters in the rebuilt tree
+    """
+    space = active_space()
+    try:
+        memory_nodes.delete_many({"user_id": user_id, "level": {"$gte": 1}})
+        memory_nodes.update_many({"user_id": user_id, "level": {"$in": [0, None]}}, {"$set": {"level": 0, "parent_id": None}})
+        leaves = list(memory_nodes.find({"user_id": user_id, "level": 0}, projection={space.field: 1}))
+        if len(leaves) <= MEMORY_TREE_BRANCHING:
+            return 0
+        total, size = _group_totals(leaves, space)
+        root_id = memory_nodes.insert_one(_new_cluster(space, user_id, 1, None, total, size, size)).inserted_id
+        memory_nodes.update_many({"user_id": user_id, "level": 0}, {"$set": {"parent_id": root_id}})
+        await _split_if_needed(root_id)
+        await refresh_stale_summaries(user_id, limit=0)
+        clusters = memory_nodes.count_documents({"user_id": user_id, "level": {"$gte": 1}})
+        logger.info("Rebuilt memory tree for user %s: %s memories in %s clusters", user_id, size, clusters)
+        return clusters
+    except Exception as e:
+        logger.error("Error rebuilding memory tree for user %s: %s", user_id, e)
+        raise
@@ -0,0 +1,220 @@
+import time
+import numpy as np
+from database.mongodb import VECTOR_SEARCH_INDEXES, db
+from database.embedding_space import active_space
+from database.search_tuning import cardinality_bucket, num_candidates, save_calibration
+from utils.logger import get_logger
+from utils.vector_math import many_to_many, to_unit, top_k
+
+logger = get_logger(__name__)
+
+DEFAULT_MULTIPLIERS = (1, 2, 5, 10, 20, 50)
+# Scores closer than this count as ties, so equally near documents are interchangeable in recall
+TIE_TOLERANCE = 1e-6
+
+
+def sample_users(collection_name, count, min_documents=0):
+    """{user id: number of vectors} of up to `count` random users with at least `min_documents` vectors"""
+    field = active_space().field
+    response = db[collection_name].aggregate(
+        [
+            {"$match": {field: {"$exists": True}}},
+            {"$group": {"_id": "$user_id", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gte": max(min_documents, 1)}}},
+            {"$sample": {"size": count}},
+        ]
+    )
+    return {doc["_id"]: doc["count"] for doc in response}
+
+
+def sample_queries(collection_name, user_id, count):
+    """Stored vectors of random documents of a user, used as query vectors"""
+    field = active_space().field
+    response = db[collection_name].aggregate(
+        [
+            {"$match": {"user_id": user_id, field: {"$exists": True}}},
+            {"$sample": {"size": count}},
+            {"$project": {field: 1}},
+        ]
+    )
+    return [doc[field] for doc in response]
+
+
+def exact_neighbours(collection_name, user_id, queries, limit, chunk_size=10000):
+    """
+    Cosine similarities (the metric of the vector indexes) of the true `limit` nearest neighbours of each
+    query among all of a user's vectors, by brute force. The vectors are streamed in chunks, keeping a
+    running top `limit` per query, so users of any size fit in memory.
+
+    Returns:
+        One array of similarities per query, highest first
+    """
+    field = active_space().field
+    units = to_unit(queries)
+    best_scores = [np.empty(0, dtype=units.dtype) for _ in queries]
+
+    def merge(chunk):
+        scores = many_to_many(units, to_unit([doc[field] for doc in chunk]))
+        for row in range(len(queries)):
+            combined = np.concatenate([best_scores[row], scores[row]])
+            best_scores[row] = combined[top_k(combined, limit)]
+
+    chunk = []
+    cursor = db[collection_name].find(
+        {"user_id": user_id, field: {"$exists": True}}, projection={"_id": 0, field: 1}
+    ).batch_size(chunk_size)
+    for doc in cursor:
+        chunk.append(doc)
+        if len(chunk) == chunk_size:
+            merge(chunk)
+            chunk = []
+    if chunk:
+        merge(chunk)
+    return best_scores
+
+
+def indexed_neighbours(collection_name, user_id, query, limit, options):
+    """
+    Nearest neighbours of a query through the collection's vector index, with the given $vectorSearch
+    options (numCandidates or exact)
+
+    Returns:
+        (cosine similarities of the results, seconds taken)
+    """
+    space = active_space()
+    base_name, _ = VECTOR_SEARCH_INDEXES[collection_name]
+    pipeline = [
+        {
+            "$vectorSearch": {
+                "index": space.index_name(base_name),
+                "path": space.field,
+                "queryVector": query,
+                **options,
+                "limit": limit,
+                "filter": {"user_id": user_id},
+            }
+        },
+        {"$project": {"_id": 0, "score": {"$meta": "vectorSearchScore"}}},
+    ]
+    started = time.perf_counter()
+    # The indexes score cosine similarity as (1 + cosine) / 2
+    similarities = [2 * doc["score"] - 1 for doc in db[collection_name].aggregate(pipeline)]
+    return similarities, time.perf_counter() - started
+
+
+def _settings(limit, multipliers):
+    """(label, $vectorSearch options) of every measured setting, exact search last"""
+    settings = [(str(multiplier), {"numCandidates": num_candidates(limit, multiplier)}) for multiplier in multipliers]
+    return settings + [("exact", {"exact": True})]
+
+
+def benchmark_user(collection_name, user_id, queries, limit, multipliers):
+    """
+    Recall and latency of each setting for one user's queries.
+
+    Returns:
+        {setting label: {"recall": [per query], "latency": [seconds per query]}}
+    """
+    truths = exact_neighbours(collection_name, user_id, queries, limit)
+    settings = _settings(limit, multipliers)
+    measured = {label: {"recall": [], "latency": []} for label, _ in settings}
+    # Warm the index and the connection before timing anything
+    indexed_neighbours(collection_name, user_id, queries[0], limit, settings[0][1])
+    for query, truth in zip(queries, truths):
+        if len(truth) == 0:
+            continue
+        for label, options in settings:
+            found, seconds = indexed_neighbours(collection_name, user_id, query, limit, options)
+            # A result is a true neighbour when no document outside the results is nearer. Comparing
+            # scores rather than ids keeps ties from counting as misses
+            hits = sum(similarity >= truth[-1] - TIE_TOLERANCE for similarity in found)
+            measured[label]["recall"].append(min(hits, len(truth)) / len(truth))
+            measured[label]["latency"].append(seconds)
+    return measured
+
+
+def run_benchmark(
+    collection_name, users=20, queries=10, limit=10, multipliers=DEFAULT_MULTIPLIERS, user_ids=None, min_documents=0
+):
+    """
+    Measure recall@`limit` and latency of a collection's vector index against exact brute-force search.
+
+    For each sampled user (or each of `user_ids`), `queries` of their stored vectors are searched with
+    numCandidates = `limit` * multiplier for every multiplier, and exactly; the results are compared with
+    the true nearest neighbours among all of the user's vectors. Results are grouped by user size (see
+    CARDINALITY_BUCKETS), since recall at a given numCandidates drops as users grow.
+
+    Returns:
+        Report with, per user size bucket, the mean recall and latency percentiles of every setting
+    """
+    if user_ids:
+        field = active_space().field
+        sizes = {
+            user_id: db[collection_name].count_documents({"user_id": user_id, field: {"$exists": True}})
+            for user_id in user_ids
+        }
+    else:
+        sizes = sample_users(collection_name, users, min_documents)
+    buckets = {}
+    for user_id, size in sizes.items():
+        user_queries = sample_queries(collection_name, user_id, queries)
+        if not user_queries:
+            continue
+        logger.info("Benchmarking %s for user %s (%d vectors, %d queries)", collection_name, user_id, size, len(user_queries))
+        bucket = buckets.setdefault(cardinality_bucket(size), {"users": 0, "queries": 0, "measured": {}})
+        bucket["users"] += 1
+        bucket["queries"] += len(user_queries)
+        for label, values in benchmark_user(collection_name, user_id, user_queries, limit, multipliers).items():
+            totals = bucket["measured"].setdefault(label, {"recall": [], "latency": []})
+            totals["recall"] += values["recall"]
+            totals["latency"] += values["latency"]
+    report = {"collection": collection_name, "space": active_space().to_dict(), "limit": limit, "buckets": []}
+    for bound in sorted(buckets, key=lambda bound: bound or float("inf")):
+        bucket = buckets[bound]
+        settings = []
+        for label, options in _settings(limit, multipliers):
+            values = bucket["measured"].get(label)
+            if not values or not values["recall"]:
+                continue
+            latency_ms = np.asarray(values["latency"]) * 1000
+            settings.append(
+                {
+                    "setting": label,
+                    "num_candidates": options.get("numCandidates"),
+                    "recall": float(np.mean(values["recall"])),
+                    "latency_p50_ms": float(np.percentile(latency_ms, 50)),
+                    "latency_p95_ms": float(np.percentile(latency_ms, 95)),
+                }
+            )
+        report["buckets"].append(
+            {"max_documents": bound, "users": bucket["users"], "queries": bucket["queries"], "settings": settings}
+        )
+    return report
+
+
+def recommend(report, target_recall):
+    """{bucket bound: smallest multiplier reaching `target_recall`, None when none does}"""
+    recommendations = {}
+    for bucket in report["buckets"]:
+        reaching = [
+            int(setting["setting"]) for setting in bucket["settings"]
+            if setting["setting"] != "exact" and setting["recall"] >= target_recall
+        ]
+        recommendations[bucket["max_documents"]] = min(reaching) if reaching else None
+    return recommendations
+
+
+def save_report(report):
+    """Record a report as the calibration `auto` candidate tuning reads, see SearchTuning.multiplier"""
+    buckets = [
+        {
+            "max_documents": bucket["max_documents"],
+            "users": bucket["users"],
+            "queries": bucket["queries"],
+            "recall": {
+                setting["setting"]: setting["recall"] for setting in bucket["settings"] if setting["setting"] != "exact"
+            },
+        }
+        for bucket in report["buckets"]
+    ]
+    save_calibration(report["collection"], report["limit"], [bucket for bucket in buckets if bucket["recall"]])
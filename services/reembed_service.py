@@ -0,0 +1,183 @@
+import asyncio
+import datetime
+import pymongo
+from botocore.exceptions import ClientError
+from config import (
+    REEMBED_BATCH_SIZE, REEMBED_CONCURRENCY, REEMBED_RATE_LIMIT, REEMBED_MAX_RETRIES
+)
+from database.embedding_space import active_space
+from database.mongodb import VECTOR_SEARCH_INDEXES, db, reembed_checkpoints, vector_search_index_definition
+from services.bedrock_service import generate_embedding
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Field holding the text that gets embedded, per collection
+SOURCE_FIELDS = {
+    "conversations": "text",
+    "memory_nodes": "content",
+    "conversation_rollups": "summary",
+}
+
+
+class RateLimiter:
+    """Spaces out calls so that at most `rate` start per second (0 disables limiting)"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def job_name(collection_name, target_field, model_id):
+    """Default checkpoint key for a re-embedding run"""
+    return f"{collection_name}:{target_field}:{model_id}"
+
+
+def create_shadow_index(collection_name, index_name, target_field, num_dimensions):
+    """Create a vector search index over a shadow embedding field for zero-downtime cutover"""
+    existing = {index["name"] for index in db[collection_name].list_search_indexes()}
+    if index_name in existing:
+        logger.info("Search index %s already exists on %s", index_name, collection_name)
+        return
+    db[collection_name].create_search_index(
+        {
+            "name": index_name,
+            "type": "vectorSearch",
+            "definition": vector_search_index_definition(
+                target_field, num_dimensions, VECTOR_SEARCH_INDEXES[collection_name][1]
+            ),
+        }
+    )
+    logger.info("Created search index %s on %s.%s", index_name, collection_name, target_field)
+
+
+async def _embed_with_retry(text, model_id, dimensions, limiter, semaphore):
+    """Embed a single text, backing off on Bedrock throttling"""
+    async with semaphore:
+        for attempt in range(REEMBED_MAX_RETRIES + 1):
+            await limiter.wait()
+            try:
+                return await asyncio.to_thread(generate_embedding, text, model_id, dimensions)
+            except ClientError as err:
+                code = err.response.get("Error", {}).get("Code")
+                if code not in ("ThrottlingException", "ServiceUnavailableException") or attempt == REEMBED_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(min(2 ** attempt, 30))
+
+
+async def reembed_collection(
+    collection_name: str,
+    target_field: str = "embeddings",
+    model_id: str = None,
+    dimensions: int = None,
+    batch_size: int = REEMBED_BATCH_SIZE,
+    concurrency: int = REEMBED_CONCURRENCY,
+    rate_limit: float = REEMBED_RATE_LIMIT,
+    only_missing: bool = False,
+    reset: bool = False,
+    name: str = None,
+):
+    """
+    Re-embed every document of a collection in `_id` order, writing the vectors to `target_field`.
+
+    Progress is checkpointed after each batch under `name`, so a killed run resumes from the
+    last written `_id`. Writing into a field other than `embeddings` leaves the live vectors
+    untouched until reads are switched over.
+
+    Args:
+        collection_name: "conversations", "memory_nodes" or "conversation_rollups"
+        target_field: Field to write the new embeddings to
+        model_id: Embedding model to use, defaults to that of the active embedding space
+        dimensions: Output size for models with configurable dimensions, defaults to the model's default
+        batch_size: Documents fetched and written per bulk_write
+        concurrency: Maximum embedding requests in flight
+        rate_limit: Maximum embedding requests started per second
+        only_missing: Skip documents that already have `target_field`
+        reset: Ignore any existing checkpoint and start from the beginning
+        name: Checkpoint key, defaults to "<collection>:<field>:<model>"
+    Returns:
+        The final checkpoint document
+    """
+    if collection_name not in SOURCE_FIELDS:
+        raise ValueError(f"Unsupported collection: {collection_name}")
+    if model_id is None:
+        space = active_space()
+        model_id, dimensions = space.model_id, space.dimensions
+    source_field = SOURCE_FIELDS[collection_name]
+    collection = db[collection_name]
+    name = name or job_name(collection_name, target_field, model_id)
+
+    if reset:
+        reembed_checkpoints.delete_one({"_id": name})
+    checkpoint = reembed_checkpoints.find_one({"_id": name}) or {
+        "_id": name,
+        "collection": collection_name,
+        "target_field": target_field,
+        "model_id": model_id,
+        "dimensions": dimensions,
+        "last_id": None,
+        "processed": 0,
+        "skipped": 0,
+        "completed": False,
+    }
+    if checkpoint["completed"]:
+        logger.info("Re-embedding job %s already completed", name)
+        return checkpoint
+
+    limiter = RateLimiter(rate_limit)
+    semaphore = asyncio.Semaphore(concurrency)
+    base_filter = {source_field: {"$exists": True}}
+    if only_missing:
+        base_filter[target_field] = {"$exists": False}
+
+    while True:
+        query = dict(base_filter)
+        if checkpoint["last_id"] is not None:
+            query["_id"] = {"$gt": checkpoint["last_id"]}
+        # Each batch is a fresh range query on _id, so no long-lived cursor can time out
+        batch = list(
+            collection.find(query, projection={source_field: 1})
+            .sort("_id", pymongo.ASCENDING)
+            .limit(batch_size)
+        )
+        if not batch:
+            break
+
+        texts = [(doc["_id"], (doc.get(source_field) or "").strip()) for doc in batch]
+        embeddable = [(doc_id, text) for doc_id, text in texts if text]
+        embeddings = await asyncio.gather(
+            *(_embed_with_retry(text, model_id, dimensions, limiter, semaphore) for _, text in embeddable)
+        )
+        operations = [
+            pymongo.UpdateOne({"_id": doc_id}, {"$set": {target_field: embedding}})
+            for (doc_id, _), embedding in zip(embeddable, embeddings)
+        ]
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+
+        checkpoint["last_id"] = batch[-1]["_id"]
+        checkpoint["processed"] += len(operations)
+        checkpoint["skipped"] += len(texts) - len(embeddable)
+        checkpoint["updated_at"] = datetime.datetime.now(datetime.timezone.utc)
+        reembed_checkpoints.replace_one({"_id": name}, checkpoint, upsert=True)
+        logger.info(
+            "Re-embedded %s documents in %s (last _id %s)",
+            checkpoint["processed"], collection_name, checkpoint["last_id"],
+        )
+
+    checkpoint["completed"] = True
+    checkpoint["updated_at"] = datetime.datetime.now(datetime.timezone.utc)
+    reembed_checkpoints.replace_one({"_id": name}, checkpoint, upsert=True)
+    logger.info("Re-embedding job %s completed: %s documents", name, checkpoint["processed"])
+    return checkpoint
@@ -0,0 +1,326 @@
+import asyncio
+import pymongo
+import pymongo.errors
+from config import (
+    RETRIEVE_MEMORY_TIMEOUT_SECONDS, SEMANTIC_CACHE_ENABLED, HYBRID_SEARCH_INCLUDE_ROLLUPS, SIMILAR_MEMORIES_TOP_N
+)
+from database.search_scope import UNSCOPED
+from services.bedrock_service import generate_query_embedding_async
+from services.cache_service import retrieval_cache, write_versions
+from services.conversation_service import (
+    batch_hybrid_search, get_conversation_context, get_rollup_context, relevant_documents, search_memory
+)
+from services.memory_service import batch_find_similar_memories, find_similar_memories
+from services.summary_service import get_rolling_summaries, get_rolling_summary, schedule_summary_update
+from utils.deadline import Deadline, DeadlineExceeded
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+async def within(deadline, coro):
+    """
+    Await a stage within the remaining budget. MongoDB operations inside the stage inherit the budget
+    through pymongo.timeout, so they are also cut off server-side.
+    """
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        coro.close()
+        raise DeadlineExceeded()
+    try:
+        with pymongo.timeout(remaining):
+            return await asyncio.wait_for(coro, remaining)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded()
+    except pymongo.errors.PyMongoError as error:
+        if error.timeout:
+            raise DeadlineExceeded() from error
+        raise
+
+
+def format_memories(similar_memories):
+    """Shape similar memory nodes for the API response"""
+    memories = [
+        {
+            "content": memory["content"],
+            "summary": memory["summary"],
+            "similarity": memory["similarity"],
+            "importance": memory["effective_importance"],
+            "score": memory["score"],
+        }
+        for memory in similar_memories
+    ]
+    return memories if memories else "No similar memories found"
+
+
+def _empty_result():
+    return {
+        "related_conversation": "No conversation found",
+        "conversation_summary": "No summary found",
+        "summary_status": "skipped",
+        "similar_memories": "No similar memories found",
+    }
+
+
+async def retrieve(user_id, text, timeout=None, scope=UNSCOPED, top_n=SIMILAR_MEMORIES_TOP_N):
+    """
+    Retrieve memory items, context, summary, and similar memory nodes within a latency budget.
+
+    The budget (`timeout` seconds, default RETRIEVE_MEMORY_TIMEOUT_SECONDS) is shared by all stages.
+    When it runs out, whatever has been computed so far is returned: `partial` is set, the stages that
+    did not finish are listed in `skipped_stages` and `summary_status` reports whether the conversation
+    summary is "ready", "pending" (not computed yet), "skipped" or "none" (no related conversation).
+    A `scope` (SearchScope) restricts the searched messages and memories; `top_n` is the number of similar
+    memory nodes returned.
+
+    With the semantic cache enabled, concurrent requests for the same user, text and budget share one
+    computation, and a query embedding close enough to a recently answered one returns that answer.
+    Requests with different budgets never share a computation: a follower could otherwise wait past its
+    own budget, or get a partial result its larger budget would have completed.
+    """
+    if not SEMANTIC_CACHE_ENABLED:
+        return await _retrieve(user_id, text, timeout, scope, top_n)
+    return await retrieval_cache.single_flight(
+        (user_id, " ".join(text.split()), scope.key(), top_n, timeout or RETRIEVE_MEMORY_TIMEOUT_SECONDS),
+        lambda: _retrieve(user_id, text, timeout, scope, top_n),
+    )
+
+
+def _cache_key(scope, top_n, version):
+    """
+    Cache entries are only shared by requests with the same scope and number of memories, made at the same
+    write version of the user (see write_versions)
+    """
+    return scope.key(), top_n, version
+
+
+async def _retrieve(user_id, text, timeout, scope, top_n):
+    deadline = Deadline(timeout or RETRIEVE_MEMORY_TIMEOUT_SECONDS)
+    generation = retrieval_cache.generation(user_id)
+    # Read before computing: a result is cached under the version its data reflects
+    version = write_versions([user_id])[user_id] if SEMANTIC_CACHE_ENABLED else None
+    vector_query = None
+    skipped = []
+    result = _empty_result()
+
+    def finish():
+        result["partial"] = bool(skipped)
+        result["skipped_stages"] = skipped
+        if skipped:
+            logger.info("Retrieval for user %s exceeded its %ss budget, skipped %s", user_id, deadline.seconds, skipped)
+        elif SEMANTIC_CACHE_ENABLED and result["summary_status"] != "pending":
+            retrieval_cache.store(user_id, vector_query, result, generation, _cache_key(scope, top_n, version))
+        return result
+
+    try:
+        vector_query = await within(deadline, generate_query_embedding_async(text))
+    except DeadlineExceeded:
+        skipped += ["embedding", "search", "similar_memories", "context", "summary"]
+        return finish()
+    if SEMANTIC_CACHE_ENABLED:
+        cached = retrieval_cache.lookup(user_id, vector_query, _cache_key(scope, top_n, version))
+        if cached is not None:
+            return {**cached, "cached": True}
+
+    # Search conversations and memory nodes concurrently
+    memory_items, similar_memories = await asyncio.gather(
+        within(deadline, search_memory(user_id, text, vector_query, scope)),
+        within(deadline, find_similar_memories(user_id, vector_query, top_n, scope)),
+        return_exceptions=True,
+    )
+    for stage, outcome in (("search", memory_items), ("similar_memories", similar_memories)):
+        if isinstance(outcome, DeadlineExceeded):
+            skipped.append(stage)
+        elif isinstance(outcome, BaseException):
+            raise outcome
+    if "similar_memories" not in skipped:
+        result["similar_memories"] = format_memories(similar_memories)
+    if "search" in skipped:
+        skipped += ["context", "summary"]
+        return finish()
+    if memory_items["documents"] == "No documents found":
+        result["summary_status"] = "none"
+        return finish()
+
+    top_item = memory_items["documents"][0]
+    if top_item["type"] == "rollup":
+        # Archived conversations already carry a rollup summary
+        try:
+            context = await within(deadline, get_rollup_context(top_item["_id"], user_id=user_id))
+        except DeadlineExceeded:
+            skipped += ["context", "summary"]
+            return finish()
+        result["related_conversation"] = context["documents"]
+        result["conversation_summary"] = context["summary"]
+        result["summary_status"] = "ready"
+        return finish()
+
+    # Retrieve conversation context around the matching memory item
+    try:
+        context = await within(deadline, get_conversation_context(top_item["_id"], user_id=user_id))
+        result["related_conversation"] = context["documents"]
+    except DeadlineExceeded:
+        skipped.append("context")
+
+    # Use the precomputed rolling summary; it is maintained on ingest, not here
+    try:
+        summary = await within(deadline, get_rolling_summary(user_id, top_item["conversation_id"]))
+    except DeadlineExceeded:
+        skipped.append("summary")
+        result["conversation_summary"] = "Summary skipped: latency budget exhausted"
+        return finish()
+    if summary is None:
+        schedule_summary_update(user_id, top_item["conversation_id"])
+        result["conversation_summary"] = "Summary pending"
+        result["summary_status"] = "pending"
+    else:
+        result["conversation_summary"] = summary["summary"]
+        result["summary_status"] = "ready"
+    return finish()
+
+
+async def retrieve_batch(queries, timeout=None):
+    """
+    Retrieve for several (user_id, text, scope, top_n) queries at once, with results shaped like those of
+    `retrieve` and in request order.
+
+    Distinct texts are embedded concurrently, the conversation and memory searches of all queries share
+    aggregation round trips, and a context or summary needed by several queries is fetched once. The
+    latency budget is shared by the whole batch.
+    """
+    deadline = Deadline(timeout or RETRIEVE_MEMORY_TIMEOUT_SECONDS)
+    generations = [retrieval_cache.generation(user_id) for user_id, _, _, _ in queries]
+    versions = write_versions({user_id for user_id, _, _, _ in queries}) if SEMANTIC_CACHE_ENABLED else {}
+    vectors = [None] * len(queries)
+    results = [_empty_result() for _ in queries]
+    skipped = [[] for _ in queries]
+
+    def skip(indices, stages):
+        for index in indices:
+            skipped[index] += stages
+
+    def finish():
+        for index, result in enumerate(results):
+            if result.get("cached"):
+                continue
+            result["partial"] = bool(skipped[index])
+            result["skipped_stages"] = skipped[index]
+            if SEMANTIC_CACHE_ENABLED and not skipped[index] and result["summary_status"] != "pending":
+                retrieval_cache.store(
+                    queries[index][0], vectors[index], result, generations[index],
+                    _cache_key(*queries[index][2:], versions[queries[index][0]]),
+                )
+        if any(skipped):
+            logger.info(
+                "Batch retrieval exceeded its %ss budget for %d of %d queries",
+                deadline.seconds, sum(map(bool, skipped)), len(queries),
+            )
+        return results
+
+    async def embed_all(texts):
+        return await asyncio.gather(*(generate_query_embedding_async(text) for text in texts))
+
+    texts = list(dict.fromkeys(text for _, text, _, _ in queries))
+    try:
+        embeddings = dict(zip(texts, await within(deadline, embed_all(texts))))
+    except DeadlineExceeded:
+        skip(range(len(queries)), ["embedding", "search", "similar_memories", "context", "summary"])
+        return finish()
+    pending = []
+    for index, (user_id, text, scope, top_n) in enumerate(queries):
+        vectors[index] = embeddings[text]
+        cached = (
+            retrieval_cache.lookup(user_id, vectors[index], _cache_key(scope, top_n, versions.get(user_id)))
+            if SEMANTIC_CACHE_ENABLED else None
+        )
+        if cached is not None:
+            results[index] = {**cached, "cached": True}
+        else:
+            pending.append(index)
+    if not pending:
+        return finish()
+
+    # Search conversations and memory nodes of all queries concurrently
+    searches, memories = await asyncio.gather(
+        within(deadline, asyncio.to_thread(
+            batch_hybrid_search,
+            [(queries[index][1], vectors[index], queries[index][0], queries[index][2]) for index in pending],
+            weight=0.8, top_n=5, include_rollups=HYBRID_SEARCH_INCLUDE_ROLLUPS,
+        )),
+        within(deadline, asyncio.to_thread(
+            batch_find_similar_memories,
+            [(queries[index][0], vectors[index], *queries[index][2:]) for index in pending],
+        )),
+        return_exceptions=True,
+    )
+    for stage, outcome in (("search", searches), ("similar_memories", memories)):
+        if isinstance(outcome, DeadlineExceeded):
+            skip(pending, [stage])
+        elif isinstance(outcome, BaseException):
+            raise outcome
+    if not isinstance(memories, DeadlineExceeded):
+        for index, similar_memories in zip(pending, memories):
+            results[index]["similar_memories"] = format_memories(similar_memories)
+    if isinstance(searches, DeadlineExceeded):
+        skip(pending, ["context", "summary"])
+        return finish()
+    top_items = {}
+    for index, documents in zip(pending, searches):
+        documents = relevant_documents(documents)["documents"]
+        if documents == "No documents found":
+            results[index]["summary_status"] = "none"
+        else:
+            top_items[index] = documents[0]
+
+    # Fetch each distinct context once
+    contexts = {}
+    for index, top_item in top_items.items():
+        contexts.setdefault((top_item["type"] == "rollup", top_item["_id"]), queries[index][0])
+    fetched = await asyncio.gather(
+        *(
+            within(deadline, (get_rollup_context if rollup else get_conversation_context)(_id, user_id=user_id))
+            for (rollup, _id), user_id in contexts.items()
+        ),
+        return_exceptions=True,
+    )
+    fetched = dict(zip(contexts, fetched))
+    summary_keys = {}
+    for index, top_item in top_items.items():
+        rollup = top_item["type"] == "rollup"
+        context = fetched[(rollup, top_item["_id"])]
+        if isinstance(context, DeadlineExceeded):
+            skip([index], ["context", "summary"] if rollup else ["context"])
+        elif isinstance(context, BaseException):
+            raise context
+        else:
+            results[index]["related_conversation"] = context["documents"]
+            if rollup:
+                # Archived conversations already carry a rollup summary
+                results[index]["conversation_summary"] = context["summary"]
+                results[index]["summary_status"] = "ready"
+        if not rollup:
+            summary_keys.setdefault((queries[index][0], top_item["conversation_id"]), []).append(index)
+    if not summary_keys:
+        return finish()
+
+    # Use the precomputed rolling summaries, all read in one query
+    try:
+        summaries = await within(deadline, get_rolling_summaries(list(summary_keys)))
+    except DeadlineExceeded:
+        for indices in summary_keys.values():
+            skip(indices, ["summary"])
+            for index in indices:
+                results[index]["conversation_summary"] = "Summary skipped: latency budget exhausted"
+        return finish()
+    for key, indices in summary_keys.items():
+        summary = summaries.get(key)
+        if summary is None:
+            schedule_summary_update(*key)
+        for index in indices:
+            if summary is None:
+                results[index]["conversation_summary"] = "Summary pending"
+                results[index]["summary_status"] = "pending"
+            else:
+                results[index]["conversation_summary"] = summary["summary"]
+                results[index]["summary_status"] = "ready"
+    return finish()
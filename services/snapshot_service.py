@@ -0,0 +1,166 @@
+import datetime
+import pymongo.errors
+from config import (
+    CONVERSATIONS_COLLECTION, MEMORY_NODES_COLLECTION, SNAPSHOT_VECTOR_ENCODING, SNAPSHOT_BATCH_SIZE,
+    SNAPSHOT_COMPRESSION_LEVEL
+)
+from database.embedding_space import active_space, settings
+from database.mongodb import db
+from database.search_tuning import tuning
+from services.cache_service import invalidate_user
+from utils.logger import get_logger
+from utils.snapshot_format import ENCODINGS, MAGIC, decode_vector, encode_frame, encode_vector, read_frames
+from utils.vector_math import normalize_embedding
+
+logger = get_logger(__name__)
+
+SNAPSHOT_VERSION = 1
+# Collections a snapshot holds the documents of one user from, in the order they are written
+SNAPSHOT_COLLECTIONS = (CONVERSATIONS_COLLECTION, MEMORY_NODES_COLLECTION)
+
+
+def _other_vector_fields(space):
+    """Vector fields of retired and migrating spaces, which a snapshot leaves out"""
+    others = settings.retired() + ([settings.migration()] if settings.migration() else [])
+    fields = {field for other in others for field in (other.field, other.sum_field)}
+    return fields - {space.field, space.sum_field}
+
+
+def snapshot_user(user_id, encoding=SNAPSHOT_VECTOR_ENCODING, batch_size=SNAPSHOT_BATCH_SIZE,
+                  level=SNAPSHOT_COMPRESSION_LEVEL):
+    """
+    Stream a snapshot of a user's conversations and memories, as chunks of bytes.
+
+    The snapshot starts with MAGIC and a header frame describing the embedding space, followed by frames
+    of up to `batch_size` documents and an end frame with the document counts. Only the vectors of the
+    active space are kept, encoded as float16 or int8 (see `encode_vector`); every other field is stored
+    as BSON, so ids, timestamps and the memory tree links survive as they are.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown vector encoding {encoding!r}, expected one of {ENCODINGS}")
+    space = active_space()
+    vector_fields = [space.field, space.sum_field]
+    yield MAGIC
+    yield encode_frame(
+        {
+            "type": "header",
+            "version": SNAPSHOT_VERSION,
+            "user_id": user_id,
+            "created_at": datetime.datetime.now(datetime.timezone.utc),
+            "space": space.to_dict(),
+            "encoding": encoding,
+            "vector_fields": vector_fields,
+            "collections": list(SNAPSHOT_COLLECTIONS),
+        },
+        level,
+    )
+    projection = {field: 0 for field in _other_vector_fields(space)} or None
+    counts = {}
+    for collection_name in SNAPSHOT_COLLECTIONS:
+        counts[collection_name] = 0
+        cursor = db[collection_name].find({"user_id": user_id}, projection=projection).batch_size(batch_size)
+        batch = []
+        for doc in cursor:
+            for field in vector_fields:
+                if doc.get(field) is not None:
+                    doc[field] = encode_vector(doc[field], encoding)
+            batch.append(doc)
+            if len(batch) == batch_size:
+                yield encode_frame({"type": "documents", "collection": collection_name, "documents": batch}, level)
+                counts[collection_name] += len(batch)
+                batch = []
+        if batch:
+            yield encode_frame({"type": "documents", "collection": collection_name, "documents": batch}, level)
+            counts[collection_name] += len(batch)
+    yield encode_frame({"type": "end", "counts": counts}, level)
+    logger.info("Snapshot of user %s: %s", user_id, counts)
+
+
+class SnapshotRestore:
+    """
+    Writes the frames of a snapshot, in order, into this deployment. Documents keep their ids, so
+    documents that already exist are skipped and an interrupted restore can simply be run again.
+    """
+
+    def __init__(self):
+        self.header = None
+        self.finished = False
+        self.counts = {}
+
+    def _check_header(self, header):
+        if header.get("type") != "header" or header.get("version") != SNAPSHOT_VERSION:
+            raise ValueError("Unsupported snapshot version")
+        if any(field not in header for field in ("user_id", "space", "encoding", "vector_fields", "collections")):
+            raise ValueError("Malformed snapshot header")
+        if header["collections"] and not set(header["collections"]) <= set(SNAPSHOT_COLLECTIONS):
+            raise ValueError(f"Snapshot holds unknown collections {header['collections']}")
+        source, target = header["space"], active_space()
+        if (source.get("model_id"), source.get("dimensions")) != (target.model_id, target.dimensions):
+            # Vectors of another model or size would not be comparable with the stored ones
+            raise ValueError(
+                f"Snapshot vectors are {source.get('model_id')} with {source.get('dimensions')} dimensions, "
+                f"the active embedding space is {target}"
+            )
+        if settings.migration() is not None:
+            logger.warning("Restoring during an embedding migration; run its backfill again afterwards")
+
+    def _insert(self, collection_name, documents):
+        """Insert a batch unordered, counting documents that already existed instead of failing on them"""
+        try:
+            inserted = len(db[collection_name].insert_many(documents, ordered=False).inserted_ids)
+        except pymongo.errors.BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors):
+                raise
+            inserted = e.details.get("nInserted", len(documents) - len(errors))
+        counts = self.counts.setdefault(collection_name, {"inserted": 0, "existing": 0})
+        counts["inserted"] += inserted
+        counts["existing"] += len(documents) - inserted
+
+    def apply(self, frame):
+        if self.header is None:
+            self._check_header(frame)
+            self.header = frame
+            return
+        if self.finished:
+            raise ValueError("Data after the end of the snapshot")
+        if frame.get("type") == "end":
+            self.finished = True
+            return
+        if frame.get("type") != "documents" or frame.get("collection") not in self.header["collections"]:
+            raise ValueError(f"Unexpected snapshot frame {frame.get('type')!r}")
+        if not isinstance(frame.get("documents"), list):
+            raise ValueError("Snapshot frame without documents")
+        # The active space may keep its vectors under another field name here than where the snapshot was taken
+        source_field, source_sum = self.header["vector_fields"]
+        space = active_space()
+        encoding = self.header["encoding"]
+        for doc in frame["documents"]:
+            vector = doc.pop(source_field, None)
+            vector_sum = doc.pop(source_sum, None)
+            if vector is not None:
+                vector = decode_vector(vector, encoding)
+                # Leaves are unit vectors, which quantization moved slightly off; cluster centroids are means
+                # and are restored as they were
+                doc[space.field] = normalize_embedding(vector) if doc.get("level", 0) == 0 else vector
+            if vector_sum is not None:
+                doc[space.sum_field] = decode_vector(vector_sum, encoding)
+        if frame["documents"]:
+            self._insert(frame["collection"], frame["documents"])
+
+    def finish(self):
+        """Counts of inserted and already existing documents per collection; raises if the end was never read"""
+        if not self.finished:
+            raise ValueError("Snapshot is truncated")
+        invalidate_user(self.header["user_id"])
+        tuning.invalidate()
+        logger.info("Restored snapshot of user %s: %s", self.header["user_id"], self.counts)
+        return {"user_id": self.header["user_id"], "collections": self.counts}
+
+
+def restore_snapshot(stream):
+    """Restore a snapshot read from a binary file object, see `SnapshotRestore`"""
+    restore = SnapshotRestore()
+    for frame in read_frames(stream):
+        restore.apply(frame)
+    return restore.finish()
@@ -0,0 +1,186 @@
+import json
+import asyncio
+import datetime
+import pymongo
+import pymongo.errors
+from bson import json_util
+from config import ROLLING_SUMMARY_MAX_MESSAGES, ROLLING_SUMMARY_LOOKBACK_SECONDS
+from database.mongodb import conversations, conversation_summaries, user_session
+from database.read_routing import for_reads
+from services.bedrock_service import send_to_bedrock
+from services.cache_service import invalidate_user
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# (user_id, conversation_id) pairs with an update running, and those that received messages meanwhile
+_in_flight = set()
+_dirty = set()
+# Strong references so scheduled updates are not garbage collected mid-flight
+_background_tasks = set()
+
+# Static part of the summary prompt, sent ahead of the varying part so Bedrock can cache it
+ROLLING_SUMMARY_INSTRUCTIONS = (
+    "You are an advanced AI assistant that maintains a running summary of a conversation.\n"
+    "Update the existing summary with the new messages, preserving all essential details: key points, "
+    "topics discussed, decisions made and relevant insights. Do not drop earlier information unless the "
+    "new messages explicitly supersede it.\n\n"
+    "### Output Format:\n"
+    "- **Topic:** Briefly describe the conversation's purpose.\n"
+    "- **Key Discussion Points:** Outline the main topics covered.\n"
+    "- **Decisions & Takeaways:** Highlight key conclusions or next steps.\n"
+    "- **Unresolved Questions (if any):** Mention pending queries or areas needing further clarification.\n"
+)
+
+
+async def fold_into_summary(previous_summary, messages):
+    """Ask the LLM to update a conversation summary with new messages only"""
+    prompt = (
+        f"Existing summary: {previous_summary or 'None (this is the start of the conversation)'}\n\n"
+        f"New messages (JSON): {json.dumps(messages, default=json_util.default)}"
+    )
+    return await send_to_bedrock(prompt, instructions=ROLLING_SUMMARY_INSTRUCTIONS, name="rolling_summary")
+
+
+async def update_rolling_summary(user_id, conversation_id):
+    """
+    Bring the stored summary of a conversation up to date.
+
+    The summary document is versioned by `(last_message_timestamp, last_message_id)`, the newest timestamp
+    folded in and the `_id` of the last message folded in. Message ids are created by the client before
+    the insert, so neither order tells which messages were committed after the last update. Instead each
+    update reads the messages from ROLLING_SUMMARY_LOOKBACK_SECONDS before `last_message_timestamp` on,
+    skipping the ids in `recent_messages`, those already folded in within that window. Only these
+    messages are sent to the LLM together with the previous summary, and the write is conditional on the
+    version read, so concurrent updaters in other processes cannot overwrite each other.
+    """
+    lookback = datetime.timedelta(seconds=ROLLING_SUMMARY_LOOKBACK_SECONDS)
+    with user_session(user_id):
+        while True:
+            current = conversation_summaries.find_one(
+                {"user_id": user_id, "conversation_id": conversation_id},
+                projection={"summary": 1, "last_message_timestamp": 1, "last_message_id": 1, "recent_messages": 1},
+            )
+            query = {"user_id": user_id, "conversation_id": conversation_id}
+            recent = []
+            if current is not None and "recent_messages" not in current:
+                # Summaries written before the look-back window existed only know their last timestamp
+                query["timestamp"] = {"$gt": current["last_message_timestamp"]}
+            elif current is not None:
+                recent = current["recent_messages"]
+                query["timestamp"] = {"$gte": current["last_message_timestamp"] - lookback}
+                query["_id"] = {"$nin": [message["_id"] for message in recent]}
+            new_messages = list(
+                conversations.find(query, projection={"type": 1, "text": 1, "timestamp": 1})
+                .sort([("timestamp", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)])
+                .limit(ROLLING_SUMMARY_MAX_MESSAGES)
+            )
+            if not new_messages:
+                return
+            last_message_timestamp = max(message["timestamp"] for message in new_messages)
+            if current is not None:
+                last_message_timestamp = max(last_message_timestamp, current["last_message_timestamp"])
+            recent = [
+                message for message in recent + [{"_id": m["_id"], "timestamp": m["timestamp"]} for m in new_messages]
+                if message["timestamp"] >= last_message_timestamp - lookback
+            ]
+            last_message_id = new_messages[-1]["_id"]
+            for message in new_messages:
+                del message["_id"]
+
+            summary = await fold_into_summary(current["summary"] if current else None, new_messages)
+            version = {
+                "last_message_timestamp": current["last_message_timestamp"] if current else None,
+                "last_message_id": current.get("last_message_id") if current else None,
+            }
+            try:
+                result = conversation_summaries.update_one(
+                    {"user_id": user_id, "conversation_id": conversation_id, **version},
+                    {
+                        "$set": {
+                            "summary": summary,
+                            "last_message_timestamp": last_message_timestamp,
+                            "last_message_id": last_message_id,
+                            "recent_messages": recent,
+                            "updated_at": datetime.datetime.now(datetime.timezone.utc),
+                        },
+                        "$inc": {"message_count": len(new_messages)},
+                    },
+                    upsert=current is None,
+                )
+            except pymongo.errors.DuplicateKeyError:
+                # Another process created the summary first
+                return
+            if current is not None and result.matched_count == 0:
+                # Another process advanced the version; it will have covered these messages
+                return
+            # Cached retrieval results may embed the previous summary
+            invalidate_user(user_id)
+            if len(new_messages) < ROLLING_SUMMARY_MAX_MESSAGES:
+                return
+
+
+async def _run_summary_updates(key):
+    try:
+        while True:
+            _dirty.discard(key)
+            try:
+                await update_rolling_summary(*key)
+            except Exception as e:
+                logger.error("Error updating rolling summary for conversation %s: %s", key[1], e)
+                return
+            if key not in _dirty:
+                return
+    finally:
+        _in_flight.discard(key)
+        _dirty.discard(key)
+
+
+def schedule_summary_update(user_id, conversation_id):
+    """
+    Refresh the rolling summary of a conversation in the background.
+
+    Messages arriving while an update is running for the same conversation are coalesced into a single
+    follow-up update instead of one LLM call each.
+    """
+    key = (user_id, conversation_id)
+    if key in _in_flight:
+        _dirty.add(key)
+        return
+    _in_flight.add(key)
+    task = asyncio.create_task(_run_summary_updates(key))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def get_rolling_summary(user_id, conversation_id):
+    """Return the stored summary of a conversation, or None if none has been computed yet"""
+    try:
+        with user_session(user_id):
+            return for_reads(conversation_summaries, "summary").find_one(
+                {"user_id": user_id, "conversation_id": conversation_id},
+                projection={"_id": 0, "summary": 1, "last_message_timestamp": 1, "message_count": 1},
+            )
+    except Exception as error:
+        logger.error("%s", error)
+        raise
+
+
+async def get_rolling_summaries(keys):
+    """Stored summaries of several (user_id, conversation_id) pairs in one query, keyed by pair"""
+    if not keys:
+        return {}
+    user_ids = {user_id for user_id, _ in keys}
+    try:
+        with user_session(user_ids.pop() if len(user_ids) == 1 else None):
+            cursor = for_reads(conversation_summaries, "summary").find(
+                {"$or": [{"user_id": user_id, "conversation_id": conversation_id} for user_id, conversation_id in keys]},
+                projection={
+                    "_id": 0, "user_id": 1, "conversation_id": 1,
+                    "summary": 1, "last_message_timestamp": 1, "message_count": 1,
+                },
+            )
+            return {(doc.pop("user_id"), doc.pop("conversation_id")): doc for doc in cursor}
+    except Exception as error:
+        logger.error("%s", error)
+        raise
@@ -0,0 +1,42 @@
+import argparse
+import json
+import sys
+
+import config
+from services.snapshot_service import restore_snapshot, snapshot_user
+from utils.snapshot_format import ENCODINGS
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Copy a user's conversations and memories between deployments: `create` writes them to a compact "
+            "snapshot file (vectors as float16 or int8), `restore` loads one into this deployment."
+        )
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="Write a snapshot of one user")
+    create.add_argument("user_id")
+    create.add_argument("--output", "-o", default="-", help="Snapshot file (default: stdout)")
+    create.add_argument("--encoding", choices=ENCODINGS, default=config.SNAPSHOT_VECTOR_ENCODING)
+    create.add_argument("--batch-size", type=int, default=config.SNAPSHOT_BATCH_SIZE, help="Documents per frame")
+    restore = commands.add_parser("restore", help="Load a snapshot; documents that already exist are skipped")
+    restore.add_argument("input", help="Snapshot file (- for stdin)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "create":
+        output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+        with output:
+            for chunk in snapshot_user(args.user_id, args.encoding, args.batch_size):
+                output.write(chunk)
+    else:
+        source = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+        with source:
+            print(json.dumps(restore_snapshot(source), indent=2))
+
+
+if __name__ == "__main__":
+    main()
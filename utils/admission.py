@@ -0,0 +1,145 @@
+import math
+import time
+import asyncio
+import contextlib
+from collections import deque
+import config
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed; `retry_after` is the number of seconds the client should wait"""
+
+    def __init__(self, pool, reason, retry_after):
+        super().__init__(f"{pool} requests over capacity ({reason})")
+        self.pool = pool
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionPool:
+    """
+    Concurrency limit for one class of requests in this process. At most `max_concurrent` requests run
+    at once; when all slots are taken, up to `max_queue` more wait in arrival order, each for at most
+    `max_wait` seconds. A user may hold at most `max_per_user` running or waiting requests, so a single
+    tenant cannot fill the pool. Anything beyond that is rejected at once rather than left to time out.
+    Runs on the event loop only, so no locking is needed.
+    """
+
+    def __init__(self, name, max_concurrent, max_per_user, max_queue, max_wait):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.running = 0
+        self._per_user = {}
+        self._waiters = deque()
+        # Moving average of how long admitted requests hold their slot
+        self._mean_seconds = None
+        self._counts = {"admitted": 0, "waited": 0, "rejected_user": 0, "rejected_queue": 0, "rejected_wait": 0}
+
+    def retry_after(self):
+        """Whole seconds until a slot is likely to be free: the queue draining at the recent service rate"""
+        mean = self._mean_seconds if self._mean_seconds is not None else 1.0
+        return max(1, math.ceil(mean * (len(self._waiters) + 1) / self.max_concurrent))
+
+    def _reject(self, reason, retry_after=None):
+        self._counts[f"rejected_{reason}"] += 1
+        return AdmissionRejected(self.name, reason, retry_after or self.retry_after())
+
+    def _hold(self, user_id):
+        if user_id is not None:
+            self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+
+    def _unhold(self, user_id):
+        if user_id is not None:
+            remaining = self._per_user[user_id] - 1
+            if remaining:
+                self._per_user[user_id] = remaining
+            else:
+                del self._per_user[user_id]
+
+    def _free_slot(self):
+        """Hand a freed slot to the longest waiting request, if any"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+    async def acquire(self, user_id=None):
+        """Take a slot, waiting in the queue when the pool is full. Raises AdmissionRejected"""
+        if user_id is not None and self._per_user.get(user_id, 0) >= self.max_per_user:
+            mean = self._mean_seconds if self._mean_seconds is not None else 1.0
+            raise self._reject("user", max(1, math.ceil(mean)))
+        if self.running < self.max_concurrent and not self._waiters:
+            self.running += 1
+            self._hold(user_id)
+            self._counts["admitted"] += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject("queue")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._hold(user_id)
+        self._counts["waited"] += 1
+        try:
+            await asyncio.wait({waiter}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            # The client went away while waiting; give back the slot if it was handed over meanwhile
+            if waiter.done() and not waiter.cancelled():
+                self._free_slot()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            self._unhold(user_id)
+            raise
+        if not waiter.done():
+            waiter.cancel()
+            self._waiters.remove(waiter)
+            self._unhold(user_id)
+            raise self._reject("wait")
+        self._counts["admitted"] += 1
+
+    def release(self, user_id=None, seconds=None):
+        if seconds is not None:
+            self._mean_seconds = seconds if self._mean_seconds is None else 0.9 * self._mean_seconds + 0.1 * seconds
+        self._unhold(user_id)
+        self._free_slot()
+
+    @contextlib.asynccontextmanager
+    async def admit(self, user_id=None):
+        """Run the enclosed block in a slot of the pool; a no-op with ADMISSION_CONTROL_ENABLED off"""
+        if not config.ADMISSION_CONTROL_ENABLED:
+            yield
+            return
+        await self.acquire(user_id)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(user_id, time.monotonic() - started)
+
+    def snapshot(self):
+        return {
+            "running": self.running,
+            "queued": sum(not waiter.done() for waiter in self._waiters),
+            "users": len(self._per_user),
+            "max_concurrent": self.max_concurrent,
+            "max_per_user": self.max_per_user,
+            "max_queue": self.max_queue,
+            "mean_seconds": round(self._mean_seconds, 4) if self._mean_seconds is not None else None,
+            **self._counts,
+        }
+
+
+# Separate pools, so a burst of ingestion cannot take the slots reads need
+ingest_admission = AdmissionPool(
+    "ingest", config.INGEST_MAX_CONCURRENT, config.INGEST_MAX_PER_USER, config.INGEST_MAX_QUEUE,
+    config.ADMISSION_MAX_WAIT_SECONDS,
+)
+retrieve_admission = AdmissionPool(
+    "retrieve", config.RETRIEVE_MAX_CONCURRENT, config.RETRIEVE_MAX_PER_USER, config.RETRIEVE_MAX_QUEUE,
+    config.ADMISSION_MAX_WAIT_SECONDS,
+)
@@ -0,0 +1,21 @@
+import time
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage cannot complete within the remaining request budget"""
+
+
+class Deadline:
+    """Latency budget of a request, shared by all of its stages"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """Seconds left in the budget, never negative"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
@@ -2,7 +2,9 @@ import traceback
 from typing import Dict, Any
 from fastapi import HTTPException
 import config
-from utils.logger import logger
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 def format_error_response(error: Exception) -> Dict[str, Any]:
     """
@@ -15,7 +17,7 @@ def format_error_response(error: Exception) -> Dict[str, Any]:
         Dict: A standardized error response
     """
     error_detail = str(error)
-    logger.error(f"Error: {error_detail}")
+    logger.error("Error: %s", error_detail)
     
     response = {
         "success": False,
@@ -42,7 +44,6 @@ def handle_exception(error: Exception) -> Dict[str, Any]:
         # Pass through HTTP exceptions
         raise error
     
-    logger.error(f"Exception: {str(error)}")
-    logger.error(traceback.format_exc())
+    logger.error("Exception: %s", error, exc_info=error)
     
     return format_error_response(error)
\ No newline at end of file
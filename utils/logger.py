@@ -1,22 +1,179 @@
 import sys
-import config
-import asyncio
-import logging
-import os
+import json
 import time
-import inspect
-import functools
-from contextlib import contextmanager
-from httpx import AsyncClient, Client, HTTPStatusError
-from datetime import datetime, timezone
-
-def get_logger():
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            stream=sys.stdout
-        )
-        return logging.getLogger(config.APP_NAME)
+import queue
+import atexit
+import random
+import logging
+import datetime
+import threading
+import logging.handlers
+import config
+
+# Attributes every LogRecord has; anything else was passed through `extra` and is output as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _parse_table(spec):
+    """Parse a "name=value,name=value" setting into a dict of floats"""
+    table = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        table[name.strip()] = float(value)
+    return table
+
+
+def _lookup(table, logger_name):
+    """Value of the longest table entry naming `logger_name` or one of its ancestors, falling back to "*" """
+    best, best_length = table.get("*"), -1
+    for name, value in table.items():
+        for candidate in (name, f"{config.APP_NAME}.{name}"):
+            if (logger_name == candidate or logger_name.startswith(candidate + ".")) and len(candidate) > best_length:
+                best, best_length = value, len(candidate)
+    return best
+
+
+def _truncate(text, limit):
+    if limit and len(text) > limit:
+        return f"{text[:limit]}... [{len(text) - limit} more characters]"
+    return text
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a configured fraction of each logger's records below WARNING"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = _lookup(self.rates, record.name)
+        return rate is None or random.random() < rate
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per logger allowing a configured number of records per second. The next record let
+    through reports how many were suppressed in between.
+    """
+
+    def __init__(self, limits):
+        super().__init__()
+        self.limits = limits
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        limit = _lookup(self.limits, record.name)
+        if limit is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, suppressed = self._buckets.get(record.name, (limit, now, 0))
+            tokens = min(limit, tokens + (now - updated) * limit)
+            if tokens < 1:
+                self._buckets[record.name] = (tokens, now, suppressed + 1)
+                return False
+            self._buckets[record.name] = (tokens - 1, now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """Plain text lines with messages and tracebacks truncated to LOG_MAX_MESSAGE_LENGTH"""
+
+    def formatMessage(self, record):
+        record.message = _truncate(record.message, config.LOG_MAX_MESSAGE_LENGTH)
+        line = super().formatMessage(record)
+        if getattr(record, "suppressed", 0):
+            line += f" ({record.suppressed} records suppressed)"
+        if getattr(record, "dropped", 0):
+            line += f" ({record.dropped} records dropped, log queue full)"
+        return line
+
+    def formatException(self, exc_info):
+        return _truncate(super().formatException(exc_info), config.LOG_MAX_MESSAGE_LENGTH * 4)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including fields passed through `extra`"""
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": _truncate(record.getMessage(), config.LOG_MAX_MESSAGE_LENGTH),
+            "module": record.module,
+            "line": record.lineno,
+        }
+        if record.exc_info:
+            entry["exception"] = _truncate(self.formatException(record.exc_info), config.LOG_MAX_MESSAGE_LENGTH * 4)
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else repr(value)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that leaves formatting to the listener thread. The stdlib handler formats every
+    record on the calling thread because records may be pickled to another process; an in-process
+    queue can carry the record (and its arguments) as is. A full queue drops records instead of
+    blocking the caller.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if self.dropped:
+            record.dropped, self.dropped = self.dropped, 0
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1 + getattr(record, "dropped", 0)
+
+
+def _configure():
+    """Route all logging through the configured filters and a background writer to stdout"""
+    output = logging.StreamHandler(sys.stdout)
+    if config.LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(TextFormatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    if config.LOG_ASYNC:
+        log_queue = queue.Queue(config.LOG_QUEUE_SIZE)
+        handler = DeferredQueueHandler(log_queue)
+        listener = logging.handlers.QueueListener(log_queue, output)
+        listener.start()
+        # Flush queued records on interpreter exit
+        atexit.register(listener.stop)
+    else:
+        handler = output
+    handler.addFilter(SamplingFilter(_parse_table(config.LOG_SAMPLE_RATES)))
+    handler.addFilter(RateLimitFilter(_parse_table(config.LOG_RATE_LIMITS)))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(config.LOG_LEVEL)
+    return output
+
+
+# The handler writing to stdout, e.g. to redirect output elsewhere
+output_handler = _configure()
+
+
+def get_logger(name=None):
+    """Logger of a module, named below the application logger so that per-logger settings apply"""
+    return logging.getLogger(f"{config.APP_NAME}.{name}" if name else config.APP_NAME)
+
 
 # Export logger
-logger = get_logger()
\ No newline at end of file
+logger = get_logger()
@@ -0,0 +1,266 @@
+import os
+import sys
+import hmac
+import time
+import uuid
+import random
+import asyncio
+import datetime
+import threading
+import contextvars
+import concurrent.futures
+import weakref
+from collections import deque
+import config
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Profile of the request being handled in the current context, inherited by the tasks it spawns
+_current_profile = contextvars.ContextVar("current_profile", default=None)
+MAX_STACK_DEPTH = 128
+
+
+class Profile:
+    """Statistical profile of one request: sampled stacks with the number of times each was seen"""
+
+    def __init__(self, method, path):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.started = time.monotonic()
+        self.finished = None
+        self.status_code = None
+        self.stacks = {}
+        self.loop_samples = 0
+        self.thread_samples = 0
+
+    def add(self, stack):
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def collapsed(self):
+        """Stacks in the collapsed format read by flamegraph.pl and speedscope"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def summary(self, interval_ms):
+        wall_ms = ((self.finished or time.monotonic()) - self.started) * 1000
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status_code": self.status_code,
+            "started_at": self.started_at.isoformat(),
+            "wall_ms": round(wall_ms, 1),
+            # While the request's code runs on the event loop thread, no other request can make progress
+            "loop_blocked_ms": round(self.loop_samples * interval_ms, 1),
+            "worker_thread_ms": round(self.thread_samples * interval_ms, 1),
+            "samples": self.loop_samples + self.thread_samples,
+        }
+
+
+class _AttributingExecutor(concurrent.futures.ThreadPoolExecutor):
+    """Default executor that lets the sampler attribute worker threads (asyncio.to_thread) to profiles"""
+
+    def submit(self, fn, /, *args, **kwargs):
+        profile = _current_profile.get()
+        if profile is None:
+            return super().submit(fn, *args, **kwargs)
+        return super().submit(_run_attributed, profile, fn, *args, **kwargs)
+
+
+def _run_attributed(profile, fn, *args, **kwargs):
+    thread_id = threading.get_ident()
+    profiler.threads[thread_id] = profile
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.threads.pop(thread_id, None)
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the event loop thread and of worker threads while profiled requests are in
+    flight. A loop sample is attributed to a request when the task running at that moment belongs to it,
+    i.e. when the request is blocking the event loop; worker thread samples are attributed through the
+    executor. The sampler thread sleeps while no request is being profiled.
+    """
+
+    def __init__(self, interval_ms, max_concurrent, max_seconds, max_profiles, output_dir):
+        self.interval_ms = interval_ms
+        self.max_concurrent = max_concurrent
+        self.max_seconds = max_seconds
+        self.output_dir = output_dir
+        self.recent = deque(maxlen=max_profiles)
+        self.active = set()
+        self.tasks = weakref.WeakKeyDictionary()
+        self.threads = {}
+        self.loop = None
+        self.loop_thread_id = None
+        self._labels = {}
+        self._wake = threading.Event()
+        self._thread = None
+        # Profile files are written by one thread of their own, off the event loop and in order
+        self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-writer")
+
+    def install(self, loop):
+        """Hook task creation and the default executor of the event loop serving requests"""
+        if self.loop is loop:
+            return
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        inner_factory = loop.get_task_factory()
+
+        def task_factory(loop, coro, **kwargs):
+            if inner_factory is None:
+                task = asyncio.Task(coro, loop=loop, **kwargs)
+            else:
+                task = inner_factory(loop, coro, **kwargs)
+            profile = _current_profile.get()
+            if profile is not None:
+                self.tasks[task] = profile
+            return task
+
+        loop.set_task_factory(task_factory)
+        loop.set_default_executor(_AttributingExecutor(thread_name_prefix="asyncio"))
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+            self._thread.start()
+
+    def start(self, method, path):
+        """Begin profiling the current request, or return None when at the concurrency limit"""
+        if len(self.active) >= self.max_concurrent:
+            return None
+        profile = Profile(method, path)
+        self.tasks[asyncio.current_task()] = profile
+        self.active.add(profile)
+        self._wake.set()
+        return profile
+
+    def stop(self, profile):
+        profile.finished = time.monotonic()
+        self.active.discard(profile)
+        self.recent.append(profile)
+        if self.output_dir:
+            self._writer.submit(self._write, profile)
+
+    def get(self, profile_id):
+        return next((profile for profile in self.recent if profile.id == profile_id), None)
+
+    def merged(self, path=None):
+        """Collapsed stacks of all recent profiles (of one path, when given) added together"""
+        merged = Profile("*", path or "*")
+        for profile in self.recent:
+            if path in (None, profile.path):
+                for stack, count in profile.stacks.items():
+                    merged.stacks[stack] = merged.stacks.get(stack, 0) + count
+        return merged.collapsed()
+
+    def _write(self, profile):
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            slug = profile.path.strip("/").replace("/", "_") or "root"
+            name = f"{profile.started_at:%Y%m%dT%H%M%S}-{profile.method.lower()}-{slug}-{profile.id}.collapsed"
+            with open(os.path.join(self.output_dir, name), "w") as file:
+                file.write(profile.collapsed())
+            files = sorted(entry for entry in os.listdir(self.output_dir) if entry.endswith(".collapsed"))
+            for old in files[:-self.recent.maxlen]:
+                os.remove(os.path.join(self.output_dir, old))
+        except OSError as e:
+            logger.error("Could not write profile %s: %s", profile.id, e)
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _stack(self, frame, root):
+        labels = []
+        while frame is not None and len(labels) < MAX_STACK_DEPTH:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        labels.append(root)
+        return tuple(reversed(labels))
+
+    def _run(self):
+        interval = self.interval_ms / 1000
+        while True:
+            if not self.active:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            time.sleep(interval)
+            try:
+                self._sample()
+            except Exception as e:  # The sampler must never take the process down
+                logger.error("Profiler sample failed: %s", e)
+
+    def _sample(self):
+        now = time.monotonic()
+        for profile in list(self.active):
+            if now - profile.started > self.max_seconds:
+                self.active.discard(profile)
+        if not self.active:
+            return
+        frames = sys._current_frames()
+        task = asyncio.current_task(self.loop)
+        profile = self.tasks.get(task) if task is not None else None
+        if profile in self.active and self.loop_thread_id in frames:
+            profile.add(self._stack(frames[self.loop_thread_id], "[event loop]"))
+            profile.loop_samples += 1
+        for thread_id, profile in list(self.threads.items()):
+            if profile in self.active and thread_id in frames:
+                profile.add(self._stack(frames[thread_id], "[worker thread]"))
+                profile.thread_samples += 1
+
+
+profiler = SamplingProfiler(
+    config.PROFILING_INTERVAL_MS,
+    config.PROFILING_MAX_CONCURRENT,
+    config.PROFILING_MAX_SECONDS,
+    config.PROFILING_MAX_PROFILES,
+    config.PROFILING_OUTPUT_DIR,
+)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling PROFILING_SAMPLE_RATE of HTTP requests, and requests carrying an
+    `X-Profile` header equal to ADMIN_TOKEN. Profiled responses carry an `X-Profile-Id` header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _wanted(self, scope):
+        if config.ADMIN_TOKEN:
+            for name, value in scope.get("headers", []):
+                if name == b"x-profile":
+                    return hmac.compare_digest(value, config.ADMIN_TOKEN.encode())
+        return random.random() < config.PROFILING_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (config.PROFILING_SAMPLE_RATE > 0 or config.ADMIN_TOKEN):
+            return await self.app(scope, receive, send)
+        # Installed before the first request runs anything in the default executor
+        profiler.install(asyncio.get_running_loop())
+        if scope["path"].startswith("/admin/") or not self._wanted(scope):
+            return await self.app(scope, receive, send)
+        profile = profiler.start(scope["method"], scope["path"])
+        if profile is None:
+            return await self.app(scope, receive, send)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]}
+            await send(message)
+
+        token = _current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _current_profile.reset(token)
+            profiler.stop(profile)
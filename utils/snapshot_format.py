@@ -0,0 +1,97 @@
+import struct
+import zlib
+import bson
+import numpy as np
+
+# Start of every snapshot: format name and version
+MAGIC = b"AMSNAP\x00\x01"
+# Frames are a 4-byte big-endian length followed by that many bytes of zlib-compressed BSON
+_LENGTH = struct.Struct(">I")
+_SCALE = struct.Struct("<f")
+# Largest frame, compressed or decompressed: a longer length prefix is rejected before its bytes are
+# buffered, so a corrupt or hostile length cannot exhaust memory
+MAX_FRAME_BYTES = 256 * 1024 * 1024
+ENCODINGS = ("float16", "int8")
+
+
+def encode_vector(vector, encoding):
+    """
+    Compact bytes of a vector: little-endian float16 values, or for int8 a float32 scale followed by the
+    values divided by it and rounded, the scale mapping the largest magnitude to 127
+    """
+    array = np.asarray(vector, dtype=np.float32)
+    if encoding == "float16":
+        return array.astype("<f2").tobytes()
+    if encoding == "int8":
+        peak = float(np.max(np.abs(array))) if array.size else 0.0
+        scale = peak / 127 if peak > 0 else 1.0
+        return _SCALE.pack(scale) + np.rint(array / scale).astype(np.int8).tobytes()
+    raise ValueError(f"Unknown vector encoding {encoding!r}, expected one of {ENCODINGS}")
+
+
+def decode_vector(data, encoding):
+    """Vector written by `encode_vector`, as the list of floats stored in MongoDB"""
+    if encoding == "float16":
+        array = np.frombuffer(data, dtype="<f2")
+    elif encoding == "int8":
+        (scale,) = _SCALE.unpack_from(data)
+        array = np.frombuffer(data, dtype=np.int8, offset=_SCALE.size) * np.float32(scale)
+    else:
+        raise ValueError(f"Unknown vector encoding {encoding!r}, expected one of {ENCODINGS}")
+    return array.astype(np.float32).tolist()
+
+
+def encode_frame(payload, level=6):
+    """One length-prefixed frame holding a document"""
+    data = zlib.compress(bson.encode(payload), level)
+    return _LENGTH.pack(len(data)) + data
+
+
+class FrameReader:
+    """
+    Incremental decoder of a snapshot: bytes are fed in chunks of any size as they arrive, and each
+    complete frame is returned as soon as its last byte is in
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._started = False
+
+    def feed(self, chunk):
+        """Documents of the frames completed by `chunk`"""
+        self._buffer += chunk
+        if not self._started:
+            if len(self._buffer) < len(MAGIC):
+                return []
+            if bytes(self._buffer[:len(MAGIC)]) != MAGIC:
+                raise ValueError("Not a memory snapshot")
+            del self._buffer[:len(MAGIC)]
+            self._started = True
+        frames = []
+        while len(self._buffer) >= _LENGTH.size:
+            (length,) = _LENGTH.unpack_from(self._buffer)
+            if length > MAX_FRAME_BYTES:
+                raise ValueError(f"Snapshot frame larger than {MAX_FRAME_BYTES} bytes")
+            end = _LENGTH.size + length
+            if len(self._buffer) < end:
+                break
+            decompressor = zlib.decompressobj()
+            data = decompressor.decompress(bytes(self._buffer[_LENGTH.size:end]), MAX_FRAME_BYTES)
+            if decompressor.unconsumed_tail:
+                raise ValueError(f"Snapshot frame larger than {MAX_FRAME_BYTES} bytes")
+            frames.append(bson.decode(data))
+            del self._buffer[:end]
+        return frames
+
+    def close(self):
+        """Check that the input ended on a frame boundary"""
+        if not self._started or self._buffer:
+            raise ValueError("Snapshot is truncated")
+
+
+def read_frames(stream, chunk_size=1 << 16):
+    """Documents of the frames of a binary file object, read `chunk_size` bytes at a time"""
+    reader = FrameReader()
+    while chunk := stream.read(chunk_size):
+        yield from reader.feed(chunk)
+    reader.close()
@@ -0,0 +1,64 @@
+import numpy as np
+
+DTYPE = np.float32
+# Vectors shorter than this are treated as zero instead of being blown up by normalization
+_EPSILON = 1e-12
+
+
+def to_array(vectors) -> np.ndarray:
+    """Vector or stack of vectors as a C-contiguous float32 array, without copying when it already is one"""
+    return np.ascontiguousarray(vectors, dtype=DTYPE)
+
+
+def to_unit(vectors) -> np.ndarray:
+    """
+    Unit-length float32 copy of a vector (1-D) or of each row of a matrix (2-D). Zero vectors stay zero.
+    With unit vectors, cosine similarity is a plain dot product.
+    """
+    array = np.array(vectors, dtype=DTYPE, order="C", copy=True)
+    norms = np.linalg.norm(array, axis=-1, keepdims=True)
+    array /= np.maximum(norms, _EPSILON)
+    return array
+
+
+def to_list(vector) -> list:
+    """Vector as a list of Python floats, the form stored in MongoDB"""
+    return np.asarray(vector, dtype=DTYPE).tolist()
+
+
+def normalize_embedding(embedding) -> list:
+    """Normalize an embedding once, before it is written, so readers can skip recomputing norms"""
+    return to_list(to_unit(embedding))
+
+
+def one_to_many(query: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    """Similarity of one unit vector to each row of a matrix of unit vectors"""
+    if len(matrix) == 0:
+        return np.empty(0, dtype=DTYPE)
+    return matrix @ query
+
+
+def many_to_many(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """Pairwise similarities of the rows of two matrices of unit vectors, shape (len(left), len(right))"""
+    return left @ right.T
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the `k` highest scores, highest first, in O(n) plus sorting the k selected"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    selected = np.argpartition(-scores, k - 1)[:k]
+    return selected[np.argsort(-scores[selected], kind="stable")]
+
+
+def vector_sum(vectors) -> np.ndarray:
+    """Sum of a stack of vectors, accumulated in float64 to keep running sums exact enough"""
+    return np.asarray(vectors, dtype=np.float64).sum(axis=0)
+
+
+def centroid(vectors, weights=None, normalize=False) -> np.ndarray:
+    """(Weighted) mean of a stack of vectors, optionally scaled back to unit length"""
+    matrix = np.asarray(vectors, dtype=np.float64)
+    mean = np.average(matrix, axis=0, weights=weights)
+    return to_unit(mean) if normalize else mean.astype(DTYPE)
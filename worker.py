@@ -0,0 +1,33 @@
+import argparse
+import asyncio
+import signal
+
+import config
+from services.ingest_worker_service import IngestWorker
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Embed new conversation messages and consolidate them into memories by tailing the conversations "
+            "change stream. Used with INGEST_MODE=worker; run one process per partition to scale out."
+        )
+    )
+    parser.add_argument("--partition", type=int, default=0, help="Partition of the users handled by this worker")
+    parser.add_argument("--partitions", type=int, default=1, help="Total number of partitions (worker processes)")
+    parser.add_argument(
+        "--concurrency", type=int, default=config.INGEST_WORKER_CONCURRENCY, help="Messages enriched at once"
+    )
+    return parser.parse_args()
+
+
+async def run(args):
+    worker = IngestWorker(args.partition, args.partitions, args.concurrency)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    await worker.run()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))